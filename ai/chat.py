@@ -1,21 +1,33 @@
 import asyncio
 import logging
 import os
+import time
 from typing import Optional
 from discord.ext import commands
 from discord import app_commands
 import discord
-from openai import OpenAI
 from database import SessionLocal, GuildConfig
-
-ai_token = os.getenv("AI_TOKEN")
+from config_cache import config_cache
+from cogs.message_pipeline import message_stage, MessageContext, AI
+from metrics import ai_in_flight, ai_latency
+from executors import ExecutorBusy, ExecutorTimeout, run_in
 
 client = None
-if ai_token:
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=ai_token,
-    )
+
+
+def _get_client():
+    """OpenAI client for the current AI_TOKEN, or None; openai is only imported once a token is set."""
+    global client
+    ai_token = os.getenv("AI_TOKEN")
+    if not ai_token:
+        return None
+    if client is None or client.api_key != ai_token:
+        from openai import OpenAI
+        client = OpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=ai_token,
+        )
+    return client
 
 conversation_history = {}
 
@@ -23,13 +35,9 @@ conversation_history = {}
 def _get_msg(guild_id: int | None, key: str, **kwargs) -> str:
     lang = "ru"
     if guild_id:
-        session = SessionLocal()
-        try:
-            config = session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-            if config and config.language:
-                lang = str(config.language)
-        finally:
-            session.close()
+        config = config_cache.get(GuildConfig, guild_id)
+        if config and config.language:
+            lang = str(config.language)
     messages = {
         "ru": {
             "ai_disabled": "❌ AI модуль отключён на этом сервере.",
@@ -97,14 +105,8 @@ def _get_conversation_key(channel_id: int, guild_id: int | None = None) -> str:
 _ai_cleanup_counter = 0
 
 async def _get_ai_response(conv_key: str, message_text: str) -> str | None:
-    global client, _ai_cleanup_counter
-    ai_token = os.getenv("AI_TOKEN")
-    if ai_token and (not client or client.api_key != ai_token):
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=ai_token,
-        )
-    if not client or not client.api_key:
+    global _ai_cleanup_counter
+    if not os.getenv("AI_TOKEN"):
         return None
 
     _ai_cleanup_counter += 1
@@ -127,12 +129,22 @@ async def _get_ai_response(conv_key: str, message_text: str) -> str | None:
 
     try:
         def get_completion():
-            return client.chat.completions.create(
+            # on the ai executor, so the first call's openai import stays off the event loop
+            return _get_client().chat.completions.create(
                 model="nvidia/nemotron-3-nano-30b-a3b:free",
                 messages=conversation_history[conv_key],
                 extra_body={"reasoning": {"enabled": True}}
             )
-        response = await asyncio.get_event_loop().run_in_executor(None, get_completion)
+        ai_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            response = await run_in("ai", get_completion)
+        except Exception:
+            ai_latency.observe(time.perf_counter() - started, "error")
+            raise
+        finally:
+            ai_in_flight.dec()
+        ai_latency.observe(time.perf_counter() - started, "ok")
         assistant_msg = response.choices[0].message
         content = assistant_msg.content
         reasoning = getattr(assistant_msg, 'reasoning_details', None)
@@ -142,6 +154,10 @@ async def _get_ai_response(conv_key: str, message_text: str) -> str | None:
             history_entry["reasoning_details"] = reasoning
         conversation_history[conv_key].append(history_entry)
         return content
+    except ExecutorBusy:
+        return "⏳ ИИ сейчас перегружен, попробуйте через минуту."
+    except ExecutorTimeout:
+        return "⏳ ИИ не ответил вовремя, попробуйте ещё раз."
     except Exception as e:
         logging.error(f"AI API error: {e}")
         return f"❌ Ошибка API: {str(e)}"
@@ -176,11 +192,7 @@ class AIChat(commands.Cog):
     def _get_config(self, guild_id: int | None):
         if not guild_id:
             return None
-        session = SessionLocal()
-        try:
-            return session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-        finally:
-            session.close()
+        return config_cache.get(GuildConfig, guild_id)
 
     def _can_respond_in_channel(self, guild_id: int, channel_id: int) -> bool:
         config = self._get_config(guild_id)
@@ -193,16 +205,14 @@ class AIChat(commands.Cog):
         channel_ids = [int(cid.strip()) for cid in config.ai_channel_ids.split(",") if cid.strip()]
         return channel_id in channel_ids
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot:
-            return
+    @message_stage(AI, name="ai_reply", dms=True)
+    async def ai_stage(self, ctx: MessageContext):
+        message = ctx.message
         if isinstance(message.channel, discord.DMChannel):
-            config = self._get_config(None)
             await self._handle_dm(message)
             return
 
-        guild_id = message.guild.id if message.guild else None
+        guild_id = ctx.guild_id
         if not guild_id:
             return
 
@@ -0,0 +1,91 @@
+"""
+Isolated execution for heavy report queries.
+
+Statistics commands hand a plain function to run_query(). It runs with a
+session from the read-only analytics engine (database.read_engine) on a
+small dedicated thread pool, so long aggregates never occupy the event loop,
+the default executor, or the connections the message writers use. Each
+query has a time limit, enforced both here and by the database, and the
+number of reports waiting for a worker is capped.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from database import ReadSessionLocal, ANALYTICS_QUERY_TIMEOUT_MS
+
+logger = logging.getLogger("alfheim_bot.analytics")
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "2"))
+ANALYTICS_MAX_QUEUE = int(os.getenv("ANALYTICS_MAX_QUEUE", "8"))
+
+
+class AnalyticsBusy(Exception):
+    """Too many reports are already queued."""
+
+
+class AnalyticsTimeout(Exception):
+    """The report did not finish within its time limit."""
+
+
+class AnalyticsRunner:
+    def __init__(self, session_factory=ReadSessionLocal, workers: int = ANALYTICS_WORKERS,
+                 max_queue: int = ANALYTICS_MAX_QUEUE, timeout_ms: int = ANALYTICS_QUERY_TIMEOUT_MS):
+        self.session_factory = session_factory
+        self.timeout = timeout_ms / 1000
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analytics")
+        self.in_flight = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _call(self, fn, args, kwargs):
+        session = self.session_factory()
+        try:
+            return fn(session, *args, **kwargs)
+        finally:
+            session.close()
+
+    async def run(self, fn, *args, **kwargs):
+        """Return fn(session, *args, **kwargs) computed on the analytics pool."""
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            raise AnalyticsBusy()
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        # run_in_executor does not carry context variables (e.g. the SQL handler tag) over by itself
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self.executor, context.run, self._call, fn, args, kwargs)
+        try:
+            # a small grace period lets the database-side timeout report first
+            return await asyncio.wait_for(future, timeout=self.timeout + 1)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"analytics query {fn.__name__} exceeded {self.timeout:.0f}s")
+            raise AnalyticsTimeout()
+        except Exception as e:
+            if _is_timeout_error(e):
+                self.timeouts += 1
+                logger.warning(f"analytics query {fn.__name__} cancelled by the database: {e}")
+                raise AnalyticsTimeout() from e
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _is_timeout_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in ("interrupted", "statement timeout", "execution time exceeded"))
+
+
+analytics = AnalyticsRunner()
+
+
+async def run_query(fn, *args, **kwargs):
+    return await analytics.run(fn, *args, **kwargs)
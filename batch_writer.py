@@ -0,0 +1,256 @@
+"""
+Write-behind queue for high-frequency rows.
+
+Listeners enqueue inserts and keyed updates here instead of committing on
+every event. Updates to the same row are coalesced (increments are summed,
+plain values keep the latest) and everything pending is written in a single
+transaction every WRITE_BEHIND_INTERVAL_MS or once WRITE_BEHIND_MAX_ROWS
+mutations are queued.
+
+A batch the db executor refuses is put back in front of anything queued
+since. Rows the database rejects are retried one by one and the ones that
+still fail are dropped; both show up in alfheim_write_behind_failures_total.
+"""
+
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from database import SessionLocal, bulk_upsert, insert_ignore
+from executors import ExecutorTimeout, run_in
+from metrics import write_behind_failures
+
+logger = logging.getLogger("alfheim_bot.batch_writer")
+
+FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "2000"))
+MAX_PENDING_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "500"))
+
+
+class PendingUpdate:
+    __slots__ = ("model", "key", "increments", "values")
+
+    def __init__(self, model, key: dict):
+        self.model = model
+        self.key = key
+        self.increments = {}
+        self.values = {}
+
+    def merge(self, increments: dict | None, values: dict | None):
+        for col, delta in (increments or {}).items():
+            self.increments[col] = self.increments.get(col, 0) + delta
+        if values:
+            self.values.update(values)
+
+    def signature(self) -> tuple:
+        return self.model, tuple(sorted(self.key)), tuple(sorted(self.increments)), tuple(sorted(self.values))
+
+    def row(self) -> dict:
+        return {**self.key, **self.values, **self.increments}
+
+
+class BatchWriter:
+    def __init__(self, session_factory=SessionLocal, interval_ms: int = FLUSH_INTERVAL_MS,
+                 max_rows: int = MAX_PENDING_ROWS):
+        self.session_factory = session_factory
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self._inserts = defaultdict(list)
+        self._updates = {}
+        self._inflight = {}
+        self._task = None
+        self._wakeup = None
+        self._lock = None
+        self._flush_listeners = []
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        # bumped when a batch is taken and when it lands, so readers can tell a flush overlapped them
+        self.epoch = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._inserts.values()) + len(self._updates)
+
+    def has_pending(self, model) -> bool:
+        return bool(self._inserts.get(model)) or any(u.model is model for u in self._updates.values())
+
+    def insert(self, model, **values):
+        self._inserts[model].append(values)
+        self._enqueued()
+
+    def update(self, model, key: dict, increments: dict | None = None, values: dict | None = None):
+        """Queue an update of the row matching key, creating it if it does not exist yet.
+        The key columns must be covered by a unique index on the table.
+        """
+        map_key = (model, tuple(sorted(key.items())))
+        pending = self._updates.get(map_key)
+        if pending is None:
+            pending = self._updates[map_key] = PendingUpdate(model, dict(key))
+        pending.merge(increments, values)
+        self._enqueued()
+
+    def pending_increments(self, model, **key) -> dict:
+        """Increments not yet visible in the database, including a batch being written right now."""
+        map_key = (model, tuple(sorted(key.items())))
+        totals = {}
+        for source in (self._inflight, self._updates):
+            pending = source.get(map_key)
+            if pending:
+                for col, delta in pending.increments.items():
+                    totals[col] = totals.get(col, 0) + delta
+        return totals
+
+    def add_flush_listener(self, listener):
+        """Call listener(batch) after every flush, where batch maps each model to the rows
+        just written (inserted values, or key plus updated columns); usable as a decorator.
+        """
+        self._flush_listeners.append(listener)
+        return listener
+
+    def remove_flush_listener(self, listener):
+        if listener in self._flush_listeners:
+            self._flush_listeners.remove(listener)
+
+    def _notify(self, inserts: dict, updates: list):
+        if not self._flush_listeners:
+            return
+        batch = defaultdict(list)
+        for model, rows in inserts.items():
+            batch[model].extend(rows)
+        for pending in updates:
+            batch[pending.model].append(pending.row())
+        for listener in list(self._flush_listeners):
+            try:
+                listener(batch)
+            except Exception as e:
+                logger.error(f"flush listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+    def _enqueued(self):
+        self._ensure_task()
+        if self.pending >= self.max_rows:
+            self._wakeup.set()
+
+    def _ensure_task(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._lock = self._lock or asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"write-behind flush failed: {e}")
+
+    async def flush(self) -> int:
+        """Write everything queued so far; returns the number of mutations written."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            inserts, self._inflight = self._inserts, self._updates
+            if not inserts and not self._inflight:
+                return 0
+            self._inserts, self._updates = defaultdict(list), {}
+            self.epoch += 1
+            updates = list(self._inflight.values())
+            try:
+                written = await run_in("db", self._write, inserts, updates)
+            except ExecutorTimeout:
+                # the write carries on in its thread; queueing it again would apply increments twice
+                raise
+            except Exception:
+                self._requeue(inserts, self._inflight)
+                raise
+            finally:
+                self._inflight = {}
+                self.epoch += 1
+            self.flushes += 1
+            self.rows_written += written
+            self.rows_dropped += sum(len(rows) for rows in inserts.values()) + len(updates) - written
+            self._notify(inserts, updates)
+            return written
+
+    def _requeue(self, inserts: dict, updates: dict):
+        """Put a batch that was never written back ahead of what was queued since."""
+        for model, rows in inserts.items():
+            write_behind_failures.inc(model.__tablename__, "requeued", amount=len(rows))
+            self._inserts[model] = rows + self._inserts.get(model, [])
+        for pending in updates.values():
+            write_behind_failures.inc(pending.model.__tablename__, "requeued")
+        for map_key, newer in self._updates.items():
+            pending = updates.get(map_key)
+            if pending is None:
+                updates[map_key] = newer
+            else:
+                pending.merge(newer.increments, newer.values)
+        self._updates = updates
+        logger.warning(f"write-behind flush did not run; {self.pending} rows queued again")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _write(self, inserts: dict, updates: list) -> int:
+        count = sum(len(rows) for rows in inserts.values()) + len(updates)
+        session = self.session_factory()
+        try:
+            dialect = session.get_bind().dialect.name
+            for model, rows in inserts.items():
+                session.execute(insert_ignore(model, dialect), rows)
+            self._upsert(session, updates)
+            session.commit()
+            return count
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"batch of {count} failed ({e}), retrying row by row")
+        finally:
+            session.close()
+        return self._write_each(inserts, updates)
+
+    def _write_each(self, inserts: dict, updates: list) -> int:
+        written = 0
+        items = [(model, row, None) for model, rows in inserts.items() for row in rows]
+        items += [(None, None, pending) for pending in updates]
+        for model, row, pending in items:
+            session = self.session_factory()
+            try:
+                if pending is None:
+                    session.execute(insert_ignore(model, session.get_bind().dialect.name), [row])
+                else:
+                    self._upsert(session, [pending])
+                session.commit()
+                written += 1
+            except Exception as e:
+                session.rollback()
+                table = (model or pending.model).__tablename__
+                write_behind_failures.inc(table, "dropped")
+                logger.error(f"dropping write-behind row for {table}: {e}")
+            finally:
+                session.close()
+        return written
+
+    @staticmethod
+    def _upsert(session, updates: list):
+        """One INSERT ... ON CONFLICT DO UPDATE per group of updates touching the same columns."""
+        groups = defaultdict(list)
+        for pending in updates:
+            groups[pending.signature()].append(pending.row())
+        for (model, key_columns, increment_columns, _), rows in groups.items():
+            bulk_upsert(session, model, key_columns, rows, increment_columns)
+
+
+batch_writer = BatchWriter()
@@ -5,8 +5,14 @@ import logging
 import datetime
 from discord.ext import commands, tasks
 from discord import app_commands
-from database import SessionLocal, Report, MessageLog, RaidProtection, SuspiciousJoin, GuildConfig, Warning
+from database import SessionLocal, Report, MessageLog, RaidProtection, SuspiciousJoin, GuildConfig, Warning, get_or_create
 from typing import Optional
+from batch_writer import batch_writer
+from config_cache import config_cache
+from retention import prune_all
+from executors import run_in
+from sharding import shard_filter
+from cogs.message_pipeline import message_stage, MessageContext, AUTOMOD, LOGGING
 
 logger = logging.getLogger("alfheim_bot.advanced_mod")
 
@@ -16,14 +22,15 @@ class AdvancedModeration(commands.Cog):
         self.bot = bot
         self.spam_tracker = {}
         self.join_tracker = {}
-        self._msg_log_cache = {}
         self._spam_config_cache = {}
         self.cache_cleanup.start()
         self.check_raid_protection.start()
+        self.prune_message_logs.start()
 
     def cog_unload(self):
         self.check_raid_protection.cancel()
         self.cache_cleanup.cancel()
+        self.prune_message_logs.cancel()
 
     @tasks.loop(minutes=30)
     async def cache_cleanup(self):
@@ -32,71 +39,59 @@ class AdvancedModeration(commands.Cog):
         self._spam_config_cache.clear()
 
     def _get_guild_config(self, guild_id: int):
-        if guild_id not in self._msg_log_cache:
-            session = SessionLocal()
-            try:
-                config = session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-                if config:
-                    self._msg_log_cache[guild_id] = {
-                        'log_channel_id': config.log_channel_id,
-                        'anti_spam': config.anti_spam,
-                    }
-                else:
-                    self._msg_log_cache[guild_id] = {'log_channel_id': None, 'anti_spam': False}
-            finally:
-                session.close()
-        return self._msg_log_cache[guild_id]
+        config = config_cache.get(GuildConfig, guild_id)
+        return {
+            'log_channel_id': config.log_channel_id if config else None,
+            'anti_spam': config.anti_spam if config else False,
+        }
 
     def invalidate_cache(self, guild_id: int = None):
-        if guild_id:
-            self._msg_log_cache.pop(guild_id, None)
-        else:
-            self._msg_log_cache.clear()
+        config_cache.invalidate(guild_id)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
+    @message_stage(AUTOMOD, name="anti_spam")
+    async def anti_spam_stage(self, ctx: MessageContext):
+        if not ctx.config or not ctx.config.anti_spam:
             return
-        cfg = self._get_guild_config(message.guild.id)
-        needs_log = cfg.get('log_channel_id') is not None
-
-        if needs_log:
-            attachments_data = []
-            if message.attachments:
-                attachments_data = [{"url": a.url, "filename": a.filename} for a in message.attachments]
-            session = SessionLocal()
+        message = ctx.message
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        user_key = f"{message.guild.id}_{message.author.id}"
+        if user_key not in self.spam_tracker:
+            self.spam_tracker[user_key] = []
+        self.spam_tracker[user_key] = [t for t in self.spam_tracker[user_key] if now - t < 5]
+        self.spam_tracker[user_key].append(now)
+        if len(self.spam_tracker[user_key]) > 5:
+            ctx.stop("anti_spam")
             try:
-                msg_log = MessageLog(
-                    guild_id=message.guild.id, message_id=message.id,
-                    channel_id=message.channel.id, user_id=message.author.id,
-                    content=message.content,
-                    attachments=json.dumps(attachments_data) if attachments_data else None
-                )
-                session.add(msg_log)
-                session.commit()
-            finally:
-                session.close()
-
-        if cfg.get('anti_spam'):
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            user_key = f"{message.guild.id}_{message.author.id}"
-            if user_key not in self.spam_tracker:
+                await message.delete()
+                await message.author.timeout(datetime.timedelta(minutes=5), reason="Spam detected")
+                await message.channel.send(f"⚠️ {message.author.mention} muted for spam (5m)", delete_after=5)
                 self.spam_tracker[user_key] = []
-            self.spam_tracker[user_key] = [t for t in self.spam_tracker[user_key] if now - t < 5]
-            self.spam_tracker[user_key].append(now)
-            if len(self.spam_tracker[user_key]) > 5:
-                try:
-                    await message.delete()
-                    await message.author.timeout(datetime.timedelta(minutes=5), reason="Spam detected")
-                    await message.channel.send(f"⚠️ {message.author.mention} muted for spam (5m)", delete_after=5)
-                    self.spam_tracker[user_key] = []
-                except Exception as e:
-                    logger.warning(f"Spam action failed for {message.author}: {e}")
+            except Exception as e:
+                logger.warning(f"Spam action failed for {message.author}: {e}")
+
+    @message_stage(LOGGING, name="message_log")
+    async def message_log_stage(self, ctx: MessageContext):
+        if not ctx.config or ctx.config.log_channel_id is None:
+            return
+        message = ctx.message
+        attachments_data = []
+        if message.attachments:
+            attachments_data = [{"url": a.url, "filename": a.filename} for a in message.attachments]
+        batch_writer.insert(
+            MessageLog,
+            guild_id=message.guild.id, message_id=message.id,
+            channel_id=message.channel.id, user_id=message.author.id,
+            content=message.content,
+            attachments=json.dumps(attachments_data) if attachments_data else None,
+            created_at=datetime.datetime.now(),
+        )
 
     @commands.Cog.listener()
     async def on_message_delete(self, message: discord.Message):
         if message.author.bot or not message.guild:
             return
+        if batch_writer.has_pending(MessageLog):
+            await batch_writer.flush()
         session = SessionLocal()
         try:
             msg_log = session.query(MessageLog).filter_by(message_id=message.id).first()
@@ -122,6 +117,8 @@ class AdvancedModeration(commands.Cog):
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
         if before.author.bot or not before.guild or before.content == after.content:
             return
+        if batch_writer.has_pending(MessageLog):
+            await batch_writer.flush()
         session = SessionLocal()
         try:
             msg_log = session.query(MessageLog).filter_by(message_id=before.id).first()
@@ -191,6 +188,17 @@ class AdvancedModeration(commands.Cog):
     async def before_check_raid_protection(self):
         await self.bot.wait_until_ready()
 
+    @tasks.loop(hours=1)
+    async def prune_message_logs(self):
+        try:
+            await run_in("db", prune_all, where=shard_filter(self.bot, GuildConfig.guild_id))
+        except Exception as e:
+            logger.error(f"Message log pruning failed: {e}")
+
+    @prune_message_logs.before_loop
+    async def before_prune_message_logs(self):
+        await self.bot.wait_until_ready()
+
     @app_commands.command(name="report", description="Report a user to moderators")
     async def report(self, interaction: discord.Interaction, user: discord.Member, reason: str, message_link: Optional[str] = None):
         if not interaction.guild: return
@@ -353,6 +361,26 @@ class AdvancedModeration(commands.Cog):
         finally:
             session.close()
 
+    @app_commands.command(name="log_retention", description="Configure how long message logs are kept")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(days="Days to keep message logs (0 = forever)", archive="Archive expired logs to compressed files before deleting")
+    async def log_retention(self, interaction: discord.Interaction, days: app_commands.Range[int, 0, 3650], archive: bool = False):
+        if not interaction.guild: return
+        session = SessionLocal()
+        try:
+            config, _ = get_or_create(session, GuildConfig, guild_id=interaction.guild.id)
+            config.message_log_retention_days = days
+            config.message_log_archive = archive
+            session.commit()
+        finally:
+            session.close()
+        if days == 0:
+            await interaction.response.send_message("✅ Message logs are kept forever", ephemeral=True)
+        else:
+            await interaction.response.send_message(
+                f"✅ Message logs are kept for {days} days{' and archived before deletion' if archive else ''}", ephemeral=True
+            )
+
     @app_commands.command(name="refresh_cache", description="Сбросить кэш конфигов")
     @app_commands.checks.has_permissions(administrator=True)
     async def refresh_cache(self, interaction: discord.Interaction):
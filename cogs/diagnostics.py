@@ -0,0 +1,180 @@
+import math
+import discord
+from discord.ext import commands
+from discord import app_commands
+from instrumentation import sql_stats, SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD
+from sharding import local_shards, shard_monitor
+from loop_monitor import loop_monitor, LOOP_BLOCK_MS
+from command_sync import scope_for, sync_tree
+
+
+class Diagnostics(commands.Cog):
+    """Process-wide internals; the data spans every guild, so commands are limited to the bot owner."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def _check_owner(self, interaction: discord.Interaction) -> bool:
+        if await self.bot.is_owner(interaction.user):
+            return True
+        await interaction.response.send_message("❌ Only the bot owner can use this command", ephemeral=True)
+        return False
+
+    @app_commands.command(name="db_stats", description="Show the most expensive SQL statements per handler")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.choices(sort=[
+        app_commands.Choice(name="Total time", value="total_ms"),
+        app_commands.Choice(name="Executions", value="count"),
+        app_commands.Choice(name="Slowest single run", value="max_ms"),
+        app_commands.Choice(name="N+1 flags", value="n_plus_one"),
+    ])
+    async def db_stats(self, interaction: discord.Interaction, sort: str = "total_ms",
+                       limit: app_commands.Range[int, 1, 15] = 8, reset: bool = False):
+        if not await self._check_owner(interaction): return
+        top = [s for s in sql_stats.top(limit, key=sort) if getattr(s, sort)]
+        embed = discord.Embed(title="🗄️ SQL statements", color=discord.Color.blurple())
+        if not top:
+            embed.description = "No statements recorded yet"
+        for stats in top:
+            flags = []
+            if stats.slow:
+                flags.append(f"🐢 {stats.slow} slow")
+            if stats.n_plus_one:
+                flags.append(f"🔁 N+1 x{stats.n_plus_one}")
+            embed.add_field(
+                name=f"{stats.handler}"[:256],
+                value=(
+                    f"**{stats.count:,}** runs · **{stats.total_ms:,.0f}** ms total · "
+                    f"avg {stats.avg_ms:.1f} ms · max {stats.max_ms:.0f} ms · {stats.rows:,} rows"
+                    f"{' · ' + ' · '.join(flags) if flags else ''}\n```sql\n{stats.shape[:700]}\n```"
+                )[:1024],
+                inline=False,
+            )
+        handlers = sorted(sql_stats.by_handler().items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:5]
+        if handlers:
+            embed.add_field(
+                name="Busiest handlers",
+                value="\n".join(f"`{name[:60]}` {h['count']:,} stmts, {h['total_ms']:,.0f} ms" for name, h in handlers)[:1024],
+                inline=False,
+            )
+        embed.set_footer(text=f"slow ≥ {SLOW_QUERY_MS:.0f} ms · N+1 > {N_PLUS_ONE_THRESHOLD} repeats per handler run")
+        if reset:
+            sql_stats.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="pipeline_stats", description="Show timing of the message pipeline stages")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def pipeline_stats(self, interaction: discord.Interaction):
+        if not await self._check_owner(interaction): return
+        pipeline = self.bot.get_cog("MessagePipeline")
+        if pipeline is None:
+            await interaction.response.send_message("❌ Message pipeline is not loaded", ephemeral=True); return
+        lines = []
+        for stage in pipeline.stages:
+            stats = pipeline.stage_stats.get(stage.label)
+            if stats is None:
+                lines.append(f"{stage.phase:>2} {stage.label:<32} —")
+                continue
+            lines.append(
+                f"{stage.phase:>2} {stage.label:<32} {stats.runs:>7,} runs  avg {stats.avg_ms:6.1f} ms  "
+                f"max {stats.max_ms:7.0f} ms  stops {stats.stops:,}  errors {stats.errors:,}"
+            )
+        embed = discord.Embed(
+            title="📨 Message pipeline",
+            description=f"```\n{chr(10).join(lines)[:3900]}\n```",
+            color=discord.Color.blurple(),
+        )
+        embed.set_footer(text=f"{pipeline.messages:,} messages processed")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="shards", description="Show latency, guilds and event rate per shard")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def shards(self, interaction: discord.Interaction):
+        if not await self._check_owner(interaction): return
+        count, ids = local_shards(self.bot)
+        guilds = {}
+        for guild in self.bot.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        if isinstance(self.bot, discord.AutoShardedClient):
+            latencies = dict(self.bot.latencies)
+        else:
+            latencies = {self.bot.shard_id or 0: self.bot.latency}
+        lines = []
+        for shard_id in ids or sorted(latencies):
+            latency = latencies.get(shard_id)
+            latency_text = f"{latency * 1000:6.0f} ms" if latency is not None and not math.isnan(latency) else "     — "
+            lines.append(
+                f"#{shard_id:<3} {latency_text}  {guilds.get(shard_id, 0):>6,} guilds  "
+                f"{shard_monitor.rate(shard_id):7.1f} ev/s  {shard_monitor.totals.get(shard_id, 0):>10,} events"
+            )
+        embed = discord.Embed(
+            title="🧩 Shards",
+            description=f"```\n{chr(10).join(lines)[:3900]}\n```",
+            color=discord.Color.blurple(),
+        )
+        embed.set_footer(text=f"{len(ids or latencies)} of {count or 1} shard(s) in this process · rate over the last minute")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="loop_stats", description="Show event loop lag and the handlers that block it")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.choices(sort=[
+        app_commands.Choice(name="Total blocked time", value="total_ms"),
+        app_commands.Choice(name="Occurrences", value="count"),
+        app_commands.Choice(name="Longest stall", value="max_ms"),
+    ])
+    async def loop_stats(self, interaction: discord.Interaction, sort: str = "total_ms",
+                         limit: app_commands.Range[int, 1, 10] = 5, reset: bool = False):
+        if not await self._check_owner(interaction): return
+        lag = loop_monitor.lag_summary()
+        embed = discord.Embed(
+            title="⏱️ Event loop",
+            description=(
+                f"Lag over the last {lag['samples']} samples: p50 **{lag['p50']:.1f}** ms · "
+                f"p99 **{lag['p99']:.1f}** ms · max **{lag['max']:.0f}** ms"
+            ),
+            color=discord.Color.blurple(),
+        )
+        for stats in loop_monitor.top(limit, key=sort):
+            embed.add_field(
+                name=stats.handler[:256],
+                value=(
+                    f"**{stats.count:,}** stalls · **{stats.total_ms:,.0f}** ms total · "
+                    f"avg {stats.avg_ms:.0f} ms · max {stats.max_ms:.0f} ms at `{stats.site}`"
+                    f"\n```py\n{''.join(stats.stack[-4:])[-700:]}\n```"
+                )[:1024],
+                inline=False,
+            )
+        embed.set_footer(text=f"a stall is any callback holding the loop for over {LOOP_BLOCK_MS:.0f} ms")
+        if reset:
+            loop_monitor.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="sync", description="Push application commands to Discord now")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.choices(scope=[
+        app_commands.Choice(name="Global", value="global"),
+        app_commands.Choice(name="This server (copy of the global commands)", value="guild"),
+        app_commands.Choice(name="Remove this server's copy", value="clear"),
+    ])
+    async def sync(self, interaction: discord.Interaction, scope: str = "global"):
+        if not await self._check_owner(interaction): return
+        if scope != "global" and interaction.guild is None:
+            await interaction.response.send_message("❌ Run this in a server", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        tree = self.bot.tree
+        guild = None if scope == "global" else interaction.guild
+        if scope == "guild":
+            tree.copy_global_to(guild=guild)
+        elif scope == "clear":
+            tree.clear_commands(guild=guild)
+        try:
+            synced = await sync_tree(tree, guild=guild, force=True)
+        except discord.HTTPException as e:
+            await interaction.followup.send(f"❌ Sync failed: {e}", ephemeral=True)
+            return
+        await interaction.followup.send(f"✅ Synced {synced} command(s) to {scope_for(guild)}", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Diagnostics(bot))
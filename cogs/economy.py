@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import SessionLocal, UserEconomy, ShopItem, Transaction, GuildConfig
+from database import SessionLocal, UserEconomy, ShopItem, Transaction, GuildConfig, get_or_create
 import datetime
 import random
 from typing import Optional
@@ -15,11 +15,9 @@ class Economy(commands.Cog):
         return main_get_msg(guild_id, key, **kwargs)
 
     def get_user_economy(self, session, guild_id: int, user_id: int):
-        economy = session.query(UserEconomy).filter_by(guild_id=guild_id, user_id=user_id).first()
-        if not economy:
-            economy = UserEconomy(guild_id=guild_id, user_id=user_id, balance=100, bank=0)
-            session.add(economy)
-            session.commit()
+        economy, _ = get_or_create(
+            session, UserEconomy, defaults={"balance": 100, "bank": 0}, guild_id=guild_id, user_id=user_id
+        )
         return economy
 
     @app_commands.command(name="balance", description="Check your balance")
@@ -5,6 +5,7 @@ import datetime
 from discord.ext import commands, tasks
 from discord import app_commands, ui
 from database import SessionLocal, Giveaway, GiveawayEntry, LevelConfig, UserLevel
+from sharding import shard_filter
 from typing import Optional
 
 
@@ -131,7 +132,8 @@ class Giveaways(commands.Cog):
         try:
             now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
             ended = session.query(Giveaway).filter(
-                Giveaway.ends_at <= now, Giveaway.ended == False
+                Giveaway.ends_at <= now, Giveaway.ended == False,
+                shard_filter(self.bot, Giveaway.guild_id),
             ).all()
 
             for giveaway in ended:
@@ -8,12 +8,12 @@ BOT_VERSION = "2026.6.6"
 
 CATEGORY_COMMANDS = {
     "settings": ["set_channel", "set_log_channel", "set_report_channel", "set_lang", "set_color", "config", "status", "version"],
-    "moderation": ["kick", "ban", "unban", "mute", "unmute", "warn", "warnings", "clear", "tempban", "automod_setup", "slowmode", "raid_protection", "massban", "masskick"],
+    "moderation": ["kick", "ban", "unban", "mute", "unmute", "warn", "warnings", "clear", "tempban", "automod_setup", "slowmode", "raid_protection", "massban", "masskick", "log_retention"],
     "reports": ["report", "reports", "report_resolve"],
     "economy": ["balance", "daily", "work", "transfer", "deposit", "withdraw", "shop", "buy", "leaderboard", "shop_add", "shop_remove"],
     "statistics": ["topmembers", "channelstats", "serverstats", "userstats", "activity_graph"],
     "utilities": ["remind", "reminders", "reminder_cancel", "poll", "poll_results", "serverinfo", "userinfo"],
-    "levels": ["rank", "level_config"],
+    "levels": ["rank", "levels_top", "level_config"],
     "games": ["minesweeper", "snake", "anime"],
     "giveaways": ["giveaway", "giveaway_reroll", "giveaway_end", "giveaway_list"],
     "welcome": ["welcome_setup", "welcome_test"],
@@ -22,7 +22,7 @@ CATEGORY_COMMANDS = {
     "voice": ["voice_setup"],
     "ai": ["ai ask", "ai channel", "ai toggle", "ai reset"],
     "github": ["add_user", "remove_user"],
-    "system": ["refresh_cache"],
+    "system": ["refresh_cache", "db_stats", "pipeline_stats", "shards", "loop_stats", "sync"],
 }
 
 CATEGORIES_RU = {
@@ -2,16 +2,30 @@ import discord
 import random
 import asyncio
 import math
-import time
+import os
 import logging
+from collections import OrderedDict
 from datetime import datetime, timezone
 from discord.ext import commands, tasks
 from discord import app_commands, ui
+from sqlalchemy import select, tuple_
+from analytics import run_query, AnalyticsBusy, AnalyticsTimeout
+from batch_writer import batch_writer
+from config_cache import config_cache
 from database import SessionLocal, UserLevel, LevelConfig, GuildConfig
+from executors import run_in
+from level_table import LevelTable, rewrite_levels
+from xp_engine import xp_engine
+from rank_index import rank_index
+from voice_sessions import voice_sessions, VOICE_CREDIT_INTERVAL_S
+from cogs.message_pipeline import message_stage, MessageContext, XP
 from typing import Optional
 
 logger = logging.getLogger("alfheim_bot.levels")
 
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_CACHE_GUILDS = int(os.getenv("LEADERBOARD_CACHE_GUILDS", "500"))
+
 
 def get_msg(guild_id: int, key: str, **kwargs) -> str:
     from main import get_msg as main_get_msg
@@ -78,10 +92,12 @@ class LevelFormulaModal(ui.Modal, title="🧮 Формула XP"):
                 config.level_base_xp = max(1, int(self.level_base.value))
                 config.level_multiplier = max(1.0, float(self.level_mult.value))
                 config.max_level = max(1, int(self.max_level.value))
-                session.commit()
-                await interaction.response.send_message("✅ Формула XP сохранена!", ephemeral=True)
             except ValueError:
                 await interaction.response.send_message("❌ Неверный формат чисел!", ephemeral=True)
+                return
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            changed = await apply_level_formula(session, interaction.guild_id, LevelTable.for_config(config))
+            await interaction.followup.send(f"✅ Формула XP сохранена! Уровень пересчитан у {changed} участников", ephemeral=True)
         finally:
             session.close()
 
@@ -167,126 +183,243 @@ class LevelConfigView(ui.View):
         await interaction.response.send_modal(LevelFormulaModal(self.config))
 
 
-def calc_level_xp(level: int, base_xp: int, multiplier: float) -> int:
-    return int(base_xp * (multiplier ** (level - 1)))
+# guilds whose stored levels are being rewritten for a new formula; award_xp banks XP
+# for them without changing levels, which the rewrite and the reload then settle
+_formula_changing: set[int] = set()
+
+
+async def apply_level_formula(session, guild_id: int, table: LevelTable) -> int:
+    """Commit a formula change pending in session, then re-derive every stored level in
+    the guild from total XP. Returns the number of members whose level or XP changed.
+    """
+    _formula_changing.add(guild_id)
+    try:
+        session.commit()
+        # queued level increments were worked out with the old formula
+        await batch_writer.flush()
+        changed = await run_in("db", rewrite_levels, SessionLocal.kw["bind"], lambda _: table, guild_id=guild_id)
+        xp_engine.invalidate(guild_id)
+        rank_index.invalidate(guild_id)
+        leaderboard_cache.invalidate(guild_id)
+        return changed
+    finally:
+        _formula_changing.discard(guild_id)
+
+
+def leaderboard_query(guild_id: int, after: tuple | None = None, limit: int = LEADERBOARD_PAGE_SIZE):
+    """Members ordered by (level, xp, user_id) descending, starting after the
+    (level, xp, user_id) of the previous page's last row. The seek runs on
+    ix_user_levels_leaderboard, so a deep page costs the same as the first one.
+    """
+    stmt = select(UserLevel.user_id, UserLevel.level, UserLevel.xp).where(UserLevel.guild_id == guild_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(UserLevel.level, UserLevel.xp, UserLevel.user_id) < tuple_(*after))
+    return stmt.order_by(UserLevel.level.desc(), UserLevel.xp.desc(), UserLevel.user_id.desc()).limit(limit)
+
+
+def _leaderboard_rows(session, guild_id: int, after: tuple | None, limit: int) -> list[tuple]:
+    # one row more than the page tells whether there is a next page
+    return [tuple(row) for row in session.execute(leaderboard_query(guild_id, after, limit + 1))]
+
+
+class LeaderboardCache:
+    """Rendered /levels_top pages per guild, keyed by page number and cursor.
+
+    Pages are read from the database, so they only change when batch_writer
+    flushes UserLevel rows; on_flush drops the pages of every guild in the
+    batch. A page read while its guild was invalidated is not stored.
+    """
+
+    def __init__(self, max_guilds: int = LEADERBOARD_CACHE_GUILDS):
+        self.max_guilds = max_guilds
+        self._pages: OrderedDict[int, dict] = OrderedDict()
+        self._versions: dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._pages)
+
+    def version(self, guild_id: int) -> int:
+        return self._versions.get(guild_id, 0)
+
+    def get(self, guild_id: int, key: tuple):
+        pages = self._pages.get(guild_id)
+        if pages is None:
+            return None
+        self._pages.move_to_end(guild_id)
+        return pages.get(key)
+
+    def put(self, guild_id: int, key: tuple, page, version: int):
+        if version != self.version(guild_id):
+            return
+        self._pages.setdefault(guild_id, {})[key] = page
+        self._pages.move_to_end(guild_id)
+        while len(self._pages) > self.max_guilds:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, guild_id: int | None = None):
+        guild_ids = list(self._versions) + list(self._pages) if guild_id is None else [guild_id]
+        for gid in guild_ids:
+            self._pages.pop(gid, None)
+            self._versions[gid] = self.version(gid) + 1
+
+    def on_flush(self, batch: dict):
+        for guild_id in {row.get("guild_id") for row in batch.get(UserLevel, ())}:
+            self.invalidate(guild_id)
+
+
+leaderboard_cache = LeaderboardCache()
+
+
+class LeaderboardView(ui.View):
+    def __init__(self, cog: "Levels", guild: discord.Guild, user_id: int, color: int):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.guild = guild
+        self.user_id = user_id
+        self.color = color
+        # cursor each visited page starts after; the last one is the page on screen
+        self.cursors: list[tuple | None] = [None]
+        self.next_cursor = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    async def render(self) -> discord.Embed:
+        text, self.next_cursor = await self.cog.leaderboard_page(self.guild, len(self.cursors) - 1, self.cursors[-1])
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+        embed = discord.Embed(title="🏆 Таблица лидеров по уровням", description=text, color=discord.Color(self.color))
+        embed.set_footer(text=f"Страница {len(self.cursors)}")
+        return embed
+
+    async def _show(self, interaction: discord.Interaction):
+        try:
+            embed = await self.render()
+        except (AnalyticsBusy, AnalyticsTimeout):
+            await interaction.response.send_message("⏳ Таблица лидеров сейчас недоступна, попробуйте позже", ephemeral=True)
+            return
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self._show(interaction)
+
+    @ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: ui.Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await self._show(interaction)
 
 
 class Levels(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.xp_cooldowns = {}
-        self._lvl_cache = {}
-        self._gc_cache = {}
-        self._cache_ttl = 60
-        self.cleanup_cooldowns.start()
+        batch_writer.add_flush_listener(leaderboard_cache.on_flush)
 
-    def cog_unload(self):
-        self.cleanup_cooldowns.cancel()
-
-    @tasks.loop(hours=1)
-    async def cleanup_cooldowns(self):
-        self.xp_cooldowns.clear()
-
-    def _get_configs(self, guild_id: int):
-        now = time.time()
-        if guild_id in self._lvl_cache and guild_id in self._gc_cache:
-            lvl_cached, lvl_ts = self._lvl_cache[guild_id]
-            gc_cached, gc_ts = self._gc_cache[guild_id]
-            if now - min(lvl_ts, gc_ts) < self._cache_ttl:
-                return lvl_cached, gc_cached
-        session = SessionLocal()
-        try:
-            config = session.query(LevelConfig).filter_by(guild_id=guild_id).first()
-            guild_config = session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-            self._lvl_cache[guild_id] = (config, now)
-            self._gc_cache[guild_id] = (guild_config, now)
-            return config, guild_config
-        finally:
-            session.close()
+    async def cog_load(self):
+        self.credit_voice.start()
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
-            return
-        config, guild_config = self._get_configs(message.guild.id)
+    def cog_unload(self):
+        batch_writer.remove_flush_listener(leaderboard_cache.on_flush)
+        self.credit_voice.cancel()
+
+    async def leaderboard_page(self, guild: discord.Guild, page: int, after: tuple | None) -> tuple[str, tuple | None]:
+        """(text, cursor of the next page or None) for one /levels_top page."""
+        cached = leaderboard_cache.get(guild.id, (page, after))
+        if cached is not None:
+            return cached
+        version = leaderboard_cache.version(guild.id)
+        rows = await run_query(_leaderboard_rows, guild.id, after, LEADERBOARD_PAGE_SIZE)
+        lines = []
+        for position, (user_id, level, xp) in enumerate(rows[:LEADERBOARD_PAGE_SIZE], page * LEADERBOARD_PAGE_SIZE + 1):
+            member = guild.get_member(user_id)
+            name = discord.utils.escape_markdown(member.display_name) if member else f"<@{user_id}>"
+            lines.append(f"**{position}.** {name} — уровень **{level}**, {xp or 0:,} XP")
+        next_cursor = None
+        if len(rows) > LEADERBOARD_PAGE_SIZE:
+            user_id, level, xp = rows[LEADERBOARD_PAGE_SIZE - 1]
+            next_cursor = (level, xp, user_id)
+        result = ("\n".join(lines) or "Нет данных об уровнях", next_cursor)
+        leaderboard_cache.put(guild.id, (page, after), result, version)
+        return result
+
+    @message_stage(XP, name="xp")
+    async def xp_stage(self, ctx: MessageContext):
+        message = ctx.message
+        config, guild_config = await ctx.get_config(LevelConfig), ctx.config
         if not config or not config.enabled or not guild_config or not guild_config.levels_enabled:
             return
-        session = SessionLocal()
         try:
-
-            user_key = f"{message.guild.id}_{message.author.id}"
             now = datetime.now(timezone.utc).replace(tzinfo=None)
-
-            if user_key in self.xp_cooldowns:
-                if (now - self.xp_cooldowns[user_key]).total_seconds() < config.xp_cooldown:
-                    return
-
-            user_lvl = session.query(UserLevel).filter_by(
-                guild_id=message.guild.id, user_id=message.author.id
-            ).first()
-            if not user_lvl:
-                user_lvl = UserLevel(guild_id=message.guild.id, user_id=message.author.id)
-                session.add(user_lvl)
+            state = await xp_engine.get(message.guild.id, message.author.id)
+            if state.last_message_xp and (now - state.last_message_xp).total_seconds() < config.xp_cooldown:
+                return
 
             xp_gain = random.randint(config.xp_min, config.xp_max)
 
-            if config.xp_boost_role_ids and message.author._roles:
+            if config.xp_boost_role_ids and ctx.role_ids:
                 for rid in config.xp_boost_role_ids:
-                    if rid in message.author._roles:
+                    if rid in ctx.role_ids:
                         xp_gain = int(xp_gain * config.xp_boost_multiplier)
                         break
 
-            user_lvl.xp = (user_lvl.xp or 0) + xp_gain
-            user_lvl.total_messages = (user_lvl.total_messages or 0) + 1
-            user_lvl.last_message_xp = now
-
-            next_lvl_xp = calc_level_xp(user_lvl.level or 1, config.level_base_xp, config.level_multiplier)
-
-            if user_lvl.xp >= next_lvl_xp and (user_lvl.level or 1) < config.max_level:
-                user_lvl.level = (user_lvl.level or 1) + 1
-                user_lvl.xp = user_lvl.xp - next_lvl_xp
-                session.commit()
-
-                await self.handle_levelup(message, user_lvl, config, guild_config)
-            else:
-                session.commit()
-
-            self.xp_cooldowns[user_key] = now
+            await self.award_xp(message.author, state, xp_gain, config, message.channel,
+                                total_messages=1, last_message_xp=now)
         except Exception as e:
             logger.warning(f"xp error g={message.guild.id} u={message.author.id}: {e}")
-        finally:
-            session.close()
 
-    async def handle_levelup(self, message, user_lvl, config, guild_config):
+    async def award_xp(self, member, state, xp_gain: int, config, channel=None, **counters):
+        """Add xp_gain to the member's total and move them to whatever level the total reaches."""
+        if state.guild_id in _formula_changing:
+            xp_engine.apply(state, xp=xp_gain, **counters)
+            return
+        old_level = state.level
+        new_level = LevelTable.for_config(config).level_for(state.xp + xp_gain)
+        xp_engine.apply(state, xp=xp_gain, level=new_level - old_level, **counters)
+        if new_level > old_level:
+            await self.handle_levelup(member, old_level, new_level, config, channel)
+
+    async def handle_levelup(self, member, old_level: int, new_level: int, config, channel=None):
         if config.announce_levelup:
-            channel_id = config.announce_channel_id or message.channel.id
-            channel = message.guild.get_channel(channel_id)
+            if config.announce_channel_id:
+                channel = member.guild.get_channel(config.announce_channel_id)
             if channel:
                 embed = discord.Embed(
                     title="🎉 Повышение уровня!",
-                    description=f"{message.author.mention} достиг уровня **{user_lvl.level}**!",
+                    description=f"{member.mention} достиг уровня **{new_level}**!",
                     color=discord.Color.gold(),
                 )
-                embed.set_thumbnail(url=message.author.display_avatar.url)
+                embed.set_thumbnail(url=member.display_avatar.url)
                 await channel.send(embed=embed)
 
         rewards = dict(config.level_role_rewards) if config.level_role_rewards else {}
-        reward = rewards.get(str(user_lvl.level))
-        if reward and reward.get("role_id"):
-            role = message.guild.get_role(int(reward["role_id"]))
-            if role:
-                try:
-                    if config.stack_roles:
-                        await message.author.add_roles(role)
-                    else:
-                        for lvl_data in rewards.values():
-                            if lvl_data.get("role_id") and lvl_data["role_id"] != reward["role_id"]:
-                                old_role = message.guild.get_role(int(lvl_data["role_id"]))
-                                if old_role and old_role in message.author.roles:
-                                    await message.author.remove_roles(old_role)
-                        await message.author.add_roles(role)
-                except Exception:
-                    pass
+        # every reward between the old and new level, for gains that skip several levels
+        earned = [rewards[str(lvl)] for lvl in range(old_level + 1, new_level + 1)
+                  if rewards.get(str(lvl)) and rewards[str(lvl)].get("role_id")]
+        if not earned:
+            return
+        try:
+            if config.stack_roles:
+                roles = [role for role in (member.guild.get_role(int(r["role_id"])) for r in earned) if role]
+                if roles:
+                    await member.add_roles(*roles)
+            else:
+                reward = earned[-1]
+                role = member.guild.get_role(int(reward["role_id"]))
+                if role:
+                    old_roles = []
+                    for lvl_data in rewards.values():
+                        if lvl_data.get("role_id") and lvl_data["role_id"] != reward["role_id"]:
+                            old_role = member.guild.get_role(int(lvl_data["role_id"]))
+                            if old_role and old_role in member.roles:
+                                old_roles.append(old_role)
+                    if old_roles:
+                        await member.remove_roles(*old_roles)
+                    await member.add_roles(role)
+        except Exception:
+            pass
 
     @app_commands.command(name="rank", description="Shows your current level and rank")
     async def rank_slash(self, interaction: discord.Interaction, member: Optional[discord.Member] = None):
@@ -296,13 +429,12 @@ class Levels(commands.Cog):
         session = SessionLocal()
         try:
             config = session.query(LevelConfig).filter_by(guild_id=interaction.guild.id).first()
-            user_lvl = session.query(UserLevel).filter_by(
-                guild_id=interaction.guild.id, user_id=target.id
-            ).first()
+            # the engine includes gains not flushed to the database yet
+            state = await xp_engine.get(interaction.guild.id, target.id)
             guild_config = session.query(GuildConfig).filter_by(guild_id=interaction.guild.id).first()
             color_int = int(guild_config.embed_color) if guild_config and guild_config.embed_color else 0x3498db
 
-            if not user_lvl:
+            if not (state.total_messages or state.voice_minutes or state.xp or state.level > 1):
                 embed = discord.Embed(
                     title=f"📊 {target.display_name}",
                     description="Нет данных об уровне",
@@ -312,26 +444,10 @@ class Levels(commands.Cog):
                 await interaction.response.send_message(embed=embed)
                 return
 
-            level = user_lvl.level or 1
-            xp = user_lvl.xp or 0
-            base = config.level_base_xp if config else 100
-            mult = config.level_multiplier if config else 1.5
-            next_xp = calc_level_xp(level, base, mult)
-
-            from sqlalchemy import func, and_, or_
-            rank = session.query(func.count(UserLevel.user_id)).filter(
-                and_(
-                    UserLevel.guild_id == interaction.guild.id,
-                    UserLevel.user_id != target.id,
-                    or_(
-                        UserLevel.level > (user_lvl.level or 1),
-                        and_(
-                            UserLevel.level == (user_lvl.level or 1),
-                            UserLevel.xp > (user_lvl.xp or 0)
-                        )
-                    )
-                )
-            ).scalar() + 1
+            level, xp = state.level, state.xp
+            _, into, needed = LevelTable.for_config(config).progress(xp)
+
+            rank = (await rank_index.guild(interaction.guild.id)).rank_of(level, xp)
 
             embed = discord.Embed(
                 title=f"📊 {target.display_name}",
@@ -340,12 +456,12 @@ class Levels(commands.Cog):
             embed.set_thumbnail(url=target.display_avatar.url)
             embed.add_field(name="Уровень", value=str(level), inline=True)
             embed.add_field(name="Ранг", value=f"#{rank}", inline=True)
-            embed.add_field(name="XP", value=f"{xp:,}/{next_xp:,}", inline=True)
-            embed.add_field(name="Всего сообщений", value=f"{user_lvl.total_messages or 0:,}", inline=True)
-            if user_lvl.voice_minutes:
-                embed.add_field(name="В голосовых", value=f"{user_lvl.voice_minutes} мин", inline=True)
+            embed.add_field(name="XP", value=f"{into:,}/{needed:,}" if needed else f"{xp:,} (макс.)", inline=True)
+            embed.add_field(name="Всего сообщений", value=f"{state.total_messages:,}", inline=True)
+            if state.voice_minutes:
+                embed.add_field(name="В голосовых", value=f"{state.voice_minutes} мин", inline=True)
 
-            progress = min(xp / next_xp * 100, 100) if next_xp > 0 else 0
+            progress = min(into / needed * 100, 100) if needed else 100
             bar = "█" * int(progress / 10) + "░" * (10 - int(progress / 10))
             embed.add_field(name="Прогресс", value=f"{bar} {progress:.0f}%", inline=False)
 
@@ -353,6 +469,20 @@ class Levels(commands.Cog):
         finally:
             session.close()
 
+    @app_commands.command(name="levels_top", description="Level leaderboard")
+    async def levels_top(self, interaction: discord.Interaction):
+        if not interaction.guild:
+            return
+        guild_config = config_cache.get(GuildConfig, interaction.guild.id)
+        color_int = int(guild_config.embed_color) if guild_config and guild_config.embed_color else 0x3498db
+        view = LeaderboardView(self, interaction.guild, interaction.user.id, color_int)
+        try:
+            embed = await view.render()
+        except (AnalyticsBusy, AnalyticsTimeout):
+            await interaction.response.send_message("⏳ Таблица лидеров сейчас недоступна, попробуйте позже", ephemeral=True)
+            return
+        await interaction.response.send_message(embed=embed, view=view)
+
     @app_commands.command(name="level_config", description="Full level system configuration")
     @app_commands.checks.has_permissions(administrator=True)
     async def level_config(self, interaction: discord.Interaction):
@@ -387,33 +517,63 @@ class Levels(commands.Cog):
         finally:
             session.close()
 
+    @staticmethod
+    def voice_excluded(member: discord.Member, voice: discord.VoiceState, config) -> bool:
+        """Whether time in this voice state earns no XP."""
+        channel = voice.channel
+        if channel is None or voice.self_mute or voice.self_deaf:
+            return True
+        afk_channel = member.guild.afk_channel
+        return (afk_channel is not None and channel.id == afk_channel.id) or channel.id in (config.ignore_channel_ids or ())
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
         if member.bot:
             return
-        session = SessionLocal()
+        config = await config_cache.aget(LevelConfig, member.guild.id)
+        if not config or not config.enabled or not config.xp_per_voice_minute or after.channel is None:
+            voice_sessions.update(member.guild.id, member.id, None)
+            return
+        voice_sessions.update(member.guild.id, member.id, after.channel.id, self.voice_excluded(member, after, config))
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        """Track members already in voice at startup, resuming sessions checkpointed before a restart."""
+        config = await config_cache.aget(LevelConfig, guild.id)
+        if not config or not config.enabled or not config.xp_per_voice_minute:
+            return
+        members = [m for channel in guild.voice_channels for m in channel.members
+                   if not m.bot and m.voice and voice_sessions.get(guild.id, m.id) is None]
+        if not members:
+            return
         try:
-            config = session.query(LevelConfig).filter_by(guild_id=member.guild.id).first()
-            if not config or not config.enabled or not config.xp_per_voice_minute:
-                return
-            user_lvl = session.query(UserLevel).filter_by(guild_id=member.guild.id, user_id=member.id).first()
-            if not user_lvl:
-                return
-            if after.channel and not before.channel:
-                user_lvl.last_voice_update = datetime.now(timezone.utc).replace(tzinfo=None)
-                session.commit()
-            elif not after.channel and before.channel and user_lvl.last_voice_update:
-                now = datetime.now(timezone.utc).replace(tzinfo=None)
-                minutes = int((now - user_lvl.last_voice_update).total_seconds() / 60)
-                if minutes > 0:
-                    user_lvl.voice_minutes = (user_lvl.voice_minutes or 0) + minutes
-                    user_lvl.xp = (user_lvl.xp or 0) + minutes * config.xp_per_voice_minute
-                user_lvl.last_voice_update = None
-                session.commit()
+            checkpoints = await run_in("db", voice_sessions.checkpoints, guild.id)
         except Exception as e:
-            logger.warning(f"voice xp error g={member.guild.id} u={member.id}: {e}")
-        finally:
-            session.close()
+            logger.warning(f"voice checkpoints unavailable g={guild.id}: {e}")
+            checkpoints = {}
+        for member in members:
+            excluded = self.voice_excluded(member, member.voice, config)
+            carried = 0.0 if excluded else voice_sessions.resume_seconds(checkpoints.get(member.id))
+            voice_sessions.update(guild.id, member.id, member.voice.channel.id, excluded, carried_seconds=carried)
+
+    @tasks.loop(seconds=VOICE_CREDIT_INTERVAL_S)
+    async def credit_voice(self):
+        for credit in voice_sessions.collect():
+            try:
+                config = await config_cache.aget(LevelConfig, credit.guild_id)
+                guild = self.bot.get_guild(credit.guild_id)
+                member = guild.get_member(credit.user_id) if guild else None
+                if not config or not config.enabled or not config.xp_per_voice_minute or member is None:
+                    continue
+                state = await xp_engine.get(credit.guild_id, credit.user_id)
+                await self.award_xp(member, state, credit.minutes * config.xp_per_voice_minute, config,
+                                    guild.get_channel(credit.channel_id), voice_minutes=credit.minutes)
+            except Exception as e:
+                logger.warning(f"voice xp error g={credit.guild_id} u={credit.user_id}: {e}")
+
+    @credit_voice.before_loop
+    async def before_credit_voice(self):
+        await self.bot.wait_until_ready()
 
 
 async def setup(bot):
@@ -0,0 +1,175 @@
+"""
+Single entry point for guild and DM messages.
+
+Cogs do not listen to on_message themselves; they mark coroutine methods with
+@message_stage(phase). For every message the pipeline builds one
+MessageContext (guild config snapshot, the author's role ids, one lazily
+opened async session) and runs the stages of all loaded cogs in phase order.
+A stage that deletes or punishes the message calls ctx.stop() and the later
+phases are skipped, so removed spam earns no XP, stats or AI reply.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+
+import discord
+from discord.ext import commands
+
+from database import AsyncSessionLocal, GuildConfig
+from config_cache import config_cache
+from instrumentation import handler_scope
+
+logger = logging.getLogger("alfheim_bot.pipeline")
+
+# phases, lowest first
+AUTOMOD = 0
+LOGGING = 10
+XP = 20
+STATS = 30
+AI = 40
+
+SLOW_STAGE_MS = 250
+
+
+def message_stage(phase: int, name: str = None, dms: bool = False):
+    """Mark a cog coroutine `async def stage(self, ctx: MessageContext)` as a pipeline stage."""
+    def decorate(func):
+        func.__message_stage__ = (phase, name or func.__name__, dms)
+        return func
+    return decorate
+
+
+class MessageContext:
+    def __init__(self, message: discord.Message):
+        self.message = message
+        self.guild = message.guild
+        self.guild_id = message.guild.id if message.guild else None
+        self.author = message.author
+        self.role_ids = frozenset(getattr(message.author, "_roles", ()) or ())
+        self.config = None
+        self.stopped_by = None
+        self._configs = {}
+        self._session = None
+
+    @property
+    def stopped(self) -> bool:
+        return self.stopped_by is not None
+
+    def stop(self, reason: str):
+        """Skip all remaining stages for this message."""
+        self.stopped_by = reason
+
+    async def get_config(self, model):
+        """Config snapshot for this guild, read at most once per message."""
+        if self.guild_id is None:
+            return None
+        if model not in self._configs:
+            self._configs[model] = await config_cache.aget(model, self.guild_id)
+        return self._configs[model]
+
+    async def session(self):
+        if self._session is None:
+            self._session = AsyncSessionLocal()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+@dataclass(order=True)
+class Stage:
+    phase: int
+    name: str
+    cog_name: str = field(compare=False)
+    dms: bool = field(compare=False)
+    callback: object = field(compare=False, repr=False)
+
+    @property
+    def label(self) -> str:
+        return f"{self.cog_name}.{self.name}"
+
+
+@dataclass
+class StageStats:
+    runs: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    errors: int = 0
+    stops: int = 0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.runs if self.runs else 0.0
+
+
+class MessagePipeline(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.stage_stats = {}
+        self.messages = 0
+        self._stages = []
+        self._stages_key = None
+
+    @property
+    def stages(self) -> list[Stage]:
+        # rebuilt whenever the set of loaded cogs changes
+        key = tuple(id(cog) for cog in self.bot.cogs.values())
+        if key != self._stages_key:
+            self._stages = self._collect_stages()
+            self._stages_key = key
+        return self._stages
+
+    def _collect_stages(self) -> list[Stage]:
+        stages = []
+        for cog_name, cog in self.bot.cogs.items():
+            for attr in dir(type(cog)):
+                marker = getattr(getattr(type(cog), attr, None), "__message_stage__", None)
+                if marker:
+                    phase, name, dms = marker
+                    stages.append(Stage(phase, name, cog_name, dms, getattr(cog, attr)))
+        return sorted(stages)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot:
+            return
+        ctx = MessageContext(message)
+        if ctx.guild_id is not None:
+            ctx.config = await ctx.get_config(GuildConfig)
+        self.messages += 1
+        try:
+            await self.run(ctx)
+        finally:
+            await ctx.close()
+
+    async def run(self, ctx: MessageContext):
+        for stage in self.stages:
+            if ctx.stopped:
+                break
+            if ctx.guild_id is None and not stage.dms:
+                continue
+            stats = self.stage_stats.get(stage.label)
+            if stats is None:
+                stats = self.stage_stats[stage.label] = StageStats()
+            started = time.perf_counter()
+            try:
+                with handler_scope(f"on_message:{stage.label}"):
+                    await stage.callback(ctx)
+            except Exception as e:
+                stats.errors += 1
+                logger.warning(f"stage {stage.label} failed for message {ctx.message.id}: {e}")
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.runs += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            if ctx.stopped:
+                stats.stops += 1
+            if elapsed_ms > SLOW_STAGE_MS and stage.phase < AI:
+                logger.info(f"slow stage {stage.label}: {elapsed_ms:.0f}ms")
+
+
+async def setup(bot):
+    await bot.add_cog(MessagePipeline(bot))
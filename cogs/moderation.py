@@ -5,6 +5,8 @@ from discord.ext import commands
 from discord import app_commands, ui
 from database import SessionLocal, GuildConfig, Warning, TempBan, AutoModConfig
 from typing import Optional, Union
+from config_cache import config_cache
+from cogs.message_pipeline import message_stage, MessageContext, AUTOMOD
 
 
 def get_msg(guild_id: int, key: str, **kwargs) -> str:
@@ -23,79 +25,71 @@ class Moderation(commands.Cog):
             pass
 
     async def log_mod_action(self, guild: discord.Guild, embed: discord.Embed):
-        session = SessionLocal()
-        try:
-            config = session.query(GuildConfig).filter_by(guild_id=guild.id).first()
-            if config and config.mod_log_channel_id:
-                channel = guild.get_channel(config.mod_log_channel_id)
-                if channel and hasattr(channel, 'send'):
-                    await channel.send(embed=embed)
-        finally:
-            session.close()
+        config = await config_cache.aget(GuildConfig, guild.id)
+        if config and config.mod_log_channel_id:
+            channel = guild.get_channel(config.mod_log_channel_id)
+            if channel and hasattr(channel, 'send'):
+                await channel.send(embed=embed)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
+    @message_stage(AUTOMOD, name="automod")
+    async def automod_stage(self, ctx: MessageContext):
+        message = ctx.message
+        automod = await ctx.get_config(AutoModConfig)
+        if not automod or not automod.enabled:
             return
-        session = SessionLocal()
-        try:
-            automod = session.query(AutoModConfig).filter_by(guild_id=message.guild.id).first()
-            config = session.query(GuildConfig).filter_by(guild_id=message.guild.id).first()
-            if not automod or not automod.enabled:
-                return
+        config = ctx.config
 
-            content = message.content
-            violation = False
-            reason = ""
+        content = message.content
+        violation = False
+        reason = ""
 
-            if automod.bad_words_enabled and automod.bad_words_list:
-                bad_words = [w.strip().lower() for w in str(automod.bad_words_list).split(',') if w.strip()]
-                if any(word in content.lower() for word in bad_words):
-                    violation = True
-                    reason = "Bad words"
-                    action = automod.bad_words_action or "warn"
+        if automod.bad_words_enabled and automod.bad_words_list:
+            bad_words = [w.strip().lower() for w in str(automod.bad_words_list).split(',') if w.strip()]
+            if any(word in content.lower() for word in bad_words):
+                violation = True
+                reason = "Bad words"
+                action = automod.bad_words_action or "warn"
 
-            if not violation and automod.caps_enabled:
-                letters = sum(1 for c in content if c.isalpha())
-                caps = sum(1 for c in content if c.isupper())
-                if letters >= (automod.caps_min_length or 10) and (caps / letters * 100) >= (automod.caps_threshold or 70):
-                    violation = True
-                    reason = "Excessive caps"
-                    action = automod.caps_action or "warn"
+        if not violation and automod.caps_enabled:
+            letters = sum(1 for c in content if c.isalpha())
+            caps = sum(1 for c in content if c.isupper())
+            if letters >= (automod.caps_min_length or 10) and (caps / letters * 100) >= (automod.caps_threshold or 70):
+                violation = True
+                reason = "Excessive caps"
+                action = automod.caps_action or "warn"
 
-            if not violation and automod.anti_links_enabled:
-                if re.search(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', content):
-                    if not message.author.guild_permissions.manage_messages:
-                        has_exempt = False
-                        if automod.allowed_link_roles and message.author._roles:
-                            for rid in automod.allowed_link_roles:
-                                if rid in message.author._roles:
-                                    has_exempt = True
-                                    break
-                        if not has_exempt:
-                            violation = True
-                            reason = "Links"
-                            action = automod.anti_links_action or "warn"
+        if not violation and automod.anti_links_enabled:
+            if re.search(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', content):
+                if not message.author.guild_permissions.manage_messages:
+                    has_exempt = False
+                    if automod.allowed_link_roles and ctx.role_ids:
+                        for rid in automod.allowed_link_roles:
+                            if rid in ctx.role_ids:
+                                has_exempt = True
+                                break
+                    if not has_exempt:
+                        violation = True
+                        reason = "Links"
+                        action = automod.anti_links_action or "warn"
 
-            if violation and config:
-                await message.delete()
-                if action == 'mute':
-                    dur = getattr(automod, 'spam_mute_duration', None) or 5
-                    await message.author.timeout(datetime.timedelta(minutes=dur), reason=reason)
-                elif action == 'kick':
-                    await message.author.kick(reason=reason)
-                elif action == 'ban':
-                    await message.author.ban(reason=reason)
-                else:
-                    warn = Warning(
-                        guild_id=message.guild.id, user_id=message.author.id,
-                        reason=reason, moderator_id=self.bot.user.id,
-                        timestamp=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-                    )
-                    session.add(warn)
-                    session.commit()
-        finally:
-            session.close()
+        if violation and config:
+            ctx.stop(f"automod: {reason}")
+            await message.delete()
+            if action == 'mute':
+                dur = getattr(automod, 'spam_mute_duration', None) or 5
+                await message.author.timeout(datetime.timedelta(minutes=dur), reason=reason)
+            elif action == 'kick':
+                await message.author.kick(reason=reason)
+            elif action == 'ban':
+                await message.author.ban(reason=reason)
+            else:
+                session = await ctx.session()
+                session.add(Warning(
+                    guild_id=message.guild.id, user_id=message.author.id,
+                    reason=reason, moderator_id=self.bot.user.id,
+                    timestamp=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+                ))
+                await session.commit()
 
     @app_commands.command(name="kick", description="Kicks a member")
     @app_commands.checks.has_permissions(kick_members=True)
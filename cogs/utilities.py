@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 from database import SessionLocal, Reminder, Poll, PollVote, GuildConfig
+from sharding import shard_filter
 import datetime
 from typing import Optional
 import json
@@ -23,7 +24,9 @@ class Utilities(commands.Cog):
         session = SessionLocal()
         try:
             now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-            due_reminders = session.query(Reminder).filter(Reminder.remind_at <= now).all()
+            due_reminders = session.query(Reminder).filter(
+                Reminder.remind_at <= now, shard_filter(self.bot, Reminder.guild_id)
+            ).all()
             
             for reminder in due_reminders:
                 try:
@@ -3,6 +3,7 @@ import asyncio
 from discord.ext import commands, tasks
 from discord import app_commands, ui
 from database import SessionLocal, VoiceChannelConfig, TempVoiceChannel
+from sharding import shard_filter
 from typing import Optional, Dict
 
 
@@ -279,7 +280,7 @@ class VoiceChannels(commands.Cog):
     async def check_empty_channels(self):
         session = SessionLocal()
         try:
-            empty = session.query(TempVoiceChannel).all()
+            empty = session.query(TempVoiceChannel).filter(shard_filter(self.bot, TempVoiceChannel.guild_id)).all()
             for tc in empty:
                 try:
                     channel = self.bot.get_channel(tc.channel_id)
@@ -0,0 +1,116 @@
+"""
+Application command sync that skips Discord when nothing changed.
+
+tree.sync() uploads the whole command set and is rate limited, so the bot
+hashes the payload it would send (the same dicts tree.sync() builds, in a
+stable order) and keeps the last synced hash per scope in the
+command_sync_state table: "global", or a guild id for guild syncs. A sync
+only happens when the hash differs.
+
+The stored hash is claimed with a compare-and-set before syncing, so when
+several workers start together during a rolling deploy exactly one of them
+syncs; if its sync fails the previous hash is put back.
+
+With DEV_GUILD_ID set, startup copies the global commands into that guild
+and syncs only there, which Discord applies instantly. /sync forces a sync.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+from database import CommandSyncState, SessionLocal, insert_ignore, upsert
+from executors import run_in
+
+logger = logging.getLogger("alfheim_bot.command_sync")
+
+DEV_GUILD_ID = int(os.getenv("DEV_GUILD_ID") or 0) or None
+
+GLOBAL_SCOPE = "global"
+
+
+def scope_for(guild=None) -> str:
+    return GLOBAL_SCOPE if guild is None else str(guild.id)
+
+
+async def tree_payload(tree, guild=None) -> list[dict]:
+    """The command payload tree.sync(guild=guild) would upload, sorted by type and name."""
+    commands = tree.get_commands(guild=guild)
+    if tree.translator:
+        payload = [await command.get_translated_payload(tree, tree.translator) for command in commands]
+    else:
+        payload = [command.to_dict(tree) for command in commands]
+    return sorted(payload, key=lambda c: (c.get("type", 1), c["name"]))
+
+
+async def tree_hash(tree, guild=None) -> str:
+    payload = await tree_payload(tree, guild)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _claim(scope: str, digest: str) -> tuple[bool, str | None]:
+    """Swap the stored hash for digest; returns (claimed, previous hash)."""
+    session = SessionLocal()
+    try:
+        row = session.get(CommandSyncState, scope)
+        previous = row.tree_hash if row else None
+        if previous == digest:
+            return False, previous
+        if row is None:
+            stmt = insert_ignore(CommandSyncState.__table__, session.get_bind().dialect.name)
+            claimed = session.execute(
+                stmt.values(scope=scope, tree_hash=digest, synced_at=datetime.now())).rowcount == 1
+        else:
+            claimed = session.query(CommandSyncState).filter_by(scope=scope, tree_hash=previous).update(
+                {"tree_hash": digest, "synced_at": datetime.now()}) == 1
+        session.commit()
+        return claimed, previous
+    finally:
+        session.close()
+
+
+def _release(scope: str, digest: str, previous: str | None):
+    session = SessionLocal()
+    try:
+        query = session.query(CommandSyncState).filter_by(scope=scope, tree_hash=digest)
+        if previous is None:
+            query.delete()
+        else:
+            query.update({"tree_hash": previous})
+        session.commit()
+    finally:
+        session.close()
+
+
+def _store(scope: str, digest: str):
+    session = SessionLocal()
+    try:
+        upsert(session, CommandSyncState, {"scope": scope}, {"tree_hash": digest, "synced_at": datetime.now()})
+        session.commit()
+    finally:
+        session.close()
+
+
+async def sync_tree(tree, guild=None, force: bool = False) -> int | None:
+    """Sync the commands for guild (global when None) if they changed since the last sync.
+
+    Returns the number of commands synced, or None when the sync was skipped.
+    """
+    scope = scope_for(guild)
+    digest = await tree_hash(tree, guild)
+    if force:
+        synced = await tree.sync(guild=guild)
+        await run_in("db", _store, scope, digest)
+        return len(synced)
+    claimed, previous = await run_in("db", _claim, scope, digest)
+    if not claimed:
+        logger.info(f"Commands for {scope} unchanged ({digest[:12]}), skipping sync")
+        return None
+    try:
+        synced = await tree.sync(guild=guild)
+    except Exception:
+        await run_in("db", _release, scope, digest, previous)
+        raise
+    return len(synced)
@@ -0,0 +1,134 @@
+"""
+Per-guild configuration cache.
+
+GuildConfig, LevelConfig, AutoModConfig and VerificationConfig rows are
+loaded once per guild and handed out as immutable snapshots (namedtuples with
+the model's column names, JSON values frozen). Any session that commits a
+change to one of these rows invalidates exactly that (model, guild) entry, so
+slash commands and modals that write config never leave a stale copy behind.
+
+Every invalidation bumps a version counter; a load that started before the
+bump is not stored, which keeps slow async loads from caching stale data.
+"""
+
+import logging
+from collections import namedtuple
+from types import MappingProxyType
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from database import (
+    SessionLocal, AsyncSessionLocal, GuildConfig, LevelConfig, AutoModConfig, VerificationConfig,
+)
+
+logger = logging.getLogger("alfheim_bot.config_cache")
+
+CACHED_MODELS = (GuildConfig, LevelConfig, AutoModConfig, VerificationConfig)
+
+_MISSING = object()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+_snapshot_types = {
+    model: namedtuple(f"{model.__name__}Snapshot", [c.key for c in model.__mapper__.column_attrs])
+    for model in CACHED_MODELS
+}
+
+
+def snapshot(row):
+    """Immutable copy of a config row, or None."""
+    if row is None:
+        return None
+    snap_type = _snapshot_types[type(row)]
+    return snap_type(*(_freeze(getattr(row, name)) for name in snap_type._fields))
+
+
+class ConfigCache:
+    def __init__(self, session_factory=SessionLocal, async_session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self._entries = {}
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def version(self, model, guild_id: int) -> int:
+        return self._versions.get((model, guild_id), 0)
+
+    def get(self, model, guild_id: int):
+        key = (model, guild_id)
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        version = self.version(model, guild_id)
+        session = self.session_factory()
+        try:
+            snap = snapshot(session.query(model).filter_by(guild_id=guild_id).first())
+        finally:
+            session.close()
+        return self._store(key, version, snap)
+
+    async def aget(self, model, guild_id: int):
+        key = (model, guild_id)
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        version = self.version(model, guild_id)
+        async with self.async_session_factory() as session:
+            result = await session.execute(select(model).filter_by(guild_id=guild_id).limit(1))
+            snap = snapshot(result.scalars().first())
+        return self._store(key, version, snap)
+
+    def _store(self, key, version: int, snap):
+        if self._versions.get(key, 0) == version:
+            self._entries[key] = snap
+        return snap
+
+    def invalidate(self, guild_id: int | None = None, model=None):
+        """Drop cached snapshots for one guild (optionally one model), or everything."""
+        if guild_id is None:
+            keys = list(self._entries)
+        elif model is None:
+            keys = [(m, guild_id) for m in CACHED_MODELS]
+        else:
+            keys = [(model, guild_id)]
+        for key in keys:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+
+config_cache = ConfigCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_config_writes(session, flush_context):
+    touched = session.info.setdefault("config_cache_touched", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CACHED_MODELS) and obj.guild_id is not None:
+            touched.add((type(obj), obj.guild_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_configs(session):
+    for model, guild_id in session.info.pop("config_cache_touched", ()):
+        config_cache.invalidate(guild_id, model)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_configs(session, previous_transaction):
+    session.info.pop("config_cache_touched", None)
@@ -1,13 +1,19 @@
 import os
 import sqlite3
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from sqlalchemy import (
     create_engine, Column, Integer, String, DateTime, ForeignKey,
-    BigInteger, Boolean, Text, Float, JSON, event, inspect, text,
+    BigInteger, Boolean, Text, Float, JSON, Index, event, func, inspect, text, select,
 )
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
+from instrumentation import instrument_engine
+
 Base = declarative_base()
 
 
@@ -55,6 +61,10 @@ class GuildConfig(Base):
     ai_auto_respond = Column(Boolean, default=False)
     ai_dm_enabled = Column(Boolean, default=True)
 
+    # 0 keeps logs forever; guilds opt in to pruning with /log_retention
+    message_log_retention_days = Column(Integer, default=0)
+    message_log_archive = Column(Boolean, default=False)
+
 
 class LevelConfig(Base):
     __tablename__ = "level_configs"
@@ -81,6 +91,9 @@ class LevelConfig(Base):
 
 class Giveaway(Base):
     __tablename__ = "giveaways"
+    __table_args__ = (
+        Index("ix_giveaways_ended_ends_at", "ended", "ends_at"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     channel_id = Column(BigInteger)
@@ -104,6 +117,10 @@ class Giveaway(Base):
 
 class GiveawayEntry(Base):
     __tablename__ = "giveaway_entries"
+    __table_args__ = (
+        # a repeated entry carries nothing worth keeping
+        Index("uq_giveaway_entries_giveaway_user", "giveaway_id", "user_id", unique=True, info={"merge": {}}),
+    )
     id = Column(Integer, primary_key=True)
     giveaway_id = Column(Integer, ForeignKey("giveaways.id"))
     user_id = Column(BigInteger)
@@ -112,6 +129,9 @@ class GiveawayEntry(Base):
 
 class TempBan(Base):
     __tablename__ = "temp_bans"
+    __table_args__ = (
+        Index("ix_temp_bans_unban_time", "unban_time"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     user_id = Column(BigInteger)
@@ -151,6 +171,13 @@ class ReleaseSnapshot(Base):
 
 class UserLevel(Base):
     __tablename__ = "user_levels"
+    __table_args__ = (
+        Index("uq_user_levels_guild_user", "guild_id", "user_id", unique=True, info={"merge": {
+            "xp": "sum", "level": "max", "total_messages": "sum", "voice_minutes": "sum",
+            "last_message_xp": "max", "last_voice_update": "max",
+        }}),
+        Index("ix_user_levels_leaderboard", "guild_id", "level", "xp", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     user_id = Column(BigInteger)
@@ -164,6 +191,9 @@ class UserLevel(Base):
 
 class Warning(Base):
     __tablename__ = "warnings"
+    __table_args__ = (
+        Index("ix_warnings_guild_user", "guild_id", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     user_id = Column(BigInteger)
@@ -264,6 +294,11 @@ class VerificationCode(Base):
 
 class UserEconomy(Base):
     __tablename__ = "user_economy"
+    __table_args__ = (
+        # duplicates come from the get_or_create race: every read and update went to the
+        # lowest id, so the others still hold the starting balance and nothing is merged
+        Index("uq_user_economy_guild_user", "guild_id", "user_id", unique=True, info={"merge": {}}),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     user_id = Column(BigInteger)
@@ -298,6 +333,9 @@ class Transaction(Base):
 
 class Reminder(Base):
     __tablename__ = "reminders"
+    __table_args__ = (
+        Index("ix_reminders_remind_at", "remind_at"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, nullable=True)
     user_id = Column(BigInteger, nullable=False)
@@ -345,6 +383,9 @@ class Report(Base):
 
 class MessageLog(Base):
     __tablename__ = "message_logs"
+    __table_args__ = (
+        Index("ix_message_logs_guild_created", "guild_id", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     message_id = Column(BigInteger, unique=True)
@@ -360,6 +401,11 @@ class MessageLog(Base):
 
 class UserActivity(Base):
     __tablename__ = "user_activity"
+    __table_args__ = (
+        Index("uq_user_activity_guild_user_date", "guild_id", "user_id", "date", unique=True, info={"merge": {
+            "message_count": "sum", "voice_minutes": "sum",
+        }}),
+    )
     id = Column(Integer, primary_key=True)
     guild_id = Column(BigInteger, ForeignKey("guild_configs.guild_id"))
     user_id = Column(BigInteger)
@@ -409,71 +455,293 @@ class AutoModConfig(Base):
     auto_mute_reason = Column(String(100), default="Automatic mute for rule violation")
 
 
-DATABASE_URL = "sqlite:///db/bot-db.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+class CommandSyncState(Base):
+    """Hash of the app command payload last synced to Discord, per scope ("global" or a guild id)."""
+    __tablename__ = "command_sync_state"
+    scope = Column(String(32), primary_key=True)
+    tree_hash = Column(String(64), nullable=False)
+    synced_at = Column(DateTime, default=datetime.now)
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///db/bot-db.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+
+def engine_options(url: str) -> dict:
+    """create_engine / create_async_engine kwargs for the backend and driver in url."""
+    parsed = make_url(url)
+    backend, driver = parsed.get_backend_name(), parsed.get_driver_name()
+    if backend == "sqlite":
+        return {} if driver == "aiosqlite" else {"connect_args": {"check_same_thread": False}}
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    timeout = DB_STATEMENT_TIMEOUT_MS
+    if backend == "postgresql":
+        if driver == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(timeout)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    elif backend == "mysql":
+        options["connect_args"] = {"init_command": f"SET SESSION MAX_EXECUTION_TIME={timeout}"}
+    return options
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+instrument_engine(engine)
+
+def _apply_sqlite_pragmas(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=10000")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-8000")
+    cursor.close()
+
 
 @event.listens_for(engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     if isinstance(dbapi_connection, sqlite3.Connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL")
-        cursor.execute("PRAGMA busy_timeout=10000")
-        cursor.execute("PRAGMA synchronous=NORMAL")
-        cursor.execute("PRAGMA cache_size=-8000")
-        cursor.close()
+        _apply_sqlite_pragmas(dbapi_connection)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-SCHEMA_VERSION = 1
+ANALYTICS_DATABASE_URL = os.getenv("ANALYTICS_DATABASE_URL") or DATABASE_URL
+ANALYTICS_POOL_SIZE = int(os.getenv("ANALYTICS_POOL_SIZE", "2"))
+ANALYTICS_QUERY_TIMEOUT_MS = int(os.getenv("ANALYTICS_QUERY_TIMEOUT_MS", "10000"))
 
 
-def get_schema_version(conn) -> int:
+def create_read_engine(url: str, timeout_ms: int = ANALYTICS_QUERY_TIMEOUT_MS, pool_size: int = ANALYTICS_POOL_SIZE):
+    """Engine with its own small pool whose connections refuse writes and abort
+    statements running longer than timeout_ms. Point ANALYTICS_DATABASE_URL at a
+    replica to take reports off the primary entirely.
+    """
+    options = engine_options(url)
+    backend = make_url(url).get_backend_name()
+    connect_args = options.setdefault("connect_args", {})
+    if backend == "postgresql":
+        connect_args["options"] = f"-c statement_timeout={timeout_ms} -c default_transaction_read_only=on"
+    elif backend == "mysql":
+        connect_args["init_command"] = (
+            f"SET SESSION MAX_EXECUTION_TIME={timeout_ms}; SET SESSION TRANSACTION READ ONLY"
+        )
+    if backend != "sqlite" or make_url(url).database not in (None, "", ":memory:"):
+        options.update(pool_size=pool_size, max_overflow=0)
+    read_engine = create_engine(url, **options)
+
+    if backend == "sqlite":
+        @event.listens_for(read_engine, "connect")
+        def set_read_only_pragma(dbapi_connection, connection_record):
+            _apply_sqlite_pragmas(dbapi_connection)
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA query_only=ON")
+            cursor.close()
+
+        @event.listens_for(read_engine, "before_cursor_execute")
+        def arm_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+            # SQLite has no statement timeout; the progress handler aborts with "interrupted"
+            deadline = time.monotonic() + timeout_ms / 1000
+            conn.connection.dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+
+    return read_engine
+
+
+read_engine = create_read_engine(ANALYTICS_DATABASE_URL)
+instrument_engine(read_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync database URL onto the matching asyncio driver."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+instrument_engine(async_engine.sync_engine)
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_async_sqlite_pragma(dbapi_connection, connection_record):
+    # aiosqlite hands us an adapted connection, not a sqlite3.Connection
+    if async_engine.dialect.name == "sqlite":
+        _apply_sqlite_pragmas(dbapi_connection)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """Async session that commits on success and rolls back on error."""
+    session = AsyncSessionLocal()
     try:
-        row = conn.execute(text("PRAGMA user_version")).fetchone()
-        return row[0] if row else 0
+        yield session
+        await session.commit()
     except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def async_fetch_one(session, model, **filters):
+    result = await session.execute(select(model).filter_by(**filters).limit(1))
+    return result.scalars().first()
+
+
+async def async_fetch_all(session, model, **filters):
+    result = await session.execute(select(model).filter_by(**filters))
+    return list(result.scalars().all())
+
+
+async def async_get_or_create(session, model, defaults: dict | None = None, **filters):
+    """Return (row, created). Safe against concurrent creators; the insert is not committed."""
+    row = await async_fetch_one(session, model, **filters)
+    if row is not None:
+        return row, False
+    stmt = insert_ignore(model.__table__, session.get_bind().dialect.name)
+    result = await session.execute(stmt.values(**filters, **(defaults or {})))
+    return await async_fetch_one(session, model, **filters), result.rowcount == 1
+
+
+def dialect_insert(model, dialect_name: str):
+    """INSERT construct for the backend, so callers can use its ON CONFLICT / ON DUPLICATE KEY form."""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def insert_ignore(model, dialect_name: str):
+    """INSERT that skips rows violating a unique constraint instead of failing the batch."""
+    stmt = dialect_insert(model, dialect_name)
+    if dialect_name == "mysql":
+        return stmt.prefix_with("IGNORE")
+    return stmt.on_conflict_do_nothing()
+
+
+def column_default(model, name: str):
+    """Scalar Python-side default of a column, 0 when it has none."""
+    default = model.__table__.c[name].default
+    if default is not None and default.is_scalar:
+        return default.arg
+    return 0
+
+
+def build_upsert(model, dialect_name: str, key_columns, update_columns=(), increment_columns=()):
+    """INSERT ... ON CONFLICT (key_columns) DO UPDATE for one or many rows.
+
+    update_columns take the incoming value; increment_columns hold a delta that
+    is added to the stored value (or the column default for a new row). Rows
+    must already have the default folded in, which bulk_upsert takes care of.
+    """
+    table = model.__table__
+    stmt = dialect_insert(table, dialect_name)
+    incoming = stmt.inserted if dialect_name == "mysql" else stmt.excluded
+    set_ = {col: incoming[col] for col in update_columns}
+    for col in increment_columns:
+        default = column_default(model, col)
+        set_[col] = func.coalesce(table.c[col], default) + incoming[col] - default
+    if not set_:
+        return insert_ignore(table, dialect_name)
+    if dialect_name == "mysql":
+        return stmt.on_duplicate_key_update(**set_)
+    return stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_)
+
+
+def bulk_upsert(session, model, key_columns, rows: list[dict], increment_columns=()) -> int:
+    """Upsert rows that share the same keys in one statement; not committed.
+    Columns outside key_columns and increment_columns are overwritten.
+    """
+    if not rows:
         return 0
+    key_columns = tuple(key_columns)
+    increment_columns = tuple(increment_columns)
+    update_columns = [c for c in rows[0] if c not in key_columns and c not in increment_columns]
+    defaults = {col: column_default(model, col) for col in increment_columns}
+    params = [{**row, **{col: defaults[col] + row[col] for col in increment_columns}} for row in rows]
+    stmt = build_upsert(model, session.get_bind().dialect.name, key_columns, update_columns, increment_columns)
+    session.execute(stmt, params)
+    return len(params)
 
 
-def init_db():
-    os.makedirs("db", exist_ok=True)
-    Base.metadata.create_all(bind=engine)
-    _migrate_schema()
+def upsert(session, model, key: dict, values: dict | None = None, increments: dict | None = None):
+    """Create or update the single row matching key; not committed."""
+    row = {**key, **(values or {}), **(increments or {})}
+    bulk_upsert(session, model, key.keys(), [row], (increments or {}).keys())
+
+
+def increment(session, model, key: dict, **deltas):
+    """Atomically add deltas to the row matching key, creating it if needed."""
+    upsert(session, model, key, increments=deltas)
+
+
+def get_or_create(session, model, defaults: dict | None = None, **key):
+    """Return (row, created) without the duplicate-row race of query-then-add.
+    The insert joins the session's transaction; committing it is up to the caller.
+    """
+    row = session.query(model).filter_by(**key).first()
+    if row is not None:
+        return row, False
+    stmt = insert_ignore(model.__table__, session.get_bind().dialect.name)
+    created = session.execute(stmt.values(**key, **(defaults or {}))).rowcount == 1
+    return session.query(model).filter_by(**key).first(), created
 
 
-def _migrate_schema():
-    """Add missing columns to existing tables (SQLite ALTER TABLE).
-    Uses PRAGMA user_version to avoid re-running completed migrations.
+def get_schema_version(conn) -> int:
+    """PRAGMA user_version on SQLite, a one-row schema_version table elsewhere."""
+    if conn.dialect.name == "sqlite":
+        row = conn.execute(text("PRAGMA user_version")).fetchone()
+        return row[0] if row else 0
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    row = conn.execute(text("SELECT MAX(version) FROM schema_version")).fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def set_schema_version(conn, version: int):
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+        return
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+
+
+def init_db():
+    """Create missing tables, then apply pending migrations (see migrations.py).
+    A brand-new database already matches the models and is stamped as current.
+    Runs under a cluster-wide lock so concurrent workers do not migrate twice.
     """
-    with engine.begin() as conn:
-        current = get_schema_version(conn)
-        if current >= SCHEMA_VERSION:
-            return
-        inspector = inspect(engine)
-        for table_name, model in Base.metadata.tables.items():
-            existing = {c["name"] for c in inspector.get_columns(table_name)}
-            for column in model.columns:
-                if column.name not in existing:
-                    col_type = column.type.compile(engine.dialect)
-                    nullable = "NULL" if column.nullable else "NOT NULL"
-                    default = ""
-                    if column.default is not None:
-                        arg = column.default.arg
-                        if callable(arg):
-                            try:
-                                arg = arg()
-                            except Exception:
-                                arg = None
-                        if isinstance(arg, str):
-                            default = f" DEFAULT '{arg}'"
-                        elif isinstance(arg, (int, float, bool)):
-                            default = f" DEFAULT {arg}"
-                    try:
-                        conn.execute(
-                            text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {col_type} {nullable}{default}")
-                        )
-                        print(f"[migration] Added column {table_name}.{column.name}")
-                    except Exception as e:
-                        print(f"[migration] Skipped {table_name}.{column.name}: {e}")
-        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    from migrations import latest_version, run_migrations, stamp
+    from leader import cluster_lock
+
+    os.makedirs("db", exist_ok=True)
+    # cluster workers start together; the first one migrates, the rest find the schema current
+    with cluster_lock("migrations"):
+        fresh = not inspect(engine).get_table_names()
+        Base.metadata.create_all(bind=engine)
+        if fresh:
+            stamp(latest_version())
+        else:
+            run_migrations()
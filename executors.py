@@ -0,0 +1,126 @@
+"""
+Named, bounded thread pools for blocking work.
+
+Synchronous SDK and database calls used to share asyncio's default
+executor, so a burst of slow AI completions could leave session commits
+waiting behind them. Each workload class now has its own pool:
+
+    db      session commits, write-behind flushes, pruning
+    github  PyGithub calls
+    ai      OpenAI / OpenRouter completions
+
+A pool has a worker count, an optional cap on queued plus running calls
+(ExecutorBusy beyond it) and an optional timeout (ExecutorTimeout; the
+thread itself cannot be interrupted and finishes in the background). The
+db pool has neither by default: a commit that was handed over must not be
+dropped or abandoned. Queue depth, wait time, run time, rejections and
+timeouts are exported through metrics.py.
+
+Cogs submit work with `await run_in("github", fn, *args, **kwargs)`.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import (
+    executor_queue_depth, executor_rejected, executor_run_latency, executor_timeouts, executor_wait_latency,
+)
+
+logger = logging.getLogger("alfheim_bot.executors")
+
+
+class ExecutorBusy(Exception):
+    """The executor's queue is full."""
+
+
+class ExecutorTimeout(Exception):
+    """The call did not finish within the executor's time limit."""
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_queue: int = 0, timeout: float = 0):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-worker")
+        executor_queue_depth.set(0, name)
+
+    def _call(self, submitted, fn, args, kwargs):
+        started = time.perf_counter()
+        executor_wait_latency.observe(started - submitted, self.name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            executor_run_latency.observe(time.perf_counter() - started, self.name)
+
+    async def run(self, fn, *args, timeout: float = None, **kwargs):
+        """Return fn(*args, **kwargs) computed on this pool; timeout overrides the pool default."""
+        if self.max_queue and self.pending >= self.max_queue:
+            executor_rejected.inc(self.name)
+            raise ExecutorBusy(f"{self.name} executor has {self.pending} calls pending")
+        timeout = self.timeout if timeout is None else timeout
+        self.pending += 1
+        executor_queue_depth.set(self.pending, self.name)
+        # run_in_executor does not carry context variables (e.g. the SQL handler tag) over by itself
+        context = contextvars.copy_context()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, context.run, self._call, time.perf_counter(), fn, args, kwargs)
+        future.add_done_callback(self._done)
+        try:
+            if timeout:
+                return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+            return await future
+        except asyncio.TimeoutError:
+            executor_timeouts.inc(self.name)
+            logger.warning(f"{self.name} call {getattr(fn, '__qualname__', fn)} exceeded {timeout:.0f}s")
+            raise ExecutorTimeout(f"{self.name} call exceeded {timeout:.0f}s")
+
+    def _done(self, future):
+        # counted when the thread finishes, so abandoned calls still occupy the queue
+        self.pending -= 1
+        executor_queue_depth.set(self.pending, self.name)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _setting(name: str, key: str, default: str) -> float:
+    return float(os.getenv(f"EXECUTOR_{name.upper()}_{key}", default))
+
+
+def _make(name: str, workers: str, max_queue: str, timeout: str) -> BoundedExecutor:
+    return BoundedExecutor(
+        name,
+        workers=int(_setting(name, "WORKERS", workers)),
+        max_queue=int(_setting(name, "MAX_QUEUE", max_queue)),
+        timeout=_setting(name, "TIMEOUT_S", timeout),
+    )
+
+
+executors = {
+    "db": _make("db", workers="4", max_queue="0", timeout="0"),
+    "github": _make("github", workers="4", max_queue="32", timeout="120"),
+    "ai": _make("ai", workers="4", max_queue="16", timeout="120"),
+}
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    try:
+        return executors[name]
+    except KeyError:
+        raise ValueError(f"unknown executor {name!r}; expected one of {sorted(executors)}") from None
+
+
+async def run_in(name: str, fn, *args, **kwargs):
+    return await get_executor(name).run(fn, *args, **kwargs)
+
+
+def shutdown_all():
+    for executor in executors.values():
+        executor.shutdown()
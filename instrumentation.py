@@ -0,0 +1,176 @@
+"""
+SQL statement accounting.
+
+database.py attaches record hooks to every engine. Each statement is timed,
+its row count noted, and it is attributed to the listener or slash command
+running at the time. The bot sets that handler in a context variable
+(AlfheimBot._run_event and the command tree's interaction_check). Context
+variables follow asyncio tasks and asyncio.to_thread, so work a handler
+pushes to a thread is still attributed to it.
+
+Statements slower than SLOW_QUERY_MS are logged. A handler invocation that
+runs the same statement shape more than N_PLUS_ONE_THRESHOLD times is
+flagged as a likely N+1 loop, once per invocation.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import event
+
+from metrics import db_statement_latency
+
+logger = logging.getLogger("alfheim_bot.sql")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+UNTAGGED = "(background)"
+
+current_handler: ContextVar[str] = ContextVar("current_handler", default=UNTAGGED)
+# statement shape -> executions in the current handler invocation
+_invocation_counts: ContextVar[dict | None] = ContextVar("invocation_counts", default=None)
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_SPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Collapse whitespace, IN-lists and literal numbers so equivalent statements compare equal."""
+    shape = _SPACE.sub(" ", statement).strip()
+    shape = _IN_LIST.sub("(?...)", shape)
+    return _NUMBER.sub("N", shape)
+
+
+@dataclass
+class StatementStats:
+    handler: str
+    shape: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    rows: int = 0
+    slow: int = 0
+    n_plus_one: int = 0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+class SQLStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[tuple[str, str], StatementStats] = {}
+
+    def record(self, handler: str, shape: str, elapsed_ms: float, rows: int, slow: bool = False):
+        with self._lock:
+            stats = self._stats.get((handler, shape))
+            if stats is None:
+                stats = self._stats[(handler, shape)] = StatementStats(handler, shape)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.rows += rows
+            stats.slow += slow
+
+    def flag_n_plus_one(self, handler: str, shape: str):
+        with self._lock:
+            stats = self._stats.get((handler, shape))
+            if stats is not None:
+                stats.n_plus_one += 1
+
+    def top(self, limit: int = 10, key: str = "total_ms") -> list[StatementStats]:
+        with self._lock:
+            items = list(self._stats.values())
+        return sorted(items, key=lambda s: getattr(s, key), reverse=True)[:limit]
+
+    def by_handler(self) -> dict[str, dict]:
+        totals = {}
+        with self._lock:
+            for stats in self._stats.values():
+                entry = totals.setdefault(stats.handler, {"count": 0, "total_ms": 0.0, "n_plus_one": 0})
+                entry["count"] += stats.count
+                entry["total_ms"] += stats.total_ms
+                entry["n_plus_one"] += stats.n_plus_one
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+sql_stats = SQLStats()
+
+
+def begin_handler(name: str):
+    """Attribute statements in the current task (and anything it spawns) to name."""
+    current_handler.set(name)
+    _invocation_counts.set({})
+
+
+@contextmanager
+def handler_scope(name: str):
+    handler_token = current_handler.set(name)
+    counts_token = _invocation_counts.set({})
+    try:
+        yield
+    finally:
+        _invocation_counts.reset(counts_token)
+        current_handler.reset(handler_token)
+
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _operation(statement: str) -> str:
+    verb = statement.lstrip()[:6].upper()
+    return verb if verb in _OPERATIONS else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    handler = current_handler.get()
+    shape = statement_shape(statement)
+    # SELECT row counts are only known up front on some drivers (-1 on SQLite)
+    rows = max(cursor.rowcount or 0, 0)
+    slow = elapsed_ms >= SLOW_QUERY_MS
+    sql_stats.record(handler, shape, elapsed_ms, rows, slow)
+    db_statement_latency.observe(elapsed_ms / 1000, _operation(statement))
+    if slow:
+        logger.warning(f"slow query ({elapsed_ms:.0f}ms) in {handler}: {shape[:300]}")
+
+    counts = _invocation_counts.get()
+    if counts is not None:
+        counts[shape] = counts.get(shape, 0) + 1
+        if counts[shape] == N_PLUS_ONE_THRESHOLD + 1:
+            sql_stats.flag_n_plus_one(handler, shape)
+            logger.warning(f"possible N+1 in {handler}: statement repeated over {N_PLUS_ONE_THRESHOLD} times: {shape[:300]}")
+
+
+def _handle_error(exception_context):
+    # keep the start-time stack balanced when a statement fails
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """Attach the timing hooks to a sync Engine (use async_engine.sync_engine for async ones)."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Cluster launcher for Alfheim Guide Bot
+Starts several bot processes, each connecting its own contiguous range of
+shards, so message handling uses more than one CPU core. Crashed workers are
+restarted with backoff. Jobs that must run once (GitHub polling, schema
+migrations) are coordinated between the workers by leader.py.
+
+    python launcher.py --workers 4                # shard count recommended by Discord
+    python launcher.py --workers 2 --shards 8     # fixed shard count
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger("alfheim_bot.launcher")
+
+# a worker that stayed up this long is considered healthy again
+STABLE_AFTER = 60
+MAX_BACKOFF = 60
+
+
+def recommended_shards(token: str) -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "AlfheimGuideBot launcher"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)["shards"])
+
+
+def shard_ranges(shard_count: int, workers: int) -> list[list[int]]:
+    """Split shard ids 0..shard_count-1 into at most `workers` contiguous, near-equal ranges."""
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class Worker:
+    def __init__(self, index: int, shard_count: int, shard_ids: list[int], command: list[str]):
+        self.index = index
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.command = command
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def env(self) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(map(str, self.shard_ids)),
+            "CLUSTER_WORKER": str(self.index),
+        })
+        return env
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, env=self.env())
+        self.started_at = time.monotonic()
+        logger.info(f"worker {self.index} (pid {self.process.pid}) started with shards "
+                    f"{self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count}")
+
+    def check(self, now: float):
+        """Restart the worker if it exited, backing off while it keeps failing."""
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            uptime = now - self.started_at
+            self.failures = 0 if uptime >= STABLE_AFTER else self.failures + 1
+            delay = min(MAX_BACKOFF, 2 ** self.failures) if self.failures else 1
+            logger.warning(f"worker {self.index} exited with code {code} after {uptime:.0f}s, restarting in {delay}s")
+            self.process = None
+            self.restart_at = now + delay
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout: float):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"worker {self.index} did not stop in time, killing it")
+            self.process.kill()
+            self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alfheim Guide Bot - cluster launcher")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of bot processes")
+    parser.add_argument("--shards", type=int, default=None, help="total shard count (default: Discord's recommendation)")
+    parser.add_argument("--script", default="main.py", help="bot entry point to run in each worker")
+    args = parser.parse_args()
+
+    shard_count = args.shards
+    if shard_count is None:
+        token = os.getenv("DISCORD_TOKEN")
+        if not token:
+            logger.critical("DISCORD_TOKEN must be set in .env (or pass --shards)")
+            sys.exit(1)
+        shard_count = max(recommended_shards(token), args.workers)
+        logger.info(f"using {shard_count} shards")
+
+    command = [sys.executable, args.script]
+    workers = [Worker(i, shard_count, ids, command) for i, ids in enumerate(shard_ranges(shard_count, args.workers))]
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for worker in workers:
+        worker.start()
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for worker in workers:
+            worker.check(now)
+
+    logger.info("stopping workers")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Leader election for jobs that must run once per cluster.
+
+Every worker started by launcher.py shares the same database. GitHub
+polling must happen in exactly one of them, so the workers compete for a
+lock and only the holder runs it. On PostgreSQL the lock is a session
+advisory lock held on a dedicated connection. Elsewhere (SQLite, which is
+single-host anyway) it is an flock() on a file in LEADER_LOCK_DIR. Both are released
+by the operating system or the server when the holder dies, and a follower
+takes over on its next attempt, within LEADER_RETRY_SECONDS.
+
+cluster_lock() is the blocking variant for one-off critical sections such
+as schema migrations in init_db().
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger("alfheim_bot.leader")
+
+LEADER_LOCK_DIR = os.getenv("LEADER_LOCK_DIR", "db")
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "10"))
+
+
+def lock_key(name: str) -> int:
+    """Stable signed 64-bit key for pg advisory locks."""
+    return int.from_bytes(hashlib.sha1(f"alfheim:{name}".encode()).digest()[:8], "big", signed=True)
+
+
+class FileLock:
+    def __init__(self, name: str, directory: str = None):
+        self.path = os.path.join(directory or LEADER_LOCK_DIR, f"{name}.lock")
+        self._fd = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        import fcntl
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class AdvisoryLock:
+    def __init__(self, name: str, bind=engine):
+        self.key = lock_key(name)
+        self.bind = bind
+        self._conn = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        conn = self.bind.connect().execution_options(isolation_level="AUTOCOMMIT")
+        # the lock lives as long as this session, so keep it out of the pool
+        conn.detach()
+        try:
+            if blocking:
+                conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": self.key})
+                acquired = True
+            else:
+                acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def held(self) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            self._conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logger.warning(f"lost the connection holding the leader lock: {e}")
+            self._conn.invalidate()
+            self._conn = None
+            return False
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            except Exception:
+                pass
+            self._conn.close()
+            self._conn = None
+
+
+def make_lock(name: str, bind=engine):
+    if bind.dialect.name == "postgresql":
+        return AdvisoryLock(name, bind)
+    return FileLock(name)
+
+
+@contextmanager
+def cluster_lock(name: str, bind=engine):
+    """Block until no other worker holds name, then run the body."""
+    lock = make_lock(name, bind)
+    lock.acquire(blocking=True)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+class LeaderElection:
+    def __init__(self, name: str = "leader", lock=None, retry: float = LEADER_RETRY_SECONDS):
+        self.name = name
+        self.lock = lock or make_lock(name)
+        self.retry = retry
+        self.is_leader = False
+        self._on_elected = []
+        self._on_lost = []
+        self._task = None
+
+    def on_elected(self, callback):
+        self._on_elected.append(callback)
+        return callback
+
+    def on_lost(self, callback):
+        self._on_lost.append(callback)
+        return callback
+
+    def poll(self) -> bool | None:
+        """One election round. Returns True when leadership was gained, False when lost, None if unchanged."""
+        if self.is_leader:
+            if self.lock.held():
+                return None
+            self.is_leader = False
+            return False
+        if self.lock.acquire():
+            self.is_leader = True
+            return True
+        return None
+
+    async def _run(self):
+        while True:
+            try:
+                change = await asyncio.to_thread(self.poll)
+            except Exception as e:
+                logger.error(f"leader election for {self.name} failed: {e}")
+                change = None
+            if change is not None:
+                logger.info(f"{'acquired' if change else 'lost'} leadership for {self.name} (pid {os.getpid()})")
+                for callback in self._on_elected if change else self._on_lost:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.error(f"leader callback {callback.__name__} failed: {e}")
+            await asyncio.sleep(self.retry)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.is_leader = False
+        self.lock.release()
@@ -0,0 +1,140 @@
+"""
+Level thresholds compiled from a guild's LevelConfig.
+
+UserLevel.xp is the member's total XP. Reaching level L + 1 from level L
+costs calc_level_xp(L) more; LevelTable holds the running totals of those
+costs, so a member's level is a binary search over the table instead of a
+recomputed power per message, and a gain that crosses several thresholds
+lands on the right level in one step. Tables are shared by every guild
+with the same formula and rebuilt only when the formula changes.
+
+rewrite_levels() recomputes stored levels in id-ordered chunks: for one guild
+after its formula changes, and for every guild in migration 5, which also
+converts the old XP-into-the-current-level values to totals.
+"""
+
+import bisect
+from functools import lru_cache
+
+from sqlalchemy import bindparam, select, update
+
+from database import UserLevel
+
+DEFAULT_BASE_XP = 100
+DEFAULT_MULTIPLIER = 1.5
+DEFAULT_MAX_LEVEL = 100
+
+# no stored total can get past this, so levels beyond it are not built
+XP_LIMIT = 2 ** 63 - 1
+
+
+def calc_level_xp(level: int, base_xp: int, multiplier: float) -> int:
+    """XP needed to go from level to level + 1."""
+    return int(base_xp * (multiplier ** (level - 1)))
+
+
+class LevelTable:
+    __slots__ = ("base_xp", "multiplier", "max_level", "thresholds")
+
+    def __init__(self, base_xp: int = DEFAULT_BASE_XP, multiplier: float = DEFAULT_MULTIPLIER,
+                 max_level: int = DEFAULT_MAX_LEVEL):
+        self.base_xp = max(1, base_xp)
+        self.multiplier = max(1.0, multiplier)
+        self.max_level = max(1, max_level)
+        # thresholds[i] is the total XP at which level i + 1 starts
+        thresholds, total = [0], 0
+        for level in range(1, self.max_level):
+            try:
+                total += max(1, calc_level_xp(level, self.base_xp, self.multiplier))
+            except OverflowError:
+                break
+            if total > XP_LIMIT:
+                break
+            thresholds.append(total)
+        self.thresholds = thresholds
+
+    @classmethod
+    def for_config(cls, config) -> "LevelTable":
+        """The table for a LevelConfig row or snapshot; None gives the defaults."""
+        if config is None:
+            return _table(DEFAULT_BASE_XP, DEFAULT_MULTIPLIER, DEFAULT_MAX_LEVEL)
+        return _table(
+            config.level_base_xp or DEFAULT_BASE_XP,
+            config.level_multiplier or DEFAULT_MULTIPLIER,
+            config.max_level or DEFAULT_MAX_LEVEL,
+        )
+
+    @property
+    def top_level(self) -> int:
+        """Highest reachable level: max_level, unless its threshold would not fit in XP_LIMIT."""
+        return len(self.thresholds)
+
+    def level_for(self, total_xp: int) -> int:
+        return bisect.bisect_right(self.thresholds, max(total_xp or 0, 0)) or 1
+
+    def threshold(self, level: int) -> int:
+        """Total XP at which level starts."""
+        return self.thresholds[min(max(level, 1), self.top_level) - 1]
+
+    def progress(self, total_xp: int) -> tuple[int, int, int | None]:
+        """(level, XP into it, XP the level takes); the last is None at the top level."""
+        level = self.level_for(total_xp)
+        into = (total_xp or 0) - self.threshold(level)
+        if level >= self.top_level:
+            return level, into, None
+        return level, into, self.thresholds[level] - self.thresholds[level - 1]
+
+
+@lru_cache(maxsize=256)
+def _table(base_xp: int, multiplier: float, max_level: int) -> LevelTable:
+    return LevelTable(base_xp, multiplier, max_level)
+
+
+def rewrite_levels(bind, table_for, guild_id: int | None = None, from_level_xp: bool = False,
+                   after_id: int = 0, checkpoint=None, batch_size: int = 1000) -> int:
+    """Set each member's level from their total XP, for one guild or all of them, in
+    id-ordered chunks of one transaction each. table_for(guild_id) gives the LevelTable.
+    With from_level_xp, xp first goes from XP-into-the-level to the total.
+    checkpoint(conn, last_id) runs inside each chunk's transaction. Returns rows changed.
+
+    Write-behind flushes may commit XP between a chunk's read and its write, so each
+    UPDATE only applies if xp is still what was read. Otherwise only level is written
+    and the chunk is read again; a conversion, which runs before the bot writes
+    anything, fails instead, since converting a row twice would corrupt it.
+    """
+    values = {"level": bindparam("new_level")}
+    if from_level_xp:
+        values["xp"] = bindparam("new_xp")
+    stmt = (
+        update(UserLevel)
+        .where(UserLevel.id == bindparam("row_id"), UserLevel.xp.is_not_distinct_from(bindparam("old_xp")))
+        .values(**values)
+    )
+    last_id, changed = after_id, 0
+    while True:
+        with bind.begin() as conn:
+            query = select(UserLevel.id, UserLevel.guild_id, UserLevel.level, UserLevel.xp).where(UserLevel.id > last_id)
+            if guild_id is not None:
+                query = query.where(UserLevel.guild_id == guild_id)
+            rows = conn.execute(query.order_by(UserLevel.id).limit(batch_size)).all()
+            if not rows:
+                return changed
+            updates = []
+            for row_id, gid, level, stored_xp in rows:
+                level, xp = level or 1, stored_xp or 0
+                table = table_for(gid)
+                total = table.threshold(level) + xp if from_level_xp else xp
+                new_level = table.level_for(total)
+                if new_level != level or total != xp:
+                    updates.append({"row_id": row_id, "old_xp": stored_xp, "new_level": new_level, "new_xp": total})
+            if updates:
+                written = conn.execute(stmt, updates).rowcount
+                changed += written
+                if written < len(updates):
+                    if from_level_xp:
+                        raise RuntimeError("user_levels.xp changed while it was being converted to totals")
+                    # some members gained XP since the read; settle them from the new totals
+                    continue
+            last_id = rows[-1].id
+            if checkpoint is not None:
+                checkpoint(conn, last_id)
@@ -0,0 +1,173 @@
+"""
+Event loop lag and blocking-call detection.
+
+A small task on the loop sleeps LOOP_SAMPLE_MS at a time. How late it wakes
+up is the scheduling lag every other coroutine sees, and each wake-up also
+refreshes a heartbeat. A watchdog thread reads the heartbeat. When it is
+older than LOOP_BLOCK_MS, some callback is holding the loop: the watchdog
+captures the loop thread's stack while it is still blocked, names the cog
+handler from it, and, once the loop moves again, records how long the stall
+lasted and logs it.
+
+Stacks are taken with sys._current_frames(), so nothing needs to be
+instrumented in advance and the cost while the loop is healthy is one
+timestamp per sample.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("alfheim_bot.loop")
+
+LOOP_SAMPLE_MS = float(os.getenv("LOOP_SAMPLE_MS", "100"))
+LOOP_BLOCK_MS = float(os.getenv("LOOP_BLOCK_MS", "100"))
+LAG_SAMPLES = 600
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# frames from these directories name the handler; other project frames are plumbing
+HANDLER_DIRS = ("cogs", "ai")
+
+
+@dataclass
+class BlockStats:
+    handler: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    site: str = ""
+    stack: list = field(default_factory=list, repr=False)
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+def _project_path(filename: str) -> str | None:
+    path = os.path.abspath(filename)
+    if not path.startswith(ROOT + os.sep) or f"{os.sep}site-packages{os.sep}" in path:
+        return None
+    return os.path.relpath(path, ROOT)
+
+
+def describe_stack(frame) -> tuple[str, str, list[str]]:
+    """(handler, blocking site, formatted stack) for a frame of the blocked loop thread."""
+    stack = traceback.extract_stack(frame)
+    handler = site = None
+    frames = frame
+    while frames is not None:
+        path = _project_path(frames.f_code.co_filename)
+        if path and path != os.path.basename(__file__):
+            if site is None:
+                site = f"{path}:{frames.f_lineno}"
+            if handler is None and path.split(os.sep)[0] in HANDLER_DIRS:
+                # co_qualname is new in 3.11; 3.10 only has the bare function name
+                handler = f"{path}:{getattr(frames.f_code, 'co_qualname', frames.f_code.co_name)}"
+        frames = frames.f_back
+    if handler is None:
+        handler = site.rsplit(":", 1)[0] if site else "(outside the bot)"
+    return handler, site or "", traceback.format_list(stack[-15:])
+
+
+class LoopMonitor:
+    def __init__(self, sample_ms: float = LOOP_SAMPLE_MS, block_ms: float = LOOP_BLOCK_MS):
+        self.interval = sample_ms / 1000
+        self.threshold = block_ms / 1000
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.blocks: dict[str, BlockStats] = {}
+        self._lock = threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    # loop side
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.lags.append(max(0.0, now - started - self.interval) * 1000)
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # watchdog side
+
+    def _watch(self):
+        check = min(self.interval, self.threshold) / 2
+        stalled_since = None
+        captured = None
+        while not self._stopping.wait(check):
+            heartbeat = self._heartbeat
+            now = time.monotonic()
+            if stalled_since is not None and heartbeat != stalled_since:
+                # the loop came back; the stall lasted until roughly this heartbeat
+                self.record(*captured, (heartbeat - stalled_since - self.interval) * 1000)
+                stalled_since = captured = None
+            if stalled_since is None and now - heartbeat > self.interval + self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    captured = describe_stack(frame)
+                    stalled_since = heartbeat
+
+    def record(self, handler: str, site: str, stack: list[str], blocked_ms: float):
+        with self._lock:
+            stats = self.blocks.get(handler)
+            if stats is None:
+                stats = self.blocks[handler] = BlockStats(handler)
+            stats.count += 1
+            stats.total_ms += blocked_ms
+            if blocked_ms >= stats.max_ms:
+                stats.max_ms = blocked_ms
+                stats.site = site
+                stats.stack = stack
+        logger.warning(f"event loop blocked {blocked_ms:.0f}ms in {handler} at {site}\n{''.join(stack[-5:]).rstrip()}")
+
+    # reporting
+
+    def lag_summary(self) -> dict:
+        samples = sorted(self.lags)
+        if not samples:
+            return {"samples": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "samples": len(samples),
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": samples[-1],
+        }
+
+    def top(self, limit: int = 10, key: str = "total_ms") -> list[BlockStats]:
+        with self._lock:
+            items = list(self.blocks.values())
+        return sorted(items, key=lambda s: getattr(s, key), reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.blocks.clear()
+        self.lags.clear()
+
+
+loop_monitor = LoopMonitor()
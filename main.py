@@ -1,6 +1,12 @@
 import os
 import asyncio
+import time
 import logging
+import startup_profile
+
+# before any heavy import, so STARTUP_PROFILE=1 sees all of them
+startup_profile.install()
+
 import discord
 from dotenv import load_dotenv
 from discord.ext import commands, tasks
@@ -8,6 +14,7 @@ from discord.ext import commands, tasks
 load_dotenv()
 
 BOT_VERSION = "2026.6.6"
+PROCESS_STARTED = time.perf_counter()
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,7 +23,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("alfheim_bot")
 
-from github import Github, Auth
 from database import (
     SessionLocal,
     TrackedUser,
@@ -24,25 +30,163 @@ from database import (
     ReleaseSnapshot,
     GuildConfig,
     TempBan,
+    get_or_create,
     init_db,
+    engine,
+    read_engine,
+    async_engine,
 )
+from config_cache import config_cache
 from datetime import datetime, timezone
 from typing import Optional
-from functools import lru_cache
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
+from batch_writer import batch_writer
+from xp_engine import xp_engine
+from voice_sessions import voice_sessions
+from analytics import analytics
+from instrumentation import begin_handler
+from sharding import shard_filter, sharding_options, shard_monitor
+from leader import LeaderElection
+from loop_monitor import loop_monitor
+from executors import run_in, shutdown_all as shutdown_executors
+from command_sync import DEV_GUILD_ID, scope_for, sync_tree
+from metrics import (
+    cache_entries, command_latency, db_pool_connections, gateway_events, github_calls,
+    github_rate_remaining, listener_latency, metrics_server,
+)
+
+# jobs that must run in one worker only when launcher.py starts several
+leader = LeaderElection("singleton-jobs")
+
+
+class AlfheimCommandTree(discord.app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        command = interaction.command
+        begin_handler(f"/{command.qualified_name}" if command else f"interaction:{interaction.type.name}")
+        return True
+
+    async def _call(self, interaction: discord.Interaction):
+        started = time.perf_counter()
+        try:
+            await super()._call(interaction)
+        finally:
+            command = interaction.command
+            if command is not None:
+                if interaction.type is discord.InteractionType.autocomplete:
+                    outcome = "autocomplete"
+                else:
+                    outcome = "error" if interaction.command_failed else "ok"
+                command_latency.observe(time.perf_counter() - started, command.qualified_name, outcome)
+
+
+class AlfheimBotMixin:
+    first_ready = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.background_tasks = set()
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Run coro in the background, keeping a reference until it finishes and cancelling it on close."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def setup_hook(self):
+        await setup_bot(self)
+
+    def dispatch(self, event_name, /, *args, **kwargs):
+        if event_name == "socket_event_type":
+            gateway_events.inc(args[0])
+        shard_monitor.record_event(self, event_name, args)
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # every listener runs in its own task, so the tag only covers this invocation
+        handler = getattr(coro, "__qualname__", event_name)
+        begin_handler(handler)
+        started = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            listener_latency.observe(time.perf_counter() - started, handler)
+
+    async def close(self):
+        # stop everything that queues writes before the final flush: background tasks,
+        # then the cogs (their listeners and loops, e.g. voice credits) and the gateway
+        leader.stop()
+        tasks = [task for task in self.background_tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        loop_monitor.stop()
+        await super().close()
+        try:
+            await batch_writer.close()
+        except Exception as e:
+            logger.error(f"Failed to flush pending writes on shutdown: {e}")
+        analytics.shutdown()
+        shutdown_executors()
+        await metrics_server.stop()
+
+
+class AlfheimBot(AlfheimBotMixin, commands.Bot):
+    pass
+
+
+class AlfheimShardedBot(AlfheimBotMixin, commands.AutoShardedBot):
+    pass
+
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-if GITHUB_TOKEN:
-    auth = Auth.Token(GITHUB_TOKEN)
-    g = Github(auth=auth)
+shard_options = sharding_options()
+if shard_options is None:
+    bot = AlfheimBot(command_prefix="!", intents=intents, tree_cls=AlfheimCommandTree)
 else:
-    g = None
+    bot = AlfheimShardedBot(command_prefix="!", intents=intents, tree_cls=AlfheimCommandTree, **shard_options)
+
+@db_pool_connections.set_function
+def _pool_connections():
+    values = {}
+    for name, pool in (("main", engine.pool), ("analytics", read_engine.pool), ("async", async_engine.sync_engine.pool)):
+        if hasattr(pool, "checkedout"):
+            values[(name, "checked_out")] = pool.checkedout()
+            values[(name, "idle")] = pool.checkedin()
+            values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+@cache_entries.set_function
+def _cache_entries():
+    from ai.chat import conversation_history
+
+    return {
+        "config": len(config_cache),
+        "write_behind": batch_writer.pending,
+        "discord_messages": len(bot.cached_messages),
+        "discord_users": len(bot.users),
+        "ai_conversations": len(conversation_history),
+        "xp_states": len(xp_engine),
+        "voice_sessions": len(voice_sessions),
+    }
+
+
+_github = None
+
+
+def get_github():
+    """The PyGithub client, or None without GITHUB_TOKEN; PyGithub is only imported on first use."""
+    global _github
+    if _github is None and GITHUB_TOKEN:
+        from github import Auth, Github
+        _github = Github(auth=Auth.Token(GITHUB_TOKEN))
+    return _github
 
 MESSAGES = {
     "ru": {
@@ -215,29 +359,23 @@ MESSAGES = {
 bot.MESSAGES = MESSAGES
 
 
-@lru_cache(maxsize=128)
 def _get_cached_lang(guild_id: int) -> str:
-    """Cache guild language to avoid DB calls on every message"""
-    session = SessionLocal()
-    try:
-        config = session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-        if config and config.language:
-            return str(config.language)
-        return "ru"
-    finally:
-        session.close()
+    """Guild language from the shared config cache (no DB call once loaded)"""
+    config = config_cache.get(GuildConfig, guild_id)
+    if config and config.language:
+        return str(config.language)
+    return "ru"
 
 
 def invalidate_lang_cache(guild_id: int):
-    _get_cached_lang.cache_clear()
+    config_cache.invalidate(guild_id, GuildConfig)
 
 
 def get_config(session, guild_id: int):
-    config = session.query(GuildConfig).filter_by(guild_id=guild_id).first()
-    if not config:
-        config = GuildConfig(guild_id=guild_id)
-        session.add(config)
-        session.commit()
+    config, created = get_or_create(session, GuildConfig, guild_id=guild_id)
+    if created:
+        # Core inserts bypass the ORM flush hooks; have the caller's commit invalidate the cache
+        session.info.setdefault("config_cache_touched", set()).add((GuildConfig, guild_id))
     return config
 
 
@@ -255,9 +393,8 @@ from discord import app_commands
 
 
 async def async_commit(session):
-    """Run session.commit() in a thread executor to avoid blocking the event loop"""
-    loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, session.commit)
+    """Run session.commit() on the db executor to avoid blocking the event loop"""
+    await run_in("db", session.commit)
 
 
 @tasks.loop(minutes=1)
@@ -265,7 +402,9 @@ async def check_temp_bans():
     session = SessionLocal()
     try:
         now = datetime.now(timezone.utc).replace(tzinfo=None)
-        expired_bans = session.query(TempBan).filter(TempBan.unban_time <= now).all()
+        expired_bans = session.query(TempBan).filter(
+            TempBan.unban_time <= now, shard_filter(bot, TempBan.guild_id)
+        ).all()
         for ban in expired_bans:
             guild = bot.get_guild(ban.guild_id)
             if guild:
@@ -298,10 +437,16 @@ async def check_temp_bans():
         session.close()
 
 
+@check_temp_bans.before_loop
+async def before_check_temp_bans():
+    await bot.wait_until_ready()
+
+
 @tasks.loop(minutes=2)
 async def update_status():
     session = SessionLocal()
     try:
+        # presence is per gateway connection, so every worker sets it, with the cluster-wide count
         repo_count = session.query(RepoSnapshot).count()
         activity = discord.Activity(
             type=discord.ActivityType.watching,
@@ -314,13 +459,25 @@ async def update_status():
         session.close()
 
 
+@update_status.before_loop
+async def before_update_status():
+    await bot.wait_until_ready()
+
+
 async def github_api_call(call_func, *args, max_retries=3, **kwargs):
     """Async wrapper for GitHub API with rate limiting"""
     for attempt in range(max_retries):
         try:
-            return await asyncio.to_thread(call_func, *args, **kwargs)
+            result = await run_in("github", call_func, *args, **kwargs)
+            github_calls.inc("ok")
+            if _github is not None:
+                # known from the last response's headers, no extra request
+                github_rate_remaining.set(_github.rate_limiting[0])
+            return result
         except Exception as e:
-            if "rate limit" in str(e).lower() and attempt < max_retries - 1:
+            rate_limited = "rate limit" in str(e).lower()
+            github_calls.inc("rate_limited" if rate_limited else "error")
+            if rate_limited and attempt < max_retries - 1:
                 wait = 60 * (attempt + 1)
                 logger.warning(f"GitHub rate limited, waiting {wait}s...")
                 await asyncio.sleep(wait)
@@ -328,12 +485,65 @@ async def github_api_call(call_func, *args, max_retries=3, **kwargs):
             raise
 
 
-@bot.event
-async def on_ready():
-    if bot.user:
-        logger.info(f"Logged in as {bot.user.name}")
-        logger.info(f"Bot Version: {BOT_VERSION}")
+def discover_extensions(root: str = "./cogs") -> list[str]:
+    """Extension names for every cog module and cog package under root, plus the AI chat cog."""
+    names = []
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if entry.startswith("__"):
+            continue
+        if entry.endswith(".py"):
+            names.append(f"cogs.{entry[:-3]}")
+        elif os.path.exists(os.path.join(path, "__init__.py")):
+            names.append(f"cogs.{entry}")
+    names.append("ai.chat")
+    return names
+
+
+async def load_extensions(client, names) -> dict[str, float]:
+    """Load extensions concurrently; returns load time in ms for each one that loaded."""
+
+    async def load(name):
+        started = time.perf_counter()
+        await client.load_extension(name)
+        return (time.perf_counter() - started) * 1000
+
+    timings = {}
+    results = await asyncio.gather(*(load(name) for name in names), return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to load {name}: {result}")
+        else:
+            timings[name] = result
+    return timings
+
+
+def _persistent_view_specs():
+    from database import VerificationConfig, TicketCategory
+
+    session = SessionLocal()
+    try:
+        ticket_categories = {}
+        for tgid, name in session.query(TicketCategory.guild_id, TicketCategory.name).all():
+            ticket_categories.setdefault(tgid, []).append(name)
+        verification_guilds = [gid for (gid,) in session.query(VerificationConfig.guild_id).all()]
+        return list(ticket_categories.values()), verification_guilds
+    finally:
+        session.close()
 
+
+async def register_persistent_views(client):
+    from cogs.tickets import TicketPersistentView
+    from cogs.verifications.verification import VerificationView
+
+    ticket_categories, verification_guilds = await run_in("db", _persistent_view_specs)
+    for cat_names in ticket_categories:
+        client.add_view(TicketPersistentView(cat_names, "dropdown", 0x2ecc71))
+    for gid in verification_guilds:
+        client.add_view(VerificationView(gid, "buttons"))
+
+
+async def check_for_updates():
     try:
         from update_checker import check_and_update
         logger.info("🔍 Checking for updates...")
@@ -350,67 +560,66 @@ async def on_ready():
     except Exception as e:
         logger.error(f"Failed to check for updates: {e}")
 
-    init_db()
-
-    if not update_status.is_running():
-        update_status.start()
-
-    for entry in os.listdir("./cogs"):
-        path = os.path.join("./cogs", entry)
-        if entry.startswith("__"):
-            continue
-        if entry.endswith(".py"):
-            try:
-                await bot.load_extension(f"cogs.{entry[:-3]}")
-                logger.info(f"Loaded cog: {entry}")
-            except Exception as e:
-                logger.error(f"Failed to load cog {entry}: {e}")
-        elif os.path.isdir(path):
-            init_file = os.path.join(path, "__init__.py")
-            if os.path.exists(init_file):
-                try:
-                    await bot.load_extension(f"cogs.{entry}")
-                    logger.info(f"Loaded cog package: {entry}")
-                except Exception as e:
-                    logger.error(f"Failed to load cog package {entry}: {e}")
-
-    from cogs.tickets import TicketPersistentView
-    from cogs.verifications.verification import VerificationView
-    from database import VerificationConfig, TicketCategory
-
-    session = SessionLocal()
-    try:
-        ticket_guilds = session.query(TicketCategory.guild_id).distinct().all()
-        for (tgid,) in ticket_guilds:
-            cats = session.query(TicketCategory.name).filter_by(guild_id=tgid).all()
-            cat_names = [c[0] for c in cats]
-            mode = "dropdown"
-            color = 0x2ecc71
-            bot.add_view(TicketPersistentView(cat_names, mode, color))
-
-        vconfigs = session.query(VerificationConfig).all()
-        for vc in vconfigs:
-            bot.add_view(VerificationView(vc.guild_id, "buttons"))
-    finally:
-        session.close()
 
+async def sync_commands():
     try:
-        await bot.load_extension("ai.chat")
-        logger.info("Loaded AI chat cog")
+        guild = None
+        if DEV_GUILD_ID:
+            guild = discord.Object(id=DEV_GUILD_ID)
+            bot.tree.copy_global_to(guild=guild)
+        synced = await sync_tree(bot.tree, guild=guild)
+        if synced is not None:
+            logger.info(f"Synced {synced} command(s) to {scope_for(guild)}")
     except Exception as e:
-        logger.error(f"Failed to load AI chat cog: {e}")
+        logger.error(f"Error syncing commands: {e}")
 
-    if not check_temp_bans.is_running():
-        check_temp_bans.start()
 
-    try:
-        synced = await bot.tree.sync()
-        logger.info(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        logger.error(f"Error syncing commands: {e}")
+async def setup_bot(client):
+    """One-time startup, run from setup_hook before the gateway connects."""
+    started = time.perf_counter()
+    loop_monitor.start()
+    if metrics_server.port:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Failed to start metrics server on port {metrics_server.port}: {e}")
+    # network calls that nothing else waits for
+    client.spawn(check_for_updates())
+
+    phase = time.perf_counter()
+    await run_in("db", init_db)
+    startup_profile.record("init_db", (time.perf_counter() - phase) * 1000)
+    phase = time.perf_counter()
+    timings = await load_extensions(client, discover_extensions())
+    startup_profile.record("load extensions (wall)", (time.perf_counter() - phase) * 1000)
+    for name, ms in sorted(timings.items(), key=lambda kv: -kv[1]):
+        logger.info(f"Loaded {name} ({ms:.0f} ms)")
+        startup_profile.record(f"load {name}", ms)
+    phase = time.perf_counter()
+    await register_persistent_views(client)
+    startup_profile.record("persistent views", (time.perf_counter() - phase) * 1000)
+    if GITHUB_TOKEN:
+        # import PyGithub in the background rather than in the first command that needs it
+        client.spawn(run_in("github", get_github))
+
+    update_status.start()
+    check_temp_bans.start()
+    leader.start()
+    client.spawn(sync_commands())
+    startup_profile.record("setup_hook", (time.perf_counter() - started) * 1000)
+    logger.info(f"Setup finished in {time.perf_counter() - started:.2f}s")
+    startup_profile.finish()
 
-    if not check_github_updates.is_running():
-        check_github_updates.start()
+
+@bot.event
+async def on_ready():
+    # fires again after every reconnect that cannot resume, so it only logs
+    if bot.user:
+        logger.info(f"Logged in as {bot.user.name}")
+    if bot.first_ready is None:
+        bot.first_ready = time.perf_counter()
+        logger.info(f"Bot Version: {BOT_VERSION}")
+        logger.info(f"Ready {bot.first_ready - PROCESS_STARTED:.2f}s after start")
 
 
 @bot.tree.command(name="set_channel", description="Sets the notification channel")
@@ -740,6 +949,7 @@ async def version_slash(interaction: discord.Interaction):
 
 @bot.tree.command(name="add_user", description="Adds a GitHub user to track")
 async def add_user_slash(interaction: discord.Interaction, github_username: str):
+    g = get_github()
     if not interaction.guild or not g:
         return
     await interaction.response.defer()
@@ -753,10 +963,10 @@ async def add_user_slash(interaction: discord.Interaction, github_username: str)
             return
 
         try:
-            github_user = await asyncio.to_thread(g.get_user, github_username)
+            github_user = await github_api_call(g.get_user, github_username)
             username_to_store = github_user.login
         except Exception:
-            search_results = await asyncio.to_thread(g.search_users, github_username)
+            search_results = await github_api_call(g.search_users, github_username)
             if search_results.totalCount > 0:
                 github_user = search_results[0]
                 username_to_store = github_user.login
@@ -784,7 +994,7 @@ async def add_user_slash(interaction: discord.Interaction, github_username: str)
         session.flush()
 
         repo_count = 0
-        repos = await asyncio.to_thread(list, github_user.get_repos())
+        repos = await github_api_call(list, github_user.get_repos())
         for repo in repos:
             pushed_at = repo.pushed_at
             if pushed_at.tzinfo is None:
@@ -836,10 +1046,14 @@ async def remove_user_slash(interaction: discord.Interaction, github_username: s
 
 @tasks.loop(minutes=5)
 async def check_github_updates():
+    if not leader.is_leader:
+        return
+    g = get_github()
     if not g:
         return
     session = SessionLocal()
     try:
+        # only the leader polls, so it covers every guild, including those on other workers' shards
         tracked_users = session.query(TrackedUser).all()
         for user_record in tracked_users:
             config = (
@@ -851,17 +1065,20 @@ async def check_github_updates():
                 continue
 
             channel = bot.get_channel(config.target_channel_id)
-            if not channel or not hasattr(channel, "send"):
+            if channel is None:
+                # a guild held by another worker: post over REST without its cache
+                channel = bot.get_partial_messageable(config.target_channel_id, guild_id=user_record.guild_id)
+            elif not hasattr(channel, "send"):
                 continue
 
             lang = str(config.language or "ru")
             msgs = MESSAGES.get(lang, MESSAGES["ru"])
 
             try:
-                github_user = await asyncio.to_thread(
+                github_user = await github_api_call(
                     g.get_user, user_record.github_username
                 )
-                repos = await asyncio.to_thread(list, github_user.get_repos())
+                repos = await github_api_call(list, github_user.get_repos())
                 current_repos = {repo.name: repo for repo in repos}
                 snapshots = {
                     s.repo_name: s
@@ -955,7 +1172,7 @@ async def check_github_updates():
                         embed.timestamp = repo_pushed_at
 
                         try:
-                            commits = await asyncio.to_thread(list, repo.get_commits(since=old_push))
+                            commits = await github_api_call(list, repo.get_commits(since=old_push))
                             commit_list = []
                             commit_count = 0
 
@@ -1003,7 +1220,7 @@ async def check_github_updates():
 
                 for repo_name, repo in current_repos.items():
                     try:
-                        releases = await asyncio.to_thread(list, repo.get_releases())
+                        releases = await github_api_call(list, repo.get_releases())
                         if not releases:
                             continue
 
@@ -1103,6 +1320,22 @@ async def check_github_updates():
         session.close()
 
 
+@check_github_updates.before_loop
+async def before_check_github_updates():
+    await bot.wait_until_ready()
+
+
+@leader.on_elected
+def start_singleton_jobs():
+    if not check_github_updates.is_running():
+        check_github_updates.start()
+
+
+@leader.on_lost
+def stop_singleton_jobs():
+    check_github_updates.cancel()
+
+
 if __name__ == "__main__":
     if not DISCORD_TOKEN:
         logger.critical("Error: DISCORD_TOKEN must be set in .env")
@@ -0,0 +1,261 @@
+"""
+Prometheus-style metrics served from inside the bot.
+
+Counters, gauges and histograms live in one registry and are rendered in the
+Prometheus text format at /metrics by a small aiohttp server. The server
+only runs when METRICS_PORT is set; it binds to METRICS_HOST (localhost by
+default). Workers started by launcher.py add their CLUSTER_WORKER index to
+the port so each process can be scraped separately.
+
+Updating a metric is a dict lookup and an addition under a lock, so it is
+safe from threads (work on the executors.py pools) and cheap enough
+for every gateway event. Values that already exist elsewhere (pool usage,
+cache sizes) are read at scrape time through Gauge.set_function().
+"""
+
+import bisect
+import logging
+import os
+import threading
+
+logger = logging.getLogger("alfheim_bot.metrics")
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, values) -> tuple:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        return tuple(str(v) for v in values)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def set_function(self, function):
+        """Compute the gauge at scrape time; function returns a number, or {label values tuple: number}."""
+        self._function = function
+        return function
+
+    def samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception as e:
+                logger.warning(f"metric {self.name} failed to collect: {e}")
+                return []
+            if not isinstance(result, dict):
+                result = {(): result}
+            with self._lock:
+                self._values = {self._key(k if isinstance(k, tuple) else (k,)): v for k, v in result.items()}
+        return super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items()]
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+gateway_events = registry.counter("alfheim_gateway_events_total", "Gateway events received, by type", ["type"])
+command_latency = registry.histogram(
+    "alfheim_command_seconds", "Slash command handling time", ["command", "outcome"])
+listener_latency = registry.histogram("alfheim_listener_seconds", "Event listener run time", ["listener"])
+db_statement_latency = registry.histogram(
+    "alfheim_db_statement_seconds", "SQL statement execution time", ["operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+db_pool_connections = registry.gauge(
+    "alfheim_db_pool_connections", "Database pool connections by engine and state", ["engine", "state"])
+github_calls = registry.counter("alfheim_github_calls_total", "GitHub API calls", ["outcome"])
+github_rate_remaining = registry.gauge("alfheim_github_rate_limit_remaining", "GitHub API requests left in the window")
+ai_in_flight = registry.gauge("alfheim_ai_requests_in_flight", "AI completions queued or running")
+ai_latency = registry.histogram(
+    "alfheim_ai_request_seconds", "AI completion time", ["outcome"],
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0))
+cache_entries = registry.gauge("alfheim_cache_entries", "Entries held in in-memory caches", ["cache"])
+executor_queue_depth = registry.gauge(
+    "alfheim_executor_pending", "Calls queued or running on a bounded executor", ["executor"])
+executor_wait_latency = registry.histogram(
+    "alfheim_executor_wait_seconds", "Time a call waited for an executor thread", ["executor"])
+executor_run_latency = registry.histogram(
+    "alfheim_executor_run_seconds", "Time a call ran on an executor thread", ["executor"],
+    buckets=DEFAULT_BUCKETS + (60.0, 120.0))
+executor_rejected = registry.counter(
+    "alfheim_executor_rejected_total", "Calls refused because the executor queue was full", ["executor"])
+executor_timeouts = registry.counter(
+    "alfheim_executor_timeouts_total", "Calls abandoned after the executor time limit", ["executor"])
+write_behind_failures = registry.counter(
+    "alfheim_write_behind_failures_total", "Write-behind rows that could not be written, by outcome",
+    ["table", "outcome"])
+
+
+class MetricsServer:
+    def __init__(self, host: str = METRICS_HOST, port: int = None):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        from aiohttp import web
+
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"metrics at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def metrics_port() -> int | None:
+    if not METRICS_PORT:
+        return None
+    return int(METRICS_PORT) + int(os.getenv("CLUSTER_WORKER", "0"))
+
+
+metrics_server = MetricsServer(port=metrics_port())
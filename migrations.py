@@ -0,0 +1,401 @@
+"""
+Ordered, versioned schema migrations.
+
+Each migration is a function registered with @migration(version, description)
+and receives a MigrationContext. Pending migrations run in version order on
+startup (database.init_db) and from migrate_database.py. The database records
+the last applied version (PRAGMA user_version on SQLite, the schema_version
+table elsewhere) after every migration, so a crash resumes at the migration
+that failed. Migrations must therefore be safe to re-run: the context
+operations below all are.
+
+Operations:
+    add_column / add_missing_columns   ALTER TABLE ... ADD COLUMN from the models
+    create_index                       merging duplicate rows for unique indexes
+    rebuild_table                      copy into a fresh table, e.g. to change a type
+    backfill                           UPDATE in primary-key chunks with progress
+
+With dry_run=True nothing is written; every operation prints what it would do
+and how many rows it would touch.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import Index, Table, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, LevelConfig, engine, get_schema_version, set_schema_version
+from level_table import LevelTable, rewrite_levels
+
+BACKFILL_BATCH = 1000
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(func):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, description, func))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return register
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def _log(message: str):
+    print(f"[migration] {message}")
+
+
+def _default_sql(column) -> str:
+    if column.default is None:
+        return ""
+    arg = column.default.arg
+    if callable(arg):
+        try:
+            arg = arg()
+        except Exception:
+            return ""
+    if isinstance(arg, str):
+        escaped = arg.replace("'", "''")
+        return f" DEFAULT '{escaped}'"
+    if isinstance(arg, bool):
+        return f" DEFAULT {'TRUE' if arg else 'FALSE'}"
+    if isinstance(arg, (int, float)):
+        return f" DEFAULT {arg}"
+    return ""
+
+
+class MigrationContext:
+    def __init__(self, bind=engine, dry_run: bool = False, log=_log):
+        self.engine = bind
+        self.dry_run = dry_run
+        self.log = log
+        self.dialect = bind.dialect
+        self.quote = bind.dialect.identifier_preparer.quote
+
+    def _table(self, table) -> Table:
+        if isinstance(table, Table):
+            return table
+        if isinstance(table, str):
+            return Base.metadata.tables[table]
+        return table.__table__
+
+    def _inspect(self):
+        return inspect(self.engine)
+
+    def has_table(self, name: str) -> bool:
+        return self._inspect().has_table(name)
+
+    def count(self, table_name: str, where: str | None = None) -> int:
+        if not self.has_table(table_name):
+            return 0
+        sql = f"SELECT COUNT(*) FROM {self.quote(table_name)}"
+        if where:
+            sql += f" WHERE {where}"
+        with self.engine.connect() as conn:
+            return conn.execute(text(sql)).scalar() or 0
+
+    def _estimate(self, action: str, rows: int, chunks: int | None = None):
+        cost = f"~{rows:,} rows"
+        if chunks is not None:
+            cost += f" in {chunks} chunk(s)"
+        self.log(f"would {action} ({cost})")
+
+    # -- columns -------------------------------------------------------------
+
+    def add_column(self, table, column_name: str) -> bool:
+        """Add one model column if the table lacks it. Returns True if it was added."""
+        table = self._table(table)
+        if not self.has_table(table.name):
+            return False
+        existing = {c["name"] for c in self._inspect().get_columns(table.name)}
+        if column_name in existing:
+            return False
+        column = table.c[column_name]
+        if self.dry_run:
+            self._estimate(f"add column {table.name}.{column_name}", self.count(table.name))
+            return False
+
+        col_type = column.type.compile(self.dialect)
+        default = _default_sql(column)
+        # NOT NULL without a default cannot be added to a populated table
+        nullable = "NOT NULL" if not column.nullable and default else "NULL"
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {self.quote(table.name)} ADD COLUMN "
+                f"{self.quote(column.name)} {col_type} {nullable}{default}"
+            ))
+        self.log(f"Added column {table.name}.{column.name}")
+        return True
+
+    def add_missing_columns(self):
+        for table in Base.metadata.sorted_tables:
+            for column in table.columns:
+                try:
+                    self.add_column(table, column.name)
+                except Exception as e:
+                    self.log(f"Skipped {table.name}.{column.name}: {e}")
+
+    # -- indexes -------------------------------------------------------------
+
+    def create_index(self, index: Index):
+        """Create a model index if missing. A unique index that fails on existing
+        duplicates first collapses them into the lowest id per key (the row .first()
+        has been updating); see _dedupe_rows.
+        """
+        table = index.table
+        if not self.has_table(table.name):
+            return
+        existing = {ix["name"] for ix in self._inspect().get_indexes(table.name)}
+        existing |= {uq["name"] for uq in self._inspect().get_unique_constraints(table.name)}
+        if index.name in existing:
+            return
+        if self.dry_run:
+            self._estimate(f"create index {index.name} on {table.name}", self.count(table.name))
+            return
+        started = time.monotonic()
+        try:
+            index.create(bind=self.engine, checkfirst=True)
+        except IntegrityError:
+            if not index.unique:
+                raise
+            merged, removed = self._dedupe_rows(index)
+            self.log(f"Merged {merged} duplicate keys in {table.name} for {index.name}, "
+                     f"removing {removed} rows")
+            index.create(bind=self.engine, checkfirst=True)
+        self.log(f"Created index {index.name} in {time.monotonic() - started:.1f}s")
+
+    def create_model_indexes(self, tables=None):
+        for table in tables or Base.metadata.sorted_tables:
+            for index in self._table(table).indexes:
+                self.create_index(index)
+
+    def _dedupe_rows(self, index: Index) -> tuple[int, int]:
+        """Collapse rows sharing a unique index key into the lowest id, in one transaction.
+
+        index.info["merge"] maps columns to "sum" or "max"; each is aggregated over
+        the duplicates into the kept row before the rest are deleted. An index
+        without a merge entry fails instead, so no counter is dropped silently.
+        Returns (keys merged, rows removed).
+        """
+        table = index.table
+        merge = index.info.get("merge")
+        if merge is None:
+            raise RuntimeError(
+                f"{table.name} has duplicate rows for unique index {index.name} and the index "
+                f"declares no merge rule; merge them by hand or add info={{'merge': ...}} to it"
+            )
+        name = self.quote(table.name)
+        cols = ", ".join(self.quote(c.name) for c in index.columns)
+        aggregates = "".join(
+            f", SUM(COALESCE({self.quote(col)}, 0))" if how == "sum" else f", MAX({self.quote(col)})"
+            for col, how in merge.items()
+        )
+        with self.engine.begin() as conn:
+            groups = conn.execute(text(
+                f"SELECT MIN(id){aggregates} FROM {name} GROUP BY {cols} HAVING COUNT(*) > 1"
+            )).all()
+            if merge and groups:
+                assignments = ", ".join(f"{self.quote(col)} = :{col}" for col in merge)
+                conn.execute(
+                    text(f"UPDATE {name} SET {assignments} WHERE id = :keep_id"),
+                    [{"keep_id": row[0], **dict(zip(merge, row[1:]))} for row in groups],
+                )
+            result = conn.execute(text(
+                f"DELETE FROM {name} WHERE id NOT IN "
+                f"(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {name} GROUP BY {cols}) AS keep)"
+            ))
+            return len(groups), result.rowcount
+
+    # -- table rebuilds ------------------------------------------------------
+
+    def rebuild_table(self, table, cast: tuple[str, ...] = (), expressions: dict[str, str] | None = None):
+        """Recreate a table from its current model definition and copy the rows over.
+
+        This is how column types change (SQLite has no ALTER COLUMN): columns in
+        cast are converted with CAST(col AS <new type>), expressions maps a new
+        column to arbitrary SQL over the old columns. Columns present in both
+        versions are copied unchanged; new ones get their defaults. Runs in one
+        transaction. Tables referenced by foreign keys on other backends must be
+        handled by hand.
+        """
+        table = self._table(table)
+        if not self.has_table(table.name):
+            return
+        old_columns = {c["name"] for c in self._inspect().get_columns(table.name)}
+        expressions = dict(expressions or {})
+        for name in cast:
+            col_type = table.c[name].type.compile(self.dialect)
+            expressions[name] = f"CAST({self.quote(name)} AS {col_type})"
+        targets = [c.name for c in table.columns if c.name in old_columns or c.name in expressions]
+        if self.dry_run:
+            self._estimate(f"rebuild {table.name} ({', '.join(sorted(expressions)) or 'no conversions'})",
+                           self.count(table.name))
+            return
+
+        tmp_name = f"{table.name}__rebuild"
+        tmp_meta = type(table.metadata)()
+        tmp = Table(tmp_name, tmp_meta, *(c._copy() for c in table.columns))
+        source = ", ".join(expressions.get(name, self.quote(name)) for name in targets)
+        target = ", ".join(self.quote(name) for name in targets)
+        rows = self.count(table.name)
+        started = time.monotonic()
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.quote(tmp_name)}"))
+            tmp.create(bind=conn)
+            conn.execute(text(
+                f"INSERT INTO {self.quote(tmp_name)} ({target}) SELECT {source} FROM {self.quote(table.name)}"
+            ))
+            conn.execute(text(f"DROP TABLE {self.quote(table.name)}"))
+            conn.execute(text(f"ALTER TABLE {self.quote(tmp_name)} RENAME TO {self.quote(table.name)}"))
+            if self.dialect.name == "postgresql" and "id" in table.c:
+                # the copied ids came with explicit values; move the new serial past them
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence(:t, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                    f"FROM {self.quote(table.name)}"
+                ), {"t": table.name})
+            for index in table.indexes:
+                index.create(bind=conn)
+        self.log(f"Rebuilt {table.name}: {rows:,} rows in {time.monotonic() - started:.1f}s")
+
+    # -- data backfills ------------------------------------------------------
+
+    def backfill(self, table, assignments: dict[str, str], where: str | None = None,
+                 params: dict | None = None, batch_size: int = BACKFILL_BATCH, key: str = "id") -> int:
+        """UPDATE table SET col = <sql>, ... in key ranges of batch_size rows, one
+        transaction per chunk so writers are never blocked for long. Returns rows updated.
+        """
+        table = self._table(table)
+        if not self.has_table(table.name):
+            return 0
+        name, key_col = self.quote(table.name), self.quote(key)
+        with self.engine.connect() as conn:
+            low, high = conn.execute(text(f"SELECT MIN({key_col}), MAX({key_col}) FROM {name}")).one()
+        if low is None:
+            return 0
+        chunks = math.ceil((high - low + 1) / batch_size)
+        if self.dry_run:
+            self._estimate(f"backfill {table.name}.{', '.join(assignments)}", self.count(table.name, where), chunks)
+            return 0
+
+        set_sql = ", ".join(f"{self.quote(col)} = {expr}" for col, expr in assignments.items())
+        sql = f"UPDATE {name} SET {set_sql} WHERE {key_col} >= :_lo AND {key_col} < :_hi"
+        if where:
+            sql += f" AND ({where})"
+        updated, started, last_report = 0, time.monotonic(), 0.0
+        for chunk, start in enumerate(range(low, high + 1, batch_size), 1):
+            with self.engine.begin() as conn:
+                result = conn.execute(text(sql), {**(params or {}), "_lo": start, "_hi": start + batch_size})
+                updated += max(result.rowcount, 0)
+            elapsed = time.monotonic() - started
+            if chunk == chunks or elapsed - last_report >= 5:
+                last_report = elapsed
+                self.log(f"backfill {table.name}: chunk {chunk}/{chunks} ({chunk * 100 // chunks}%), "
+                         f"{updated:,} rows updated, {elapsed:.1f}s")
+        return updated
+
+
+def pending_migrations(current: int) -> list[Migration]:
+    return [m for m in MIGRATIONS if m.version > current]
+
+
+def current_version(bind=engine) -> int:
+    with bind.begin() as conn:
+        return get_schema_version(conn)
+
+
+def stamp(version: int, bind=engine):
+    with bind.begin() as conn:
+        set_schema_version(conn, version)
+
+
+def run_migrations(bind=engine, dry_run: bool = False, log=_log) -> list[int]:
+    """Apply pending migrations in order; returns the versions applied (or planned)."""
+    current = current_version(bind)
+    ctx = MigrationContext(bind, dry_run=dry_run, log=log)
+    applied = []
+    for m in pending_migrations(current):
+        log(f"{'Planning' if dry_run else 'Applying'} {m.version}: {m.description}")
+        started = time.monotonic()
+        m.apply(ctx)
+        if not dry_run:
+            stamp(m.version, bind)
+            log(f"Applied {m.version} in {time.monotonic() - started:.1f}s")
+        applied.append(m.version)
+    return applied
+
+
+# -- registry ----------------------------------------------------------------
+
+
+@migration(1, "Add columns missing from databases created before versioning")
+def _add_legacy_columns(ctx: MigrationContext):
+    ctx.add_missing_columns()
+
+
+@migration(2, "Message log retention settings on guild_configs")
+def _message_log_retention(ctx: MigrationContext):
+    ctx.add_column("guild_configs", "message_log_retention_days")
+    ctx.add_column("guild_configs", "message_log_archive")
+
+
+@migration(3, "Composite and unique indexes on hot tables")
+def _hot_table_indexes(ctx: MigrationContext):
+    ctx.create_model_indexes()
+
+
+@migration(4, "Leaderboard index on user_levels")
+def _leaderboard_index(ctx: MigrationContext):
+    # keyset comparisons on (level, xp) skip rows where either is NULL
+    ctx.backfill("user_levels", {"level": "COALESCE(level, 1)", "xp": "COALESCE(xp, 0)"},
+                 where="level IS NULL OR xp IS NULL")
+    ctx.create_model_indexes(["user_levels"])
+
+
+@migration(5, "Total XP and recomputed levels on user_levels")
+def _cumulative_xp(ctx: MigrationContext):
+    if not ctx.has_table("user_levels"):
+        return
+    if ctx.dry_run:
+        ctx._estimate("convert user_levels.xp to totals and recompute levels", ctx.count("user_levels"))
+        return
+    # xp is rewritten in place, so a re-run must resume after the last chunk instead of
+    # converting again
+    with ctx.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS level_xp_migration (last_id BIGINT NOT NULL)"))
+        after_id = conn.execute(text("SELECT MAX(last_id) FROM level_xp_migration")).scalar() or 0
+        tables = {}
+        if ctx.has_table("level_configs"):
+            configs = conn.execute(select(
+                LevelConfig.guild_id, LevelConfig.level_base_xp, LevelConfig.level_multiplier, LevelConfig.max_level,
+            )).all()
+            tables = {row.guild_id: LevelTable.for_config(row) for row in configs}
+    default = LevelTable.for_config(None)
+
+    def checkpoint(conn, last_id: int):
+        conn.execute(text("DELETE FROM level_xp_migration"))
+        conn.execute(text("INSERT INTO level_xp_migration (last_id) VALUES (:id)"), {"id": last_id})
+
+    changed = rewrite_levels(ctx.engine, lambda guild_id: tables.get(guild_id, default), from_level_xp=True,
+                             after_id=after_id, checkpoint=checkpoint, batch_size=BACKFILL_BATCH)
+    # stamped together with dropping the progress table, so no re-run can find
+    # converted rows without it
+    with ctx.engine.begin() as conn:
+        conn.execute(text("DROP TABLE level_xp_migration"))
+        set_schema_version(conn, 5)
+    ctx.log(f"Converted user_levels to total XP, {changed} rows changed")
@@ -0,0 +1,249 @@
+"""
+Per-guild level ranking kept in memory.
+
+/rank counted every UserLevel row ranked above the member on each call,
+and /userstats did the same on the analytics pool. A guild's ranking is now
+built once from the database, on first use, into a sorted container ordered
+by (level, xp) descending, then user id. After that it is updated in place
+whenever xp_engine applies a gain. Rank lookups are a binary search plus a
+Fenwick-tree prefix sum, and top-N pages are slices. Both are O(log n) in
+the member count, versus scanning the guild's rows.
+
+Ranks use competition ranking like the old queries: members with the same
+level and XP share a rank. Guilds not looked at for a while are dropped
+once RANK_INDEX_MAX_GUILDS are loaded, and rebuilt on the next lookup.
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+from collections import OrderedDict
+
+from database import SessionLocal, UserLevel
+from executors import run_in
+from xp_engine import xp_engine
+
+logger = logging.getLogger("alfheim_bot.rank_index")
+
+RANK_INDEX_MAX_GUILDS = int(os.getenv("RANK_INDEX_MAX_GUILDS", "1000"))
+
+
+class SortedList:
+    """A sorted list split into buckets of about LOAD items.
+
+    Inserts and removals touch one bucket; a Fenwick tree over the bucket
+    sizes turns "how many items come before this one" and "the i-th item"
+    into O(log n) walks instead of summing bucket lengths.
+    """
+
+    LOAD = 1000
+
+    def __init__(self, items=()):
+        items = sorted(items)
+        self._buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(items)
+        self._rebuild_tree()
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def _rebuild_tree(self):
+        tree = [0] * (len(self._buckets) + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, bucket_index: int, delta: int):
+        i = bucket_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _items_before(self, bucket_index: int) -> int:
+        total, i = 0, bucket_index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        """(bucket, offset) of the item at position index."""
+        pos = 0
+        step = 1 << (len(self._buckets).bit_length() - 1) if self._buckets else 0
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                pos = nxt
+                index -= self._tree[nxt]
+            step >>= 1
+        return pos, index
+
+    def add(self, item):
+        if not self._buckets:
+            self._buckets, self._maxes, self._len = [[item]], [item], 1
+            self._rebuild_tree()
+            return
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._buckets):
+            i -= 1
+            self._buckets[i].append(item)
+            self._maxes[i] = item
+        else:
+            bisect.insort(self._buckets[i], item)
+        self._len += 1
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, item):
+        i = bisect.bisect_left(self._maxes, item)
+        bucket = self._buckets[i] if i < len(self._buckets) else []
+        j = bisect.bisect_left(bucket, item)
+        if j == len(bucket) or bucket[j] != item:
+            raise ValueError(f"{item!r} not in list")
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i], self._maxes[i]
+            self._rebuild_tree()
+
+    def bisect_left(self, item) -> int:
+        """Number of items less than item."""
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._buckets):
+            return self._len
+        return self._items_before(i) + bisect.bisect_left(self._buckets[i], item)
+
+    def slice(self, start: int, stop: int) -> list:
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        i, j = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            result.extend(self._buckets[i][j:j + stop - start - len(result)])
+            i, j = i + 1, 0
+        return result
+
+
+class GuildRanking:
+    """Members of one guild ordered by (level, xp) descending."""
+
+    def __init__(self, rows=()):
+        self._keys = {user_id: self._key(user_id, level, xp) for user_id, level, xp in rows}
+        self._order = SortedList(self._keys.values())
+
+    @staticmethod
+    def _key(user_id: int, level, xp) -> tuple:
+        return -(level or 1), -(xp or 0), user_id
+
+    def __len__(self):
+        return len(self._order)
+
+    def update(self, user_id: int, level: int, xp: int):
+        key = self._key(user_id, level, xp)
+        old = self._keys.get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            self._order.remove(old)
+        self._keys[user_id] = key
+        self._order.add(key)
+
+    def remove(self, user_id: int):
+        old = self._keys.pop(user_id, None)
+        if old is not None:
+            self._order.remove(old)
+
+    def rank_of(self, level: int, xp: int) -> int:
+        """1 + the number of members strictly ahead of (level, xp)."""
+        return self._order.bisect_left((-(level or 1), -(xp or 0), float("-inf"))) + 1
+
+    def rank(self, user_id: int) -> int | None:
+        key = self._keys.get(user_id)
+        return None if key is None else self.rank_of(-key[0], -key[1])
+
+    def top(self, offset: int = 0, limit: int = 10) -> list[tuple[int, int, int]]:
+        """(user_id, level, xp) for positions offset .. offset + limit."""
+        return [(user_id, -level, -xp) for level, xp, user_id in self._order.slice(offset, offset + limit)]
+
+
+class RankIndex:
+    def __init__(self, session_factory=SessionLocal, max_guilds: int = RANK_INDEX_MAX_GUILDS, engine=xp_engine):
+        self.session_factory = session_factory
+        self.max_guilds = max_guilds
+        self.engine = engine
+        self._guilds: OrderedDict[int, GuildRanking] = OrderedDict()
+        self._building: dict[int, asyncio.Future] = {}
+        # builds in flight when their guild was invalidated; their result is not kept
+        self._stale: set[int] = set()
+        self.builds = 0
+        engine.on_change(self._on_change)
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def _rows(self, guild_id: int) -> list[tuple]:
+        session = self.session_factory()
+        try:
+            return session.query(UserLevel.user_id, UserLevel.level, UserLevel.xp).filter_by(guild_id=guild_id).all()
+        finally:
+            session.close()
+
+    async def guild(self, guild_id: int) -> GuildRanking:
+        ranking = self._guilds.get(guild_id)
+        if ranking is not None:
+            self._guilds.move_to_end(guild_id)
+            return ranking
+        building = self._building.get(guild_id)
+        if building is None:
+            building = self._building[guild_id] = asyncio.ensure_future(self._build(guild_id))
+            building.add_done_callback(lambda _: self._building.pop(guild_id, None))
+        return await asyncio.shield(building)
+
+    async def _build(self, guild_id: int) -> GuildRanking:
+        rows = await run_in("db", self._rows, guild_id)
+        ranking = GuildRanking(rows)
+        # members with gains not flushed yet, including any applied while the rows were read
+        for state in self.engine.states(guild_id):
+            ranking.update(state.user_id, state.level, state.xp)
+        self.builds += 1
+        if guild_id in self._stale:
+            self._stale.discard(guild_id)
+            return ranking
+        self._guilds[guild_id] = ranking
+        while len(self._guilds) > self.max_guilds:
+            self._guilds.popitem(last=False)
+        return ranking
+
+    def _on_change(self, state):
+        ranking = self._guilds.get(state.guild_id)
+        if ranking is not None:
+            ranking.update(state.user_id, state.level, state.xp)
+
+    def invalidate(self, guild_id: int | None = None):
+        """Drop one guild's ranking, or all of them; the next lookup rebuilds it."""
+        guild_ids = list(self._guilds) + list(self._building) if guild_id is None else [guild_id]
+        for gid in guild_ids:
+            self._guilds.pop(gid, None)
+            if gid in self._building:
+                self._stale.add(gid)
+
+
+rank_index = RankIndex()
@@ -0,0 +1,130 @@
+"""
+MessageLog retention.
+
+Rows older than a guild's message_log_retention_days are deleted in small
+chunks (MESSAGE_LOG_PRUNE_BATCH rows per transaction, walking the
+(guild_id, created_at) index) so the pruner never holds the write lock for
+long. Guilds with message_log_archive enabled get the expired rows appended
+to gzip-compressed JSON-lines files, one per guild and day, before they are
+deleted. A retention of 0, the default, keeps logs forever.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import delete
+
+from database import SessionLocal, GuildConfig, MessageLog
+
+logger = logging.getLogger("alfheim_bot.retention")
+
+PRUNE_BATCH = int(os.getenv("MESSAGE_LOG_PRUNE_BATCH", "500"))
+ARCHIVE_DIR = os.getenv("MESSAGE_LOG_ARCHIVE_DIR", os.path.join("db", "archive"))
+# pause between chunks so message inserts can take the lock in between
+PRUNE_PAUSE = 0.05
+
+ARCHIVED_COLUMNS = [c.key for c in MessageLog.__table__.columns]
+
+
+def _serialize(row) -> dict:
+    data = {}
+    for name in ARCHIVED_COLUMNS:
+        value = getattr(row, name)
+        data[name] = value.isoformat() if isinstance(value, datetime.datetime) else value
+    return data
+
+
+def archive_path(guild_id: int, day: datetime.date, archive_dir: str = ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, str(guild_id), f"{day.isoformat()}.jsonl.gz")
+
+
+def archive_rows(guild_id: int, rows, archive_dir: str = ARCHIVE_DIR) -> int:
+    """Append rows to their per-day archive files (gzip members concatenate cleanly)."""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row.created_at.date(), []).append(row)
+    for day, day_rows in by_day.items():
+        path = archive_path(guild_id, day, archive_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for row in day_rows:
+                f.write(json.dumps(_serialize(row), ensure_ascii=False) + "\n")
+    return len(rows)
+
+
+def read_archive(path: str) -> list[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def prune_guild(guild_id: int, retention_days: int, archive: bool = False, now: datetime.datetime = None,
+                session_factory=SessionLocal, batch_size: int = PRUNE_BATCH, archive_dir: str = ARCHIVE_DIR,
+                pause: float = PRUNE_PAUSE) -> int:
+    """Delete (and optionally archive) one guild's expired message logs; returns rows removed."""
+    if not retention_days or retention_days <= 0:
+        return 0
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=retention_days)
+    removed = 0
+    while True:
+        session = session_factory()
+        try:
+            query = (
+                session.query(MessageLog)
+                .filter(MessageLog.guild_id == guild_id, MessageLog.created_at < cutoff)
+                .order_by(MessageLog.created_at)
+                .limit(batch_size)
+            )
+            if archive:
+                rows = query.all()
+                ids = [row.id for row in rows]
+            else:
+                ids = [row_id for (row_id,) in query.with_entities(MessageLog.id)]
+            if not ids:
+                return removed
+            if archive:
+                archive_rows(guild_id, rows, archive_dir)
+            session.execute(delete(MessageLog).where(MessageLog.id.in_(ids)))
+            session.commit()
+            removed += len(ids)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        if len(ids) < batch_size:
+            return removed
+        if pause:
+            time.sleep(pause)
+
+
+def prune_all(now: datetime.datetime = None, session_factory=SessionLocal, where=None, **kwargs) -> dict:
+    """Apply every guild's retention setting; returns {guild_id: rows removed} for guilds that lost rows.
+
+    where optionally narrows the guilds, e.g. to this process's shards.
+    """
+    session = session_factory()
+    try:
+        settings = session.query(
+            GuildConfig.guild_id, GuildConfig.message_log_retention_days, GuildConfig.message_log_archive
+        ).filter(GuildConfig.message_log_retention_days > 0)
+        if where is not None:
+            settings = settings.filter(where)
+        settings = settings.all()
+    finally:
+        session.close()
+
+    results = {}
+    for guild_id, days, archive in settings:
+        try:
+            removed = prune_guild(guild_id, days, bool(archive), now=now, session_factory=session_factory, **kwargs)
+        except Exception as e:
+            logger.error(f"message log pruning failed for guild {guild_id}: {e}")
+            continue
+        if removed:
+            results[guild_id] = removed
+            logger.info(f"pruned {removed} message logs older than {days}d for guild {guild_id}")
+    return results
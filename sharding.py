@@ -0,0 +1,126 @@
+"""
+Shard awareness for a bot that may run as several processes.
+
+SHARD_COUNT switches the bot to discord.py's AutoShardedBot. "auto" lets
+Discord pick the number of shards; a number fixes it, and SHARD_IDS then
+selects which of those shards this process connects (e.g. "0,1" and "2,3"
+on two hosts). Without SHARD_COUNT the bot is a single plain connection.
+
+Discord routes a guild to shard (guild_id >> 22) % shard_count and sends
+direct messages to shard 0. Background loops that walk database rows wrap
+their queries with shard_filter() so that each process only handles the
+guilds it is connected to; unsharded, the filter matches every row.
+"""
+
+import os
+import time
+from collections import defaultdict, deque
+
+import discord
+from sqlalchemy import or_, true
+
+SHARD_COUNT = os.getenv("SHARD_COUNT", "").strip().lower()
+SHARD_IDS = os.getenv("SHARD_IDS", "").strip()
+
+# per-second event buckets kept for the rate
+EVENT_RATE_WINDOW = 60
+
+
+def sharding_options() -> dict | None:
+    """Keyword arguments for AutoShardedBot, or None when sharding is disabled."""
+    if not SHARD_COUNT:
+        return None
+    if SHARD_COUNT == "auto":
+        return {}
+    options = {"shard_count": int(SHARD_COUNT)}
+    if SHARD_IDS:
+        options["shard_ids"] = [int(s) for s in SHARD_IDS.split(",") if s.strip()]
+    return options
+
+
+def shard_for(guild_id: int | None, shard_count: int) -> int:
+    if guild_id is None:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+
+def local_shards(bot) -> tuple[int | None, list[int] | None]:
+    """(shard_count, shard ids run by this process); (None, None) if the bot is not sharded."""
+    count = bot.shard_count
+    if not count or count <= 1:
+        return None, None
+    if isinstance(bot, discord.AutoShardedClient):
+        ids = list(bot.shards) or list(bot.shard_ids or range(count))
+    elif bot.shard_id is not None:
+        ids = [bot.shard_id]
+    else:
+        ids = list(range(count))
+    return count, sorted(ids)
+
+
+def owns_guild(bot, guild_id: int | None) -> bool:
+    count, ids = local_shards(bot)
+    if count is None:
+        return True
+    return shard_for(guild_id, count) in ids
+
+
+def shard_filter(bot, column):
+    """SQL condition limiting a guild id column to the guilds on this process's shards."""
+    count, ids = local_shards(bot)
+    if count is None or len(ids) == count:
+        return true()
+    condition = (column.op(">>")(22) % count).in_(ids)
+    if 0 in ids and column.nullable:
+        # rows without a guild belong to direct messages, which arrive on shard 0
+        condition = or_(column.is_(None), condition)
+    return condition
+
+
+class ShardMonitor:
+    """Counts dispatched gateway events per shard for rate reporting."""
+
+    def __init__(self, window: int = EVENT_RATE_WINDOW):
+        self.window = window
+        self.totals = defaultdict(int)
+        self._buckets = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, shard_id: int, now: float = None):
+        second = int(now if now is not None else time.monotonic())
+        self.totals[shard_id] += 1
+        buckets = self._buckets[shard_id]
+        if buckets and buckets[-1][0] == second:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([second, 1])
+
+    def rate(self, shard_id: int, now: float = None) -> float:
+        """Events per second over the last `window` seconds."""
+        now = int(now if now is not None else time.monotonic())
+        recent = sum(count for second, count in self._buckets.get(shard_id, ()) if now - second < self.window)
+        return recent / self.window
+
+    def record_event(self, bot, event_name: str, args: tuple):
+        if event_name.startswith("socket_"):
+            return
+        count = bot.shard_count or 1
+        if event_name.startswith("shard_") and args and isinstance(args[0], int):
+            shard_id = args[0]
+        else:
+            shard_id = shard_for(_event_guild_id(args), count)
+        self.record(shard_id)
+
+
+def _event_guild_id(args: tuple) -> int | None:
+    if not args:
+        return None
+    first = args[0]
+    if isinstance(first, discord.Guild):
+        return first.id
+    guild = getattr(first, "guild", None)
+    if guild is not None:
+        return guild.id
+    return getattr(first, "guild_id", None)
+
+
+shard_monitor = ShardMonitor()
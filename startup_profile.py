@@ -0,0 +1,109 @@
+"""
+Startup profiler: time per import and per startup phase.
+
+Enable with STARTUP_PROFILE=1 in the process environment (.env is read
+after the first imports, so it is too late there). While active, every
+first-time import made by an import statement is timed, cumulative
+(including the modules it pulls in) and self. setup_bot records extension
+load times and other phases, then logs one report with the top
+STARTUP_PROFILE_TOP imports and the peak RSS, and the profiler uninstalls
+itself.
+
+Off by default; when off, install() does nothing.
+"""
+
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger("alfheim_bot.startup_profile")
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "") not in ("", "0")
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "25"))
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class ImportProfiler:
+    def __init__(self):
+        self.imports: dict[str, tuple[float, float]] = {}
+        self.phases: dict[str, float] = {}
+        self.started = time.perf_counter()
+        self._local = threading.local()
+        self._original = None
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.imports.setdefault(name, (elapsed, elapsed - children))
+
+    def record(self, phase: str, ms: float):
+        self.phases[phase] = ms
+
+    def report(self, top: int = STARTUP_PROFILE_TOP) -> str:
+        total_self = sum(own for _, own in self.imports.values())
+        rss = peak_rss_mb()
+        lines = [
+            f"Startup profile: {time.perf_counter() - self.started:.2f}s since the profiler started"
+            + (f", peak RSS {rss:.0f} MB" if rss is not None else ""),
+            f"{len(self.imports)} modules imported in {total_self:.0f} ms",
+            f"{'cumulative ms':>14}{'self ms':>10}  module",
+        ]
+        for name, (cumulative, own) in sorted(self.imports.items(), key=lambda kv: -kv[1][0])[:top]:
+            lines.append(f"{cumulative:>14.1f}{own:>10.1f}  {name}")
+        if self.phases:
+            lines.append(f"{'ms':>14}  phase")
+            for phase, ms in sorted(self.phases.items(), key=lambda kv: -kv[1]):
+                lines.append(f"{ms:>14.1f}  {phase}")
+        return "\n".join(lines)
+
+
+profiler = ImportProfiler() if STARTUP_PROFILE else None
+
+
+def install():
+    if profiler is not None:
+        profiler.install()
+
+
+def record(phase: str, ms: float):
+    if profiler is not None:
+        profiler.record(phase, ms)
+
+
+def finish():
+    """Log the report and stop timing imports."""
+    if profiler is not None:
+        profiler.uninstall()
+        logger.info(profiler.report())
@@ -0,0 +1,637 @@
+"""
+Gateway event replay and load-test harness.
+
+Drives the real cogs (message pipeline, moderation, levels, statistics,
+welcome, voice channels) with synthetic or recorded events. The discord
+objects are small fakes, and the database is a throwaway SQLite file that
+every session factory in database.py is pointed at while the harness runs.
+Nothing connects to Discord.
+
+Each event is timed per listener (and per pipeline stage for messages),
+and SQL statements are counted per event type and listener. The report
+gives throughput, p50/p99/max latency per listener and statements per
+event, so a slower Levels XP stage or automod shows up before deploy.
+
+    python -m tests.harness                              # 2000 synthetic events, as fast as possible
+    python -m tests.harness --events 5000 --rate 500     # paced at 500 events/s
+    python -m tests.harness --record trace.jsonl         # also save the generated trace
+    python -m tests.harness --trace trace.jsonl --rate 0 # replay a saved trace
+
+A trace is JSON lines, one event per line, e.g.
+    {"type": "message", "guild": 1, "user": 100, "channel": 10, "content": "hi"}
+    {"type": "voice", "guild": 1, "user": 100, "before": null, "after": 20}
+    {"type": "member_join", "guild": 1, "user": 900}
+    {"type": "command", "guild": 1, "user": 100, "name": "rank", "options": {}}
+"""
+
+import argparse
+import asyncio
+import contextvars
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+from discord.ext import commands
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database import (
+    AutoModConfig, Base, GuildConfig, LevelConfig, _apply_sqlite_pragmas, engine_options, to_async_url,
+)
+from batch_writer import batch_writer
+from config_cache import config_cache
+from xp_engine import xp_engine
+from rank_index import rank_index
+from voice_sessions import voice_sessions
+from cogs.levels import leaderboard_cache
+
+COGS = (
+    "cogs.message_pipeline", "cogs.moderation", "cogs.advanced_moderation", "cogs.levels",
+    "cogs.statistics", "cogs.welcome", "cogs.voice_channels",
+)
+
+_event_type = contextvars.ContextVar("harness_event_type", default="(background)")
+_listener = contextvars.ContextVar("harness_listener", default="(background)")
+
+
+# ---------------------------------------------------------------- fake discord objects
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakePermissions:
+    def __init__(self, admin: bool = False):
+        self.administrator = admin
+        self.manage_messages = admin
+
+
+class FakeRole:
+    def __init__(self, role_id: int, guild):
+        self.id = role_id
+        self.guild = guild
+        self.name = f"role-{role_id}"
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.name = self.display_name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.display_avatar = self.avatar = FakeAsset()
+        self.created_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+
+
+class FakeMember(FakeUser):
+    def __init__(self, user_id: int, guild, role_ids=(), bot: bool = False):
+        super().__init__(user_id, bot)
+        self.guild = guild
+        self._roles = list(role_ids)
+        self.guild_permissions = FakePermissions()
+        self.joined_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)
+        self.voice = None
+        self.actions = []
+
+    @property
+    def roles(self):
+        return [self.guild.get_role(r) for r in self._roles if self.guild.get_role(r)]
+
+    async def add_roles(self, *roles, reason=None):
+        self._roles.extend(r.id for r in roles)
+
+    async def remove_roles(self, *roles, reason=None):
+        self._roles = [r for r in self._roles if r not in {role.id for role in roles}]
+
+    async def timeout(self, until, reason=None):
+        self.actions.append(("timeout", reason))
+
+    async def kick(self, reason=None):
+        self.actions.append(("kick", reason))
+
+    async def ban(self, reason=None, **kwargs):
+        self.actions.append(("ban", reason))
+
+    async def move_to(self, channel, reason=None):
+        self.voice = FakeVoiceState(channel)
+
+
+class FakeMessage:
+    _next_id = 10 ** 15
+
+    def __init__(self, guild, channel, author, content: str):
+        FakeMessage._next_id += 1
+        self.id = FakeMessage._next_id
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.embeds = []
+        self.mentions = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.deleted = False
+        self.jump_url = f"https://discord.com/channels/{guild.id if guild else '@me'}/{channel.id}/{self.id}"
+
+    async def delete(self, delay=None):
+        self.deleted = True
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id: int, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.category = None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        return FakeMessage(self.guild, self, self.guild.me, content or "")
+
+
+class FakeVoiceChannel(FakeTextChannel):
+    def __init__(self, channel_id: int, guild):
+        super().__init__(channel_id, guild)
+        self.members = []
+
+    async def set_permissions(self, target, **kwargs):
+        pass
+
+    async def delete(self, reason=None):
+        self.guild.channels.pop(self.id, None)
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None):
+        self.channel = channel
+        self.self_mute = self.self_deaf = self.mute = self.deaf = False
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.channels = {}
+        self._roles = {}
+        self._members = {}
+        self.system_channel = None
+        self.afk_channel = None
+        self.icon = None
+        self.me = FakeMember(1, self, bot=True)
+        self.shard_id = 0
+        self._next_channel = guild_id * 1000 + 900
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    def text_channel(self, channel_id):
+        return self.channels.setdefault(channel_id, FakeTextChannel(channel_id, self))
+
+    def voice_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if not isinstance(channel, FakeVoiceChannel):
+            channel = self.channels[channel_id] = FakeVoiceChannel(channel_id, self)
+        return channel
+
+    def member(self, user_id):
+        member = self._members.get(user_id)
+        if member is None:
+            member = self._members[user_id] = FakeMember(user_id, self)
+        return member
+
+    async def create_voice_channel(self, name, **kwargs):
+        self._next_channel += 1
+        channel = self.voice_channel(self._next_channel)
+        channel.name = name
+        return channel
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.sent.append((content, kwargs))
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.sent.append((content, kwargs))
+
+
+class FakeInteraction:
+    def __init__(self, guild, channel, user):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.user = user
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent = []
+
+
+# ---------------------------------------------------------------- bot and database
+
+class HarnessBot(commands.Bot):
+    """A bot that never logs in; background loops stay parked in before_loop."""
+
+    user = FakeUser(1, bot=True)
+
+    def __init__(self):
+        intents = discord.Intents.default()
+        intents.message_content = True
+        intents.members = True
+        super().__init__(command_prefix="!", intents=intents)
+        self.fake_guilds = {}
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()
+
+    def get_guild(self, guild_id):
+        return self.fake_guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        for guild in self.fake_guilds.values():
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    def guild(self, guild_id):
+        guild = self.fake_guilds.get(guild_id)
+        if guild is None:
+            guild = self.fake_guilds[guild_id] = FakeGuild(guild_id)
+        return guild
+
+
+@contextmanager
+def temporary_database():
+    """Point every session factory in database.py at a fresh SQLite file for the duration."""
+    directory = tempfile.mkdtemp(prefix="alfheim-harness-")
+    url = f"sqlite:///{os.path.join(directory, 'harness.db')}"
+    sync_engine = create_engine(url, **engine_options(url))
+    async_engine = create_async_engine(to_async_url(url), **engine_options(to_async_url(url)))
+    for engine in (sync_engine, async_engine.sync_engine):
+        # same WAL / busy_timeout setup as the bot's own SQLite engines
+        event.listen(engine, "connect", lambda dbapi_connection, record: _apply_sqlite_pragmas(dbapi_connection))
+        event.listen(engine, "before_cursor_execute", _count_statement)
+    Base.metadata.create_all(sync_engine)
+    factories = (database.SessionLocal, database.ReadSessionLocal, database.AsyncSessionLocal)
+    previous = [f.kw["bind"] for f in factories]
+    database.SessionLocal.configure(bind=sync_engine)
+    database.ReadSessionLocal.configure(bind=sync_engine)
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    _reset_caches()
+    try:
+        yield sync_engine
+    finally:
+        for factory, bind in zip(factories, previous):
+            factory.configure(bind=bind)
+        _reset_caches()
+        sync_engine.dispose()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _reset_caches():
+    # in-process state that would otherwise carry rows from one database into the next
+    config_cache.invalidate()
+    xp_engine.invalidate()
+    rank_index.invalidate()
+    leaderboard_cache.invalidate()
+    voice_sessions.clear()
+
+
+_statement_counts = defaultdict(int)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _statement_counts[(_event_type.get(), _listener.get())] += 1
+
+
+def seed(session_factory, guild_ids, automod: bool = True):
+    """Guild, level and automod configs that switch on the message-path features."""
+    session = session_factory()
+    try:
+        for gid in guild_ids:
+            session.add(GuildConfig(guild_id=gid, levels_enabled=True, anti_spam=True,
+                                    log_channel_id=gid * 1000 + 1, welcome_channel_id=gid * 1000 + 2))
+            session.add(LevelConfig(guild_id=gid, enabled=True, xp_cooldown=0, announce_levelup=True))
+            session.add(AutoModConfig(guild_id=gid, enabled=automod, bad_words_enabled=True,
+                                      bad_words_list="badword,worseword", caps_enabled=True,
+                                      anti_links_enabled=True))
+        session.commit()
+    finally:
+        session.close()
+
+
+# ---------------------------------------------------------------- traces
+
+WORDS = "hello there general kenobi levels are fun tonight raid boss patch notes ready".split()
+
+
+def synthetic_trace(events: int, guilds: int = 3, members: int = 50, seed_value: int = 1,
+                    mix: dict = None) -> list[dict]:
+    """A reproducible mix of messages, voice moves, joins and slash commands."""
+    rng = random.Random(seed_value)
+    mix = mix or {"message": 0.85, "voice": 0.08, "member_join": 0.04, "command": 0.03}
+    kinds, weights = zip(*mix.items())
+    in_voice = {}
+    next_member = 10_000
+    trace = []
+    for _ in range(events):
+        guild = rng.randint(1, guilds)
+        user = 100 + rng.randrange(members)
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "message":
+            roll = rng.random()
+            if roll < 0.02:
+                content = "this has a badword in it"
+            elif roll < 0.04:
+                content = "CHECK OUT THIS AMAZING OFFER NOW"
+            elif roll < 0.06:
+                content = "see https://example.com/patch"
+            else:
+                content = " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+            trace.append({"type": "message", "guild": guild, "user": user,
+                          "channel": guild * 1000 + 10 + rng.randrange(3), "content": content})
+        elif kind == "voice":
+            before = in_voice.get((guild, user))
+            after = None if before else guild * 1000 + 20 + rng.randrange(2)
+            in_voice[(guild, user)] = after
+            trace.append({"type": "voice", "guild": guild, "user": user, "before": before, "after": after})
+        elif kind == "member_join":
+            next_member += 1
+            trace.append({"type": "member_join", "guild": guild, "user": next_member})
+        else:
+            name = rng.choice(["rank", "userstats", "levels_top"])
+            trace.append({"type": "command", "guild": guild, "user": user, "name": name, "options": {}})
+    return trace
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_trace(trace: list[dict], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in trace:
+            f.write(json.dumps(item) + "\n")
+
+
+# ---------------------------------------------------------------- replay
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Report:
+    def __init__(self):
+        self.events = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.elapsed = 0.0
+        self.statements = {}
+
+    @property
+    def total_events(self) -> int:
+        return sum(self.events.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.total_events / self.elapsed if self.elapsed else 0.0
+
+    def statements_per_event(self, event_type: str) -> float:
+        count = sum(n for (kind, _), n in self.statements.items() if kind == event_type)
+        return count / self.events[event_type] if self.events[event_type] else 0.0
+
+    def listener_summary(self) -> dict:
+        return {
+            name: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 0.5) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "max_ms": max(samples) * 1000,
+                "errors": self.errors.get(name, 0),
+            }
+            for name, samples in self.latencies.items()
+        }
+
+    def format(self) -> str:
+        lines = [
+            f"{self.total_events} events in {self.elapsed:.2f}s: {self.throughput:,.0f} events/s",
+            "",
+            f"{'event':<14}{'count':>8}{'stmts/event':>14}",
+        ]
+        for kind, count in sorted(self.events.items()):
+            lines.append(f"{kind:<14}{count:>8}{self.statements_per_event(kind):>14.2f}")
+        background = sum(n for (kind, _), n in self.statements.items() if kind == "(background)")
+        lines.append(f"{'(background)':<14}{'':>8}{background:>14} total")
+        lines += ["", f"{'listener':<44}{'count':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}"]
+        for name, s in sorted(self.listener_summary().items(), key=lambda kv: -kv[1]["p99_ms"]):
+            lines.append(f"{name:<44}{s['count']:>8}{s['p50_ms']:>9.2f}{s['p99_ms']:>9.2f}"
+                         f"{s['max_ms']:>9.1f}{s['errors']:>8}")
+        return "\n".join(lines)
+
+
+class Harness:
+    def __init__(self, bot: HarnessBot, report: Report = None):
+        self.bot = bot
+        self.report = report or Report()
+
+    @classmethod
+    async def create(cls, cogs=COGS):
+        bot = HarnessBot()
+        for name in cogs:
+            await bot.load_extension(name)
+        harness = cls(bot)
+        pipeline = bot.get_cog("MessagePipeline")
+        if pipeline is not None:
+            for stage in pipeline.stages:
+                stage.callback = harness._timed(f"stage {stage.label}", stage.callback)
+        return harness
+
+    def _timed(self, name, callback):
+        async def run(*args, **kwargs):
+            token = _listener.set(name)
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                self.report.errors[name] += 1
+                raise
+            finally:
+                self.report.latencies[name].append(time.perf_counter() - started)
+                _listener.reset(token)
+        return run
+
+    def listeners(self, event_name: str):
+        return self.bot.extra_events.get(f"on_{event_name}", [])
+
+    async def _dispatch(self, event_name: str, *args):
+        for listener in self.listeners(event_name):
+            name = f"{type(listener.__self__).__name__}.{listener.__name__}"
+            try:
+                await self._timed(name, listener)(*args)
+            except Exception:
+                pass
+
+    async def handle(self, item: dict):
+        kind = item["type"]
+        token = _event_type.set(kind)
+        try:
+            await self._handle(kind, item)
+        finally:
+            _event_type.reset(token)
+
+    async def _handle(self, kind: str, item: dict):
+        self.report.events[kind] += 1
+        guild = self.bot.guild(item["guild"])
+        if kind == "message":
+            channel = guild.text_channel(item["channel"])
+            message = FakeMessage(guild, channel, guild.member(item["user"]), item["content"])
+            await self._dispatch("message", message)
+        elif kind == "voice":
+            member = guild.member(item["user"])
+            before = FakeVoiceState(guild.voice_channel(item["before"]) if item.get("before") else None)
+            after = FakeVoiceState(guild.voice_channel(item["after"]) if item.get("after") else None)
+            if before.channel is not None and member in before.channel.members:
+                before.channel.members.remove(member)
+            if after.channel is not None:
+                after.channel.members.append(member)
+            member.voice = after if after.channel else None
+            await self._dispatch("voice_state_update", member, before, after)
+        elif kind == "member_join":
+            guild.text_channel(guild.id * 1000 + 2)
+            await self._dispatch("member_join", guild.member(item["user"]))
+        elif kind == "command":
+            await self._command(guild, item)
+        else:
+            raise ValueError(f"unknown event type {kind!r}")
+
+    async def _command(self, guild, item: dict):
+        command = self.bot.tree.get_command(item["name"])
+        if command is None:
+            raise ValueError(f"unknown command {item['name']!r}")
+        interaction = FakeInteraction(guild, guild.text_channel(guild.id * 1000 + 10), guild.member(item["user"]))
+        callback = self._timed(f"/{command.qualified_name}", command.callback)
+        try:
+            if command.binding is not None:
+                await callback(command.binding, interaction, **item.get("options", {}))
+            else:
+                await callback(interaction, **item.get("options", {}))
+        except Exception:
+            pass
+
+    async def replay(self, trace: list[dict], rate: float = 0) -> Report:
+        """Feed the trace through the cogs. rate > 0 paces events at that many per second,
+        letting them overlap like real gateway traffic; rate 0 runs them back to back."""
+        # start the write-behind flusher outside any event so its statements count as background
+        batch_writer._ensure_task()
+        started = time.perf_counter()
+        if rate > 0:
+            tasks = []
+            for i, item in enumerate(trace):
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.handle(item)))
+            await asyncio.gather(*tasks)
+        else:
+            for item in trace:
+                await self.handle(item)
+        await batch_writer.flush()
+        self.report.elapsed = time.perf_counter() - started
+        self.report.statements = dict(_statement_counts)
+        return self.report
+
+    async def close(self):
+        await batch_writer.close()
+        for name in list(self.bot.extensions):
+            await self.bot.unload_extension(name)
+        # async connections must be closed while their event loop is still running
+        await database.AsyncSessionLocal.kw["bind"].dispose()
+
+
+async def run(trace: list[dict], rate: float = 0, cogs=COGS) -> Report:
+    guild_ids = sorted({item["guild"] for item in trace})
+    with temporary_database():
+        seed(database.SessionLocal, guild_ids)
+        _statement_counts.clear()
+        harness = await Harness.create(cogs)
+        try:
+            return await harness.replay(trace, rate)
+        finally:
+            await harness.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay gateway events through the cogs and report latency")
+    parser.add_argument("--events", type=int, default=2000, help="synthetic events to generate")
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--members", type=int, default=50, help="active members per guild")
+    parser.add_argument("--rate", type=float, default=0, help="events per second (0 = as fast as possible)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace", help="replay this JSON lines trace instead of generating one")
+    parser.add_argument("--record", help="write the generated trace to this file")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.events, args.guilds, args.members, args.seed)
+        if args.record:
+            save_trace(trace, args.record)
+    report = asyncio.run(run(trace, args.rate))
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
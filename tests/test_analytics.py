@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from analytics import AnalyticsBusy, AnalyticsRunner, AnalyticsTimeout
+from cogs.statistics import _daily_counts, _user_stats
+from database import Base, MessageLog, create_read_engine
+
+SLOW_QUERY = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+)
+
+
+def make_db(tmp_path, timeout_ms=10_000):
+    url = f"sqlite:///{tmp_path / 'stats.db'}"
+    writer = create_engine(url)
+    Base.metadata.create_all(bind=writer)
+    return writer, sessionmaker(bind=writer), sessionmaker(bind=create_read_engine(url, timeout_ms=timeout_ms))
+
+
+def test_read_engine_rejects_writes(tmp_path):
+    _, _, read_factory = make_db(tmp_path)
+    session = read_factory()
+    with pytest.raises(OperationalError):
+        session.execute(text("INSERT INTO user_levels (guild_id, user_id) VALUES (1, 1)"))
+    session.close()
+
+
+def test_runner_times_out_slow_queries(tmp_path):
+    _, _, read_factory = make_db(tmp_path, timeout_ms=100)
+    runner = AnalyticsRunner(session_factory=read_factory, workers=1, timeout_ms=100)
+
+    async def run():
+        with pytest.raises(AnalyticsTimeout):
+            await runner.run(lambda session: session.execute(SLOW_QUERY).scalar())
+        # the worker is free again afterwards
+        assert await runner.run(lambda session: session.execute(text("SELECT 1")).scalar()) == 1
+
+    asyncio.run(run())
+    assert runner.timeouts == 1 and runner.in_flight == 0
+    runner.shutdown()
+
+
+def test_runner_rejects_when_queue_is_full(tmp_path):
+    _, _, read_factory = make_db(tmp_path)
+    runner = AnalyticsRunner(session_factory=read_factory, workers=1, max_queue=0)
+
+    async def run():
+        with pytest.raises(AnalyticsBusy):
+            await runner.run(lambda session: 1)
+
+    asyncio.run(run())
+    assert runner.rejected == 1
+    runner.shutdown()
+
+
+def test_report_queries(tmp_path):
+    _, factory, read_factory = make_db(tmp_path)
+    first_day = datetime.datetime(2026, 3, 1)
+    session = factory()
+    for i, (day, user, channel) in enumerate([(0, 1, 10), (0, 1, 11), (2, 1, 11), (2, 2, 10), (5, 2, 10)]):
+        session.add(MessageLog(guild_id=1, message_id=i, channel_id=channel, user_id=user,
+                               created_at=first_day + datetime.timedelta(days=day, hours=3)))
+    session.commit()
+    session.close()
+
+    read = read_factory()
+    daily = _daily_counts(read, 1, first_day, 4)
+    assert [count for _, count in daily] == [2, 0, 2, 0]
+    stats = _user_stats(read, 1, 1, first_day + datetime.timedelta(days=2))
+    assert (stats["total"], stats["today"]) == (3, 1)
+    assert stats["channels"] == {10: 1, 11: 2}
+    read.close()
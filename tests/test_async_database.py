@@ -0,0 +1,37 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database import (
+    Base, UserLevel, to_async_url, async_fetch_one, async_fetch_all, async_get_or_create,
+)
+
+
+def test_to_async_url():
+    assert to_async_url("sqlite:///db/bot-db.db") == "sqlite+aiosqlite:///db/bot-db.db"
+    assert to_async_url("postgresql://u:p@localhost/bot") == "postgresql+asyncpg://u:p@localhost/bot"
+    assert to_async_url("postgresql+psycopg2://u:p@h/bot").startswith("postgresql+asyncpg://")
+    assert to_async_url("mysql+pymysql://u:p@h/bot").startswith("mysql+aiomysql://")
+
+
+def test_async_helpers():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with factory() as session:
+            row, created = await async_get_or_create(session, UserLevel, defaults={"xp": 10}, guild_id=1, user_id=2)
+            assert created and row.xp == 10
+            await session.commit()
+            again, created = await async_get_or_create(session, UserLevel, guild_id=1, user_id=2)
+            assert not created and again.id == row.id
+            assert (await async_fetch_one(session, UserLevel, guild_id=1, user_id=3)) is None
+            assert len(await async_fetch_all(session, UserLevel, guild_id=1)) == 1
+        await engine.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import batch_writer as batch_writer_module
+from batch_writer import BatchWriter
+from database import Base, Giveaway, MessageLog, UserLevel
+from executors import ExecutorBusy
+from metrics import write_behind_failures
+
+
+def make_writer(**kwargs):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    return BatchWriter(session_factory=factory, **kwargs), factory
+
+
+def test_updates_coalesce_into_one_row():
+    writer, factory = make_writer(interval_ms=60_000)
+    key = {"guild_id": 1, "user_id": 2}
+
+    async def run():
+        writer.update(UserLevel, key, increments={"xp": 10, "total_messages": 1})
+        writer.update(UserLevel, key, increments={"xp": 5, "total_messages": 1, "level": 1})
+        assert writer.pending == 1
+        assert writer.pending_increments(UserLevel, **key) == {"xp": 15, "total_messages": 2, "level": 1}
+        assert await writer.flush() == 1
+        writer.update(UserLevel, key, increments={"xp": 1})
+        await writer.close()
+
+    asyncio.run(run())
+    session = factory()
+    rows = session.query(UserLevel).all()
+    assert len(rows) == 1
+    assert (rows[0].xp, rows[0].level, rows[0].total_messages) == (16, 2, 2)
+    assert writer.flushes == 2
+    session.close()
+
+
+def test_inserts_flush_on_row_threshold():
+    writer, factory = make_writer(interval_ms=60_000, max_rows=3)
+
+    async def run():
+        for i in range(3):
+            writer.insert(MessageLog, guild_id=1, message_id=i, channel_id=1, user_id=1,
+                          content="hi", created_at=datetime.datetime.now())
+        for _ in range(20):
+            if not writer.pending:
+                break
+            await asyncio.sleep(0.01)
+        await writer.close()
+
+    asyncio.run(run())
+    session = factory()
+    assert session.query(MessageLog).count() == 3
+    session.close()
+
+
+def test_duplicate_inserts_are_ignored():
+    writer, factory = make_writer(interval_ms=60_000)
+
+    async def run():
+        for message_id in (1, 1, 2):
+            writer.insert(MessageLog, guild_id=1, message_id=message_id, channel_id=1,
+                          user_id=1, content="dup")
+        return await writer.flush()
+
+    assert asyncio.run(run()) == 3
+    session = factory()
+    assert session.query(MessageLog).count() == 2
+    assert writer.flushes == 1
+    session.close()
+
+
+def test_failed_batch_keeps_good_rows():
+    writer, factory = make_writer(interval_ms=60_000)
+
+    async def run():
+        for message_id in (1, 2):
+            writer.insert(MessageLog, guild_id=1, message_id=message_id, channel_id=1,
+                          user_id=1, content="ok")
+        writer.insert(Giveaway, guild_id=1, channel_id=1, message_id=3, host_id=1)
+        return await writer.flush()
+
+    dropped = write_behind_failures.value("giveaways", "dropped")
+    assert asyncio.run(run()) == 2
+    assert writer.rows_dropped == 1
+    assert write_behind_failures.value("giveaways", "dropped") == dropped + 1
+    session = factory()
+    assert session.query(MessageLog).count() == 2
+    assert session.query(Giveaway).count() == 0
+    session.close()
+
+
+def test_batch_the_executor_refuses_is_queued_again(monkeypatch):
+    writer, factory = make_writer(interval_ms=60_000)
+    run_in = batch_writer_module.run_in
+
+    async def busy(name, fn, *args, **kwargs):
+        raise ExecutorBusy("db executor has 1 calls pending")
+
+    async def run():
+        writer.update(UserLevel, {"guild_id": 1, "user_id": 2}, increments={"xp": 5})
+        writer.insert(MessageLog, guild_id=1, message_id=1, channel_id=1, user_id=2, content="a")
+        monkeypatch.setattr(batch_writer_module, "run_in", busy)
+        with pytest.raises(ExecutorBusy):
+            await writer.flush()
+        assert writer.pending == 2
+        writer.update(UserLevel, {"guild_id": 1, "user_id": 2}, increments={"xp": 3})
+        writer.insert(MessageLog, guild_id=1, message_id=2, channel_id=1, user_id=2, content="b")
+        monkeypatch.setattr(batch_writer_module, "run_in", run_in)
+        return await writer.flush()
+
+    requeued = write_behind_failures.value("user_levels", "requeued")
+    assert asyncio.run(run()) == 3
+    assert write_behind_failures.value("user_levels", "requeued") == requeued + 1
+    session = factory()
+    assert session.query(UserLevel).one().xp == 8
+    assert [m.message_id for m in session.query(MessageLog).order_by(MessageLog.id)] == [1, 2]
+    session.close()
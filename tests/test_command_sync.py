@@ -0,0 +1,88 @@
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+import pytest
+from discord import app_commands
+
+from command_sync import sync_tree, tree_hash
+from tests.harness import HarnessBot, temporary_database
+
+
+def make_tree():
+    bot = HarnessBot()
+    calls = []
+
+    async def fake_sync(*, guild=None):
+        calls.append(guild)
+        if getattr(bot, "fail_sync", False):
+            raise discord.HTTPException(type("Response", (), {"status": 429, "reason": "rate limited"})(), "slow down")
+        return bot.tree.get_commands(guild=guild)
+
+    bot.tree.sync = fake_sync
+
+    @bot.tree.command(name="ping", description="Pong")
+    async def ping(interaction: discord.Interaction):
+        pass
+
+    return bot, calls
+
+
+def test_hash_is_stable_and_tracks_changes():
+    async def run():
+        bot, _ = make_tree()
+        first = await tree_hash(bot.tree)
+        assert first == await tree_hash(bot.tree)
+
+        @bot.tree.command(name="pong", description="Ping")
+        @app_commands.describe(times="How many")
+        async def pong(interaction: discord.Interaction, times: int = 1):
+            pass
+
+        second = await tree_hash(bot.tree)
+        assert second != first
+        assert await tree_hash(bot.tree, guild=discord.Object(id=5)) != second
+        return first
+
+    asyncio.run(run())
+
+
+def test_sync_only_when_changed_and_force():
+    async def run():
+        bot, calls = make_tree()
+        assert await sync_tree(bot.tree) == 1
+        # a second worker or a restart with the same commands skips the upload
+        assert await sync_tree(bot.tree) is None
+        assert await sync_tree(bot.tree, force=True) == 1
+        guild = discord.Object(id=42)
+        bot.tree.copy_global_to(guild=guild)
+        assert await sync_tree(bot.tree, guild=guild) == 1
+        assert await sync_tree(bot.tree, guild=guild) is None
+        return calls
+
+    with temporary_database():
+        calls = asyncio.run(run())
+    assert [getattr(g, "id", None) for g in calls] == [None, None, 42]
+
+
+def test_failed_sync_is_retried_next_time():
+    async def run():
+        bot, calls = make_tree()
+        assert await sync_tree(bot.tree) == 1
+
+        @bot.tree.command(name="pong", description="Ping")
+        async def pong(interaction: discord.Interaction):
+            pass
+
+        bot.fail_sync = True
+        with pytest.raises(discord.HTTPException):
+            await sync_tree(bot.tree)
+        bot.fail_sync = False
+        assert await sync_tree(bot.tree) == 2
+        return calls
+
+    with temporary_database():
+        assert len(asyncio.run(run())) == 3
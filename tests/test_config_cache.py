@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import config_cache as cc
+from database import Base, GuildConfig, LevelConfig
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    path = tmp_path / "config.db"
+    engine = create_engine(f"sqlite:///{path}", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    factory = sessionmaker(bind=engine)
+    cache = cc.ConfigCache(factory, async_sessionmaker(async_engine, expire_on_commit=False))
+    monkeypatch.setattr(cc, "config_cache", cache)
+    yield cache, factory
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
+
+
+def test_snapshots_are_immutable(cache):
+    cache, factory = cache
+    session = factory()
+    session.add(LevelConfig(guild_id=1, ignore_channel_ids=[5], level_role_rewards={"5": {"role_id": 9}}))
+    session.commit()
+    session.close()
+
+    snap = cache.get(LevelConfig, 1)
+    assert snap.ignore_channel_ids == (5,)
+    assert snap.level_role_rewards["5"]["role_id"] == 9
+    with pytest.raises(AttributeError):
+        snap.enabled = False
+    with pytest.raises(TypeError):
+        snap.level_role_rewards["6"] = {}
+    assert cache.get(LevelConfig, 1) is snap
+    assert cache.get(LevelConfig, 2) is None
+
+
+def test_commit_invalidates_only_written_guild(cache):
+    cache, factory = cache
+    session = factory()
+    session.add_all([GuildConfig(guild_id=1), GuildConfig(guild_id=2)])
+    session.commit()
+
+    assert cache.get(GuildConfig, 1).language == "ru"
+    other = cache.get(GuildConfig, 2)
+    session.query(GuildConfig).filter_by(guild_id=1).first().language = "en"
+    session.flush()
+    assert cache.get(GuildConfig, 1).language == "ru"
+    session.commit()
+    session.close()
+
+    assert cache.get(GuildConfig, 1).language == "en"
+    assert cache.get(GuildConfig, 2) is other
+    assert cache.version(GuildConfig, 1) == 2
+
+
+def test_stale_async_load_is_not_stored(cache):
+    cache, factory = cache
+    session = factory()
+    session.add(GuildConfig(guild_id=1))
+    session.commit()
+    session.close()
+
+    async def run():
+        load = asyncio.ensure_future(cache.aget(GuildConfig, 1))
+        await asyncio.sleep(0)
+        cache.invalidate(1, GuildConfig)
+        assert (await load).guild_id == 1
+        assert len(cache) == 0
+        assert (await cache.aget(GuildConfig, 1)).guild_id == 1
+        assert len(cache) == 1
+
+    asyncio.run(run())
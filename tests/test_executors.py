@@ -0,0 +1,78 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from executors import BoundedExecutor, ExecutorBusy, ExecutorTimeout, get_executor, run_in
+from metrics import executor_rejected, executor_run_latency, executor_timeouts
+
+
+def test_runs_on_named_threads_with_context():
+    executor = BoundedExecutor("test-ctx", workers=2)
+    tag = contextvars.ContextVar("tag", default=None)
+
+    def work(x, y=0):
+        return threading.current_thread().name, tag.get(), x + y
+
+    async def run():
+        tag.set("on_message")
+        return await executor.run(work, 1, y=2)
+
+    name, seen, total = asyncio.run(run())
+    assert name.startswith("test-ctx-worker")
+    assert seen == "on_message"
+    assert total == 3
+    assert executor.pending == 0
+    assert executor_run_latency.count("test-ctx") == 1
+    executor.shutdown()
+
+
+def test_rejects_beyond_max_queue():
+    executor = BoundedExecutor("test-busy", workers=1, max_queue=2)
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorBusy):
+            await executor.run(release.wait)
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(run())
+    assert executor_rejected.value("test-busy") == 1
+    assert executor.pending == 0
+    executor.shutdown()
+
+
+def test_timeout_abandons_the_call_but_keeps_it_queued_until_done():
+    executor = BoundedExecutor("test-timeout", workers=1, max_queue=1, timeout=0.05)
+    release = threading.Event()
+
+    async def run():
+        with pytest.raises(ExecutorTimeout):
+            await executor.run(release.wait)
+        # the thread is still busy, so the slot is still taken
+        with pytest.raises(ExecutorBusy):
+            await executor.run(lambda: 1)
+        release.set()
+        while executor.pending:
+            await asyncio.sleep(0.01)
+        return await executor.run(lambda: 1, timeout=0)
+
+    assert asyncio.run(run()) == 1
+    assert executor_timeouts.value("test-timeout") == 1
+    executor.shutdown()
+
+
+def test_named_pools():
+    assert asyncio.run(run_in("db", lambda: threading.current_thread().name)).startswith("db-worker")
+    assert get_executor("db").max_queue == 0 and get_executor("db").timeout == 0
+    with pytest.raises(ValueError):
+        get_executor("nope")
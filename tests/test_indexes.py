@@ -0,0 +1,73 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, func, select
+
+from database import (
+    Base, Giveaway, GiveawayEntry, MessageLog, Reminder, TempBan, UserActivity,
+    UserEconomy, UserLevel, Warning,
+)
+
+from cogs.levels import leaderboard_query
+
+NOW = datetime.datetime(2026, 1, 1)
+
+HOT_QUERIES = {
+    "user_level": select(UserLevel).filter_by(guild_id=1, user_id=2),
+    "leaderboard_page": leaderboard_query(1, after=(5, 120, 3)),
+    "user_economy": select(UserEconomy).filter_by(guild_id=1, user_id=2),
+    "message_log_window": select(func.count(MessageLog.id)).where(
+        MessageLog.guild_id == 1, MessageLog.created_at >= NOW
+    ),
+    "message_log_by_id": select(MessageLog).filter_by(message_id=3),
+    "user_activity": select(UserActivity).filter_by(guild_id=1, user_id=2, date=NOW),
+    "warnings": select(Warning).filter_by(guild_id=1, user_id=2),
+    "temp_bans_due": select(TempBan).where(TempBan.unban_time <= NOW),
+    "reminders_due": select(Reminder).where(Reminder.remind_at <= NOW),
+    "giveaways_due": select(Giveaway).where(Giveaway.ends_at <= NOW, Giveaway.ended == False),
+    "giveaway_entry": select(GiveawayEntry).filter_by(giveaway_id=1, user_id=2),
+    "giveaway_entry_count": select(func.count(GiveawayEntry.id)).filter_by(giveaway_id=1),
+}
+
+
+@pytest.fixture(scope="module")
+def conn():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as connection:
+        yield connection
+    engine.dispose()
+
+
+def query_plan(conn, stmt) -> str:
+    compiled = stmt.compile(dialect=conn.dialect)
+    params = tuple(
+        str(v) if isinstance(v, datetime.datetime) else v
+        for v in (compiled.params[k] for k in compiled.positiontup)
+    )
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_index(conn, name):
+    plan = query_plan(conn, HOT_QUERIES[name])
+    assert "SCAN" not in plan, f"{name} does a full scan: {plan}"
+    assert "USING" in plan and "INDEX" in plan, f"{name} has no index: {plan}"
+
+
+def test_unique_lookup_indexes():
+    unique = {
+        idx.name for table in Base.metadata.sorted_tables for idx in table.indexes if idx.unique
+    }
+    assert {
+        "uq_user_levels_guild_user",
+        "uq_user_economy_guild_user",
+        "uq_user_activity_guild_user_date",
+        "uq_giveaway_entries_giveaway_user",
+    } <= unique
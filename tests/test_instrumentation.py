@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text
+
+import instrumentation
+from instrumentation import begin_handler, handler_scope, instrument_engine, sql_stats, statement_shape
+
+
+def make_engine():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    instrument_engine(engine)  # idempotent
+    return engine
+
+
+def test_statement_shape_normalizes():
+    a = statement_shape("SELECT *  FROM t\nWHERE id IN (?, ?, ?) LIMIT 10")
+    b = statement_shape("SELECT * FROM t WHERE id IN (?, ?) LIMIT 5")
+    assert a == b == "SELECT * FROM t WHERE id IN (?...) LIMIT N"
+
+
+def test_statements_attributed_to_handler():
+    sql_stats.reset()
+    engine = make_engine()
+    with engine.connect() as conn:
+        with handler_scope("/rank"):
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 2"))
+    by_handler = sql_stats.by_handler()
+    assert by_handler["/rank"]["count"] == 2
+    assert by_handler[instrumentation.UNTAGGED]["count"] == 1
+
+
+def test_n_plus_one_flagged_once_per_invocation(monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "N_PLUS_ONE_THRESHOLD", 3)
+    sql_stats.reset()
+    engine = make_engine()
+    caplog.set_level(logging.WARNING, logger="alfheim_bot.sql")
+
+    async def handler(n):
+        begin_handler("Giveaways.giveaway_list")
+        with engine.connect() as conn:
+            for i in range(n):
+                conn.execute(text(f"SELECT {i} + :x"), {"x": i})
+
+    async def run():
+        # separate tasks = separate invocations, like discord.py listeners
+        await asyncio.gather(asyncio.create_task(handler(10)), asyncio.create_task(handler(2)))
+
+    asyncio.run(run())
+    [stats] = sql_stats.top(1)
+    assert stats.handler == "Giveaways.giveaway_list" and stats.count == 12
+    assert stats.n_plus_one == 1
+    assert sum("possible N+1" in r.message for r in caplog.records) == 1
+
+
+def test_slow_queries_logged(monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", 0)
+    sql_stats.reset()
+    caplog.set_level(logging.WARNING, logger="alfheim_bot.sql")
+    with make_engine().connect() as conn, handler_scope("on_message"):
+        conn.execute(text("SELECT 1"))
+    assert sql_stats.top(1)[0].slow == 1
+    assert any("slow query" in r.message and "on_message" in r.message for r in caplog.records)
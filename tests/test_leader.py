@@ -0,0 +1,61 @@
+import sys
+import os
+import subprocess
+import textwrap
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from leader import FileLock, LeaderElection
+from launcher import shard_ranges
+
+
+def test_only_one_worker_becomes_leader(tmp_path):
+    first = LeaderElection("jobs", lock=FileLock("jobs", str(tmp_path)))
+    second = LeaderElection("jobs", lock=FileLock("jobs", str(tmp_path)))
+    assert first.poll() is True
+    assert second.poll() is None
+    assert first.is_leader and not second.is_leader
+    assert first.poll() is None
+
+    first.stop()
+    assert second.poll() is True
+    assert second.is_leader
+    second.stop()
+
+
+def test_follower_takes_over_when_leader_process_dies(tmp_path):
+    root = os.path.join(os.path.dirname(__file__), "..")
+    script = textwrap.dedent(f"""
+        import sys, time
+        sys.path.insert(0, {root!r})
+        from leader import FileLock
+        lock = FileLock("jobs", {str(tmp_path)!r})
+        assert lock.acquire()
+        print("locked", flush=True)
+        time.sleep(60)
+    """)
+    leader_process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+    try:
+        assert leader_process.stdout.readline().strip() == "locked"
+        follower = LeaderElection("jobs", lock=FileLock("jobs", str(tmp_path)))
+        assert follower.poll() is None
+
+        leader_process.kill()
+        leader_process.wait()
+        deadline = time.monotonic() + 5
+        while follower.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert follower.is_leader
+        follower.stop()
+    finally:
+        if leader_process.poll() is None:
+            leader_process.kill()
+        leader_process.stdout.close()
+
+
+def test_shard_ranges_are_contiguous_and_cover_all_shards():
+    assert shard_ranges(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert shard_ranges(2, 4) == [[0], [1]]
+    ranges = shard_ranges(16, 4)
+    assert sorted(s for r in ranges for s in r) == list(range(16))
@@ -0,0 +1,87 @@
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database
+from batch_writer import BatchWriter
+from cogs.levels import LEADERBOARD_PAGE_SIZE, LeaderboardCache, Levels, _leaderboard_rows, leaderboard_cache
+from database import UserLevel
+from tests.harness import FakeGuild, temporary_database
+
+
+def _seed(count: int, guild_id: int = 1):
+    session = database.SessionLocal()
+    try:
+        session.add(database.GuildConfig(guild_id=guild_id))
+        # plenty of ties on level and xp, so the user_id tiebreak matters
+        session.add_all(UserLevel(guild_id=guild_id, user_id=100 + i, level=1 + i % 4, xp=(i * 7) % 3)
+                        for i in range(count))
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_keyset_pages_cover_the_ordering_exactly_once():
+    with temporary_database():
+        _seed(57)
+        session = database.SessionLocal()
+        try:
+            expected = sorted(
+                ((row.user_id, row.level, row.xp) for row in session.query(UserLevel).filter_by(guild_id=1)),
+                key=lambda r: (r[1], r[2], r[0]), reverse=True,
+            )
+            seen, after = [], None
+            while True:
+                rows = _leaderboard_rows(session, 1, after, 10)
+                seen.extend(rows[:10])
+                if len(rows) <= 10:
+                    break
+                user_id, level, xp = rows[9]
+                after = (level, xp, user_id)
+        finally:
+            session.close()
+    assert seen == expected
+
+
+def test_pages_are_cached_until_the_guild_is_flushed():
+    cog = Levels(bot=None)
+    leaderboard_cache.invalidate()
+    try:
+        async def run():
+            guild = FakeGuild(1)
+            first, cursor = await cog.leaderboard_page(guild, 0, None)
+            assert leaderboard_cache.get(1, (0, None)) == (first, cursor)
+            second, _ = await cog.leaderboard_page(guild, 1, cursor)
+            assert first.startswith("**1.**") and second.startswith(f"**{LEADERBOARD_PAGE_SIZE + 1}.**")
+
+            writer = BatchWriter()
+            writer.add_flush_listener(leaderboard_cache.on_flush)
+            writer.update(UserLevel, {"guild_id": 2, "user_id": 5}, increments={"xp": 1})
+            await writer.flush()
+            assert leaderboard_cache.get(1, (0, None)) is not None
+
+            writer.update(UserLevel, {"guild_id": 1, "user_id": 100}, increments={"level": 10})
+            await writer.flush()
+            assert leaderboard_cache.get(1, (0, None)) is None
+            refreshed, _ = await cog.leaderboard_page(guild, 0, None)
+            assert refreshed.startswith("**1.** <@100> — уровень **11**")
+
+        with temporary_database():
+            _seed(25)
+            asyncio.run(run())
+    finally:
+        cog.cog_unload()
+
+
+def test_page_read_during_invalidation_is_not_stored():
+    cache = LeaderboardCache(max_guilds=2)
+    version = cache.version(1)
+    cache.invalidate(1)
+    cache.put(1, (0, None), ("stale", None), version)
+    assert cache.get(1, (0, None)) is None
+
+    for guild_id in (1, 2, 3):
+        cache.put(guild_id, (0, None), ("page", None), cache.version(guild_id))
+    assert len(cache) == 2 and cache.get(1, (0, None)) is None
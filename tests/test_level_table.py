@@ -0,0 +1,160 @@
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, inspect, text
+
+import database
+import cogs.levels as levels_cog
+from batch_writer import batch_writer
+from cogs.levels import Levels
+from database import Base, UserLevel, get_schema_version
+from level_table import LevelTable, calc_level_xp, rewrite_levels
+from migrations import MIGRATIONS, MigrationContext
+from xp_engine import xp_engine
+from tests.harness import FakeGuild, FakeRole, temporary_database
+
+
+def test_level_for_matches_a_linear_walk():
+    table = LevelTable(100, 1.5, 30)
+    for total in (0, 99, 100, 249, 250, 10_000, 10 ** 12):
+        level, remaining = 1, total
+        while level < 30 and remaining >= calc_level_xp(level, 100, 1.5):
+            remaining -= calc_level_xp(level, 100, 1.5)
+            level += 1
+        assert table.level_for(total) == level
+    assert table.progress(260) == (3, 10, 225)
+    assert table.progress(10 ** 12)[2] is None
+
+
+def test_tables_are_shared_and_stop_at_storable_xp():
+    config = SimpleNamespace(level_base_xp=100, level_multiplier=1.5, max_level=100)
+    assert LevelTable.for_config(config) is LevelTable.for_config(None)
+    steep = LevelTable(1000, 10.0, 99999)
+    assert steep.top_level < 99999
+    assert steep.level_for(2 ** 63 - 1) == steep.top_level
+    assert LevelTable(100, 1.0, 5).thresholds == [0, 100, 200, 300, 400]
+
+
+def test_rewrite_levels_converts_to_totals_and_resumes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'levels.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # level 2 with 30 XP into it; level 1 with enough XP for two more levels
+        conn.execute(text("INSERT INTO user_levels (id, guild_id, user_id, level, xp) VALUES "
+                          "(1, 1, 10, 2, 30), (2, 1, 11, 1, 260), (3, 2, 12, 1, 5)"))
+    table = LevelTable(100, 1.5, 100)
+    checkpoints = []
+    changed = rewrite_levels(engine, lambda _: table, from_level_xp=True, batch_size=2,
+                             checkpoint=lambda conn, last_id: checkpoints.append(last_id))
+    assert changed == 2 and checkpoints == [2, 3]
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT level, xp FROM user_levels ORDER BY id")).all()
+    assert [tuple(r) for r in rows] == [(2, 130), (3, 260), (1, 5)]
+    # nothing left to do once the stored levels match the totals
+    assert rewrite_levels(engine, lambda _: table) == 0
+
+
+def test_rewrite_keeps_xp_committed_mid_chunk(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'race.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user_levels (id, guild_id, user_id, level, xp) VALUES (1, 1, 10, 1, 500)"))
+    table = LevelTable(100, 1.5, 100)
+    flushed = []
+
+    def table_for(_):
+        # a write-behind flush lands between the chunk's read and its update
+        if not flushed:
+            with engine.begin() as other:
+                other.execute(text("UPDATE user_levels SET xp = xp + 50 WHERE id = 1"))
+            flushed.append(True)
+        return table
+
+    rewrite_levels(engine, table_for, guild_id=1)
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT level, xp FROM user_levels")).one()
+    assert tuple(row) == (table.level_for(550), 550)
+
+
+def test_migration_converts_each_guild_with_its_formula(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO level_configs (guild_id, level_base_xp, level_multiplier, max_level) "
+                          "VALUES (2, 10, 1.0, 3)"))
+        # an earlier run converted row 1, then crashed
+        conn.execute(text("INSERT INTO user_levels (id, guild_id, user_id, level, xp) VALUES "
+                          "(1, 1, 11, 3, 255), (2, 2, 10, 2, 50), (3, 1, 10, 3, 5)"))
+        conn.execute(text("CREATE TABLE level_xp_migration (last_id BIGINT NOT NULL)"))
+        conn.execute(text("INSERT INTO level_xp_migration VALUES (1)"))
+    convert = next(m for m in MIGRATIONS if m.version == 5)
+    convert.apply(MigrationContext(engine, log=lambda _: None))
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT level, xp FROM user_levels ORDER BY id")).all()
+        assert get_schema_version(conn) == 5
+    assert "level_xp_migration" not in inspect(engine).get_table_names()
+    # guild 1 uses the defaults (100 + 150 to reach level 3); guild 2 tops out at level 3
+    assert [tuple(r) for r in rows] == [(3, 255), (3, 60), (3, 255)]
+
+
+def test_one_gain_can_cross_several_levels_and_grants_every_reward():
+    guild = FakeGuild(1)
+    for role_id in (50, 51):
+        guild._roles[role_id] = FakeRole(role_id, guild)
+    member, channel = guild.member(10), guild.text_channel(20)
+    config = SimpleNamespace(
+        level_base_xp=100, level_multiplier=1.5, max_level=100, announce_levelup=True,
+        announce_channel_id=None, stack_roles=True, level_role_rewards={"2": {"role_id": 50}, "3": {"role_id": 51}},
+    )
+    cog = Levels(bot=None)
+
+    async def run():
+        state = await xp_engine.get(1, 10)
+        # 300 XP of voice at once passes level 2 (100) and level 3 (250)
+        await cog.award_xp(member, state, 300, config, channel, voice_minutes=150)
+        await batch_writer.flush()
+        return state
+
+    try:
+        with temporary_database():
+            state = asyncio.run(run())
+            session = database.SessionLocal()
+            try:
+                row = session.query(UserLevel).filter_by(guild_id=1, user_id=10).one()
+            finally:
+                session.close()
+    finally:
+        cog.cog_unload()
+    assert (state.level, state.xp) == (3, 300) == (row.level, row.xp)
+    assert member._roles == [50, 51]
+    assert "уровня **3**" in channel.sent[0][1]["embed"].description
+
+
+def test_awards_during_a_formula_change_bank_xp_without_levelling():
+    guild = FakeGuild(1)
+    member, channel = guild.member(10), guild.text_channel(20)
+    config = SimpleNamespace(level_base_xp=100, level_multiplier=1.5, max_level=100, announce_levelup=True,
+                             announce_channel_id=None, stack_roles=True, level_role_rewards={})
+    cog = Levels(bot=None)
+
+    async def run():
+        state = await xp_engine.get(1, 10)
+        levels_cog._formula_changing.add(1)
+        try:
+            await cog.award_xp(member, state, 300, config, channel)
+        finally:
+            levels_cog._formula_changing.discard(1)
+        await batch_writer.flush()
+        return state
+
+    try:
+        with temporary_database():
+            state = asyncio.run(run())
+    finally:
+        cog.cog_unload()
+    assert (state.level, state.xp) == (1, 300)
+    assert channel.sent == []
@@ -0,0 +1,98 @@
+import sys
+import os
+import asyncio
+import textwrap
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from loop_monitor import ROOT, LoopMonitor, describe_stack
+
+# a handler that appears to live in cogs/, so the monitor attributes the stall to it
+FAKE_COG = textwrap.dedent("""
+    import sys
+    import time
+
+    class FakeCog:
+        async def handler(self, seconds):
+            time.sleep(seconds)
+
+        def frame(self):
+            return sys._getframe()
+""")
+
+
+def load_fake_cog():
+    namespace = {}
+    exec(compile(FAKE_COG, os.path.join(ROOT, "cogs", "fake_blocking.py"), "exec"), namespace)
+    return namespace["FakeCog"]()
+
+
+def test_blocking_handler_is_detected_with_its_stack():
+    monitor = LoopMonitor(sample_ms=20, block_ms=50)
+    cog = load_fake_cog()
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        await cog.handler(0.3)
+        await asyncio.sleep(0.15)
+        monitor.stop()
+
+    asyncio.run(scenario())
+    [stats] = monitor.top()
+    assert stats.handler == "cogs/fake_blocking.py:FakeCog.handler"
+    assert stats.count == 1
+    assert 200 <= stats.max_ms <= 400
+    assert stats.site.startswith("cogs/fake_blocking.py:")
+    assert any("fake_blocking.py" in line and "in handler" in line for line in stats.stack)
+    assert monitor.lag_summary()["max"] >= 200
+
+
+def without_qualname(frame):
+    """A stand-in for frame as Python 3.10 builds it, whose code objects have no co_qualname."""
+    if frame is None:
+        return None
+    code = frame.f_code
+    return SimpleNamespace(
+        f_code=SimpleNamespace(co_filename=code.co_filename, co_name=code.co_name),
+        f_lineno=frame.f_lineno, f_globals=frame.f_globals, f_locals=frame.f_locals,
+        f_back=without_qualname(frame.f_back),
+    )
+
+
+def test_describe_stack_on_a_live_frame():
+    frame = load_fake_cog().frame()
+    handler, site, stack = describe_stack(frame)
+    assert handler == "cogs/fake_blocking.py:FakeCog.frame"
+    assert site.startswith("cogs/fake_blocking.py:")
+    assert "in frame" in stack[-1]
+    # on 3.10 the handler falls back to the function name instead of failing
+    handler, site, _ = describe_stack(without_qualname(frame))
+    assert handler == "cogs/fake_blocking.py:frame"
+    assert site.startswith("cogs/fake_blocking.py:")
+
+
+def test_healthy_loop_records_no_blocks():
+    monitor = LoopMonitor(sample_ms=10, block_ms=100)
+
+    async def scenario():
+        monitor.start()
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+        monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.top() == []
+    assert monitor.lag_summary()["samples"] > 0
+
+
+def test_lag_summary_percentiles():
+    monitor = LoopMonitor()
+    monitor.lags.extend(range(100))
+    summary = monitor.lag_summary()
+    assert summary["p50"] == 50
+    assert summary["p99"] == 99
+    assert summary["max"] == 99
+    monitor.reset()
+    assert monitor.lag_summary()["samples"] == 0
@@ -0,0 +1,116 @@
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import cogs.message_pipeline as pipeline_module
+from cogs.message_pipeline import (
+    AI, AUTOMOD, STATS, XP, MessageContext, MessagePipeline, message_stage,
+)
+
+
+class FakeSession:
+    opened = 0
+
+    def __init__(self):
+        FakeSession.opened += 1
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def make_message(guild_id=1, bot=False, roles=(10, 11)):
+    guild = SimpleNamespace(id=guild_id) if guild_id else None
+    author = SimpleNamespace(id=5, bot=bot, _roles=list(roles))
+    return SimpleNamespace(id=99, guild=guild, author=author, content="hi")
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    @message_stage(XP, name="xp")
+    async def xp(self, ctx):
+        self.calls.append("xp")
+
+    @message_stage(AUTOMOD, name="automod")
+    async def automod(self, ctx):
+        self.calls.append("automod")
+        if ctx.message.content == "spam":
+            ctx.stop("automod")
+
+    @message_stage(AI, name="ai", dms=True)
+    async def ai(self, ctx):
+        self.calls.append("ai")
+
+    @message_stage(STATS, name="broken")
+    async def broken(self, ctx):
+        self.calls.append("broken")
+        raise RuntimeError("boom")
+
+    async def not_a_stage(self, ctx):
+        self.calls.append("not_a_stage")
+
+
+def make_pipeline():
+    recorder = Recorder()
+    bot = SimpleNamespace(cogs={"Recorder": recorder})
+    pipeline = MessagePipeline(bot)
+    bot.cogs["MessagePipeline"] = pipeline
+    return pipeline, recorder
+
+
+def test_stages_run_in_phase_order_and_errors_are_isolated():
+    pipeline, recorder = make_pipeline()
+    assert [s.label for s in pipeline.stages] == [
+        "Recorder.automod", "Recorder.xp", "Recorder.broken", "Recorder.ai",
+    ]
+    asyncio.run(pipeline.run(MessageContext(make_message())))
+    assert recorder.calls == ["automod", "xp", "broken", "ai"]
+    assert pipeline.stage_stats["Recorder.broken"].errors == 1
+    assert pipeline.stage_stats["Recorder.ai"].runs == 1
+
+
+def test_stop_skips_later_stages():
+    pipeline, recorder = make_pipeline()
+    message = make_message()
+    message.content = "spam"
+    ctx = MessageContext(message)
+    asyncio.run(pipeline.run(ctx))
+    assert recorder.calls == ["automod"]
+    assert ctx.stopped_by == "automod"
+    assert pipeline.stage_stats["Recorder.automod"].stops == 1
+
+
+def test_direct_messages_only_reach_dm_stages():
+    pipeline, recorder = make_pipeline()
+    asyncio.run(pipeline.run(MessageContext(make_message(guild_id=None))))
+    assert recorder.calls == ["ai"]
+
+
+def test_context_shares_roles_and_one_lazy_session(monkeypatch):
+    monkeypatch.setattr(pipeline_module, "AsyncSessionLocal", FakeSession)
+    FakeSession.opened = 0
+    ctx = MessageContext(make_message(roles=(3, 4)))
+    assert ctx.role_ids == {3, 4}
+
+    async def scenario():
+        first = await ctx.session()
+        second = await ctx.session()
+        await ctx.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+    assert first.closed
+    assert FakeSession.opened == 1
+
+
+def test_stage_list_follows_loaded_cogs():
+    pipeline, _ = make_pipeline()
+    assert len(pipeline.stages) == 4
+    del pipeline.bot.cogs["Recorder"]
+    assert pipeline.stages == []
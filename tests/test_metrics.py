@@ -0,0 +1,90 @@
+import sys
+import os
+import asyncio
+import socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aiohttp
+import pytest
+
+from metrics import MetricsServer, Registry, db_statement_latency
+
+
+def test_counter_and_gauge_render_with_labels():
+    reg = Registry()
+    events = reg.counter("events_total", "Events", ["type"])
+    depth = reg.gauge("depth", "Queue depth")
+    events.inc("MESSAGE_CREATE")
+    events.inc("MESSAGE_CREATE")
+    events.inc('we"ird')
+    depth.inc()
+    depth.inc()
+    depth.dec()
+    text = reg.render()
+    assert "# TYPE events_total counter" in text
+    assert 'events_total{type="MESSAGE_CREATE"} 2' in text
+    assert 'events_total{type="we\\"ird"} 1' in text
+    assert "depth 1" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    reg = Registry()
+    latency = reg.histogram("latency_seconds", "Latency", ["command"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, "ping")
+    text = reg.render()
+    assert 'latency_seconds_bucket{command="ping",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{command="ping",le="1"} 3' in text
+    assert 'latency_seconds_bucket{command="ping",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{command="ping"} 4' in text
+    assert 'latency_seconds_sum{command="ping"} 4.25' in text
+
+
+def test_gauge_function_is_read_at_scrape_time():
+    reg = Registry()
+    sizes = {"config": 3}
+    cache = reg.gauge("cache_entries", "Cache entries", ["cache"])
+    cache.set_function(lambda: dict(sizes))
+    assert 'cache_entries{cache="config"} 3' in reg.render()
+    sizes["config"] = 7
+    assert 'cache_entries{cache="config"} 7' in reg.render()
+
+
+def test_label_count_is_checked():
+    reg = Registry()
+    events = reg.counter("events_total", "Events", ["type"])
+    with pytest.raises(ValueError):
+        events.inc()
+
+
+def test_sql_statements_are_timed(tmp_path):
+    from sqlalchemy import create_engine, text
+    from instrumentation import instrument_engine
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'metrics.db'}")
+    instrument_engine(engine)
+    before = db_statement_latency.count("SELECT")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert db_statement_latency.count("SELECT") == before + 1
+
+
+def test_server_serves_registry():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def scrape():
+        server = MetricsServer("127.0.0.1", port)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.status, await response.text()
+        finally:
+            await server.stop()
+
+    status, body = asyncio.run(scrape())
+    assert status == 200
+    assert "# TYPE alfheim_gateway_events_total counter" in body
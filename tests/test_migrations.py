@@ -0,0 +1,129 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, inspect, text
+
+from database import Base, get_schema_version
+from migrations import MigrationContext, latest_version, migration, run_migrations
+
+
+def legacy_engine(tmp_path, xp_type: str = "INTEGER"):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE guild_configs (guild_id BIGINT PRIMARY KEY, language VARCHAR(5))"))
+        conn.execute(text("INSERT INTO guild_configs VALUES (1, 'en')"))
+        conn.execute(text(
+            f"CREATE TABLE user_levels (id INTEGER PRIMARY KEY, guild_id BIGINT, user_id BIGINT, xp {xp_type}, "
+            f"level INTEGER)"
+        ))
+        for i in range(1, 26):
+            conn.execute(text("INSERT INTO user_levels (guild_id, user_id, xp, level) VALUES (1, :u, :xp, 1)"),
+                         {"u": i % 20, "xp": i * 10})
+    return engine
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    engine = legacy_engine(tmp_path)
+    lines = []
+    assert run_migrations(engine, dry_run=True, log=lines.append) == list(range(1, latest_version() + 1))
+    assert any("would add column guild_configs.message_log_retention_days" in line for line in lines)
+    assert any("would create index uq_user_levels_guild_user" in line and "~25 rows" in line for line in lines)
+    with engine.connect() as conn:
+        assert get_schema_version(conn) == 0
+    assert "message_log_retention_days" not in {c["name"] for c in inspect(engine).get_columns("guild_configs")}
+
+
+def test_migrations_apply_in_order_and_once(tmp_path):
+    engine = legacy_engine(tmp_path)
+    assert run_migrations(engine, log=lambda _: None) == list(range(1, latest_version() + 1))
+    assert run_migrations(engine, log=lambda _: None) == []
+    with engine.connect() as conn:
+        assert get_schema_version(conn) == latest_version()
+        row = conn.execute(text("SELECT language, message_log_retention_days FROM guild_configs")).one()
+        # existing guilds keep their logs until they opt in to pruning
+        assert tuple(row) == ("en", 0)
+        # the unique index merged the duplicate (guild, user) rows into the oldest
+        assert conn.execute(text("SELECT COUNT(*) FROM user_levels")).scalar() == 20
+        # users 1-5 had two rows each; their XP is summed, not dropped
+        xp = dict(conn.execute(text("SELECT user_id, xp FROM user_levels")).all())
+        assert xp[1] == 10 + 210 and xp[6] == 60
+        assert sum(xp.values()) == sum(i * 10 for i in range(1, 26))
+    assert "uq_user_levels_guild_user" in {ix["name"] for ix in inspect(engine).get_indexes("user_levels")}
+
+
+def test_rebuild_table_changes_column_type(tmp_path):
+    engine = legacy_engine(tmp_path, xp_type="TEXT")
+    ctx = MigrationContext(engine, log=lambda _: None)
+    ctx.add_missing_columns()
+    ctx.create_model_indexes(["user_levels"])
+    ctx.rebuild_table("user_levels", cast=("xp",))
+    xp_type = {c["name"]: c["type"] for c in inspect(engine).get_columns("user_levels")}["xp"]
+    assert str(xp_type) == "INTEGER"
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT typeof(xp), xp FROM user_levels WHERE id = 1")).one() == ("integer", 220)
+        assert conn.execute(text("SELECT COUNT(*) FROM user_levels")).scalar() == 20
+    assert "uq_user_levels_guild_user" in {ix["name"] for ix in inspect(engine).get_indexes("user_levels")}
+
+
+def test_unique_index_keeps_the_live_balance(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'eco.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE user_economy (id INTEGER PRIMARY KEY, guild_id BIGINT, user_id BIGINT, "
+            "balance INTEGER, bank INTEGER, last_daily DATETIME, last_work DATETIME)"
+        ))
+        # user 1 was created twice; only the first row was ever spent from or paid into
+        conn.execute(text(
+            "INSERT INTO user_economy (guild_id, user_id, balance, bank, last_daily) VALUES "
+            "(1, 1, 250, 40, '2026-01-03 00:00:00'), (1, 2, 7, 0, NULL), (1, 1, 100, 0, NULL), (1, 1, 100, 0, NULL)"
+        ))
+    lines = []
+    MigrationContext(engine, log=lines.append).create_model_indexes(["user_economy"])
+    assert any("Merged 1 duplicate keys in user_economy" in line and "removing 2 rows" in line for line in lines)
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, user_id, balance, bank, last_daily FROM user_economy ORDER BY id"
+        )).all()
+    # no coins minted from the starting balance of the rows that were never used
+    assert [tuple(r) for r in rows] == [(1, 1, 250, 40, "2026-01-03 00:00:00"), (2, 2, 7, 0, None)]
+
+
+def test_unique_index_without_merge_rule_fails(tmp_path):
+    from sqlalchemy import Column, Index, Integer, MetaData, Table
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'plain.db'}")
+    table = Table("tallies", MetaData(), Column("id", Integer, primary_key=True), Column("key", Integer),
+                  Column("count", Integer), Index("uq_tallies_key", "key", unique=True))
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE tallies (id INTEGER PRIMARY KEY, key INTEGER, count INTEGER)"))
+        conn.execute(text("INSERT INTO tallies (key, count) VALUES (1, 3), (1, 4)"))
+    with pytest.raises(RuntimeError, match="no merge rule"):
+        MigrationContext(engine, log=lambda _: None).create_index(next(iter(table.indexes)))
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT SUM(count) FROM tallies")).scalar() == 7
+
+
+def test_backfill_runs_in_chunks(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bf.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for i in range(1, 2501):
+            conn.execute(text("INSERT INTO user_levels (guild_id, user_id, xp, level) VALUES (1, :u, :xp, 1)"),
+                         {"u": i, "xp": i})
+    lines = []
+    ctx = MigrationContext(engine, log=lines.append)
+    updated = ctx.backfill("user_levels", {"level": "level + 1"}, where="xp > :min_xp", params={"min_xp": 500},
+                           batch_size=1000)
+    assert updated == 2000
+    assert "chunk 3/3 (100%)" in lines[-1]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM user_levels WHERE level = 2")).scalar() == 2000
+
+
+def test_duplicate_version_rejected():
+    with pytest.raises(ValueError):
+        migration(1, "clash")(lambda ctx: None)
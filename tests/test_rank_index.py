@@ -0,0 +1,76 @@
+import sys
+import os
+import asyncio
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+import database
+from batch_writer import BatchWriter
+from database import UserLevel
+from rank_index import GuildRanking, RankIndex, SortedList
+from xp_engine import XPEngine
+from tests.harness import temporary_database
+
+
+def test_sorted_list_matches_a_plain_sorted_list():
+    rng = random.Random(3)
+    SortedList.LOAD, load = 8, SortedList.LOAD
+    try:
+        items = SortedList(rng.randrange(500) for _ in range(100))
+        expected = sorted(items)
+        for _ in range(3000):
+            if expected and rng.random() < 0.45:
+                item = rng.choice(expected)
+                items.remove(item)
+                expected.remove(item)
+            else:
+                item = rng.randrange(500)
+                items.add(item)
+                expected.append(item)
+                expected.sort()
+            probe = rng.randrange(500)
+            assert items.bisect_left(probe) == sum(1 for x in expected if x < probe)
+        start = rng.randrange(len(expected))
+        assert list(items) == expected
+        assert items.slice(start, start + 25) == expected[start:start + 25]
+        with pytest.raises(ValueError):
+            items.remove(10_000)
+    finally:
+        SortedList.LOAD = load
+
+
+def test_ranking_uses_competition_ranks():
+    ranking = GuildRanking([(1, 3, 50), (2, 3, 80), (3, 5, 0), (4, 3, 50), (5, None, None)])
+    assert [ranking.rank(u) for u in (3, 2, 1, 4, 5)] == [1, 2, 3, 3, 5]
+    assert ranking.top(0, 3) == [(3, 5, 0), (2, 3, 80), (1, 3, 50)]
+    ranking.update(5, 6, 1)
+    assert ranking.rank(5) == 1 and ranking.rank(3) == 2
+    ranking.remove(3)
+    assert ranking.rank(3) is None and len(ranking) == 4
+    assert ranking.rank_of(1, 0) == 5
+
+
+def test_index_is_built_once_and_follows_xp_gains():
+    async def run():
+        writer = BatchWriter(interval_ms=60_000)
+        engine = XPEngine(writer=writer)
+        index = RankIndex(engine=engine)
+        session = database.SessionLocal()
+        session.add_all([UserLevel(guild_id=1, user_id=u, level=2, xp=u * 10) for u in range(1, 6)])
+        session.commit()
+        session.close()
+
+        state = await engine.get(1, 1)
+        engine.apply(state, xp=5)  # not flushed, and the guild is not indexed yet
+        ranking = await index.guild(1)
+        assert ranking.rank(1) == 5
+        engine.apply(state, level=1)
+        assert ranking.rank(1) == 1
+        assert await index.guild(1) is ranking and index.builds == 1
+        await writer.close()
+
+    with temporary_database():
+        asyncio.run(run())
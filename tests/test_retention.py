@@ -0,0 +1,84 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base, GuildConfig, MessageLog
+from retention import archive_path, prune_all, prune_guild, read_archive
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0)
+
+
+def make_factory():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def add_logs(factory, guild_id, ages_in_days, start_id=1):
+    session = factory()
+    for i, age in enumerate(ages_in_days):
+        session.add(MessageLog(
+            guild_id=guild_id, message_id=start_id + i, channel_id=1, user_id=1,
+            content=f"msg {start_id + i}", created_at=NOW - datetime.timedelta(days=age),
+        ))
+    session.commit()
+    session.close()
+
+
+def remaining(factory, guild_id):
+    session = factory()
+    try:
+        return sorted(r.message_id for r in session.query(MessageLog).filter_by(guild_id=guild_id))
+    finally:
+        session.close()
+
+
+def test_prune_deletes_in_chunks():
+    factory = make_factory()
+    add_logs(factory, 1, [40] * 7 + [1, 2])
+    removed = prune_guild(1, 30, now=NOW, session_factory=factory, batch_size=3, pause=0)
+    assert removed == 7
+    assert remaining(factory, 1) == [8, 9]
+    assert prune_guild(1, 0, now=NOW, session_factory=factory) == 0
+
+
+def test_prune_archives_per_day(tmp_path):
+    factory = make_factory()
+    add_logs(factory, 1, [40, 40, 41, 5])
+    removed = prune_guild(1, 30, archive=True, now=NOW, session_factory=factory,
+                          batch_size=2, archive_dir=str(tmp_path), pause=0)
+    assert removed == 3
+    day40 = read_archive(archive_path(1, (NOW - datetime.timedelta(days=40)).date(), str(tmp_path)))
+    day41 = read_archive(archive_path(1, (NOW - datetime.timedelta(days=41)).date(), str(tmp_path)))
+    assert [r["message_id"] for r in day40] == [1, 2]
+    assert [r["content"] for r in day41] == ["msg 3"]
+    assert remaining(factory, 1) == [4]
+
+
+def test_prune_all_uses_guild_settings(tmp_path):
+    factory = make_factory()
+    session = factory()
+    session.add_all([
+        GuildConfig(guild_id=1, message_log_retention_days=7),
+        GuildConfig(guild_id=2, message_log_retention_days=0),
+        GuildConfig(guild_id=3),
+    ])
+    session.commit()
+    session.close()
+    add_logs(factory, 1, [10, 1], start_id=1)
+    add_logs(factory, 2, [400], start_id=10)
+    add_logs(factory, 3, [31, 29], start_id=20)
+
+    # guild 3 never chose a retention, so its logs are kept
+    assert prune_all(now=NOW, session_factory=factory, archive_dir=str(tmp_path), pause=0) == {1: 1}
+    assert remaining(factory, 1) == [2]
+    assert remaining(factory, 2) == [10]
+    assert remaining(factory, 3) == [20, 21]
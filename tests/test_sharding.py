@@ -0,0 +1,88 @@
+import sys
+import os
+import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base, Reminder, TempBan
+from sharding import ShardMonitor, local_shards, owns_guild, shard_filter, shard_for
+
+
+def guild_on(shard, count, n=1):
+    """A guild id that Discord routes to the given shard."""
+    return ((n * count + shard) << 22) | 12345
+
+
+def make_session():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_shard_for_matches_discord_formula():
+    assert shard_for(guild_on(3, 4), 4) == 3
+    assert shard_for(None, 4) == 0
+
+
+def test_unsharded_bot_owns_everything():
+    bot = SimpleNamespace(shard_count=None, shard_id=None)
+    assert local_shards(bot) == (None, None)
+    assert owns_guild(bot, guild_on(2, 4))
+    session = make_session()
+    now = datetime.datetime(2026, 1, 1)
+    session.add_all([TempBan(guild_id=guild_on(s, 4), user_id=s, unban_time=now) for s in range(4)])
+    session.commit()
+    assert session.query(TempBan).filter(shard_filter(bot, TempBan.guild_id)).count() == 4
+
+
+def test_filter_keeps_only_local_shards():
+    bot = SimpleNamespace(shard_count=4, shard_id=1)
+    session = make_session()
+    now = datetime.datetime(2026, 1, 1)
+    session.add_all([TempBan(guild_id=guild_on(s, 4, n), user_id=s * 10 + n, unban_time=now)
+                     for s in range(4) for n in range(1, 4)])
+    session.commit()
+    rows = session.query(TempBan).filter(shard_filter(bot, TempBan.guild_id)).all()
+    assert len(rows) == 3
+    assert {shard_for(r.guild_id, 4) for r in rows} == {1}
+    assert owns_guild(bot, guild_on(1, 4)) and not owns_guild(bot, guild_on(0, 4))
+
+
+def test_direct_message_rows_belong_to_shard_zero():
+    now = datetime.datetime(2026, 1, 1)
+    session = make_session()
+    session.add_all([
+        Reminder(user_id=1, channel_id=1, guild_id=None, message="dm", remind_at=now),
+        Reminder(user_id=2, channel_id=2, guild_id=guild_on(1, 2), message="guild", remind_at=now),
+    ])
+    session.commit()
+    shard_zero = SimpleNamespace(shard_count=2, shard_id=0)
+    shard_one = SimpleNamespace(shard_count=2, shard_id=1)
+    assert [r.message for r in session.query(Reminder).filter(shard_filter(shard_zero, Reminder.guild_id))] == ["dm"]
+    assert [r.message for r in session.query(Reminder).filter(shard_filter(shard_one, Reminder.guild_id))] == ["guild"]
+
+
+def test_monitor_rate_uses_recent_window():
+    monitor = ShardMonitor(window=10)
+    for second in range(100, 110):
+        monitor.record(2, now=second)
+        monitor.record(2, now=second)
+    assert monitor.totals[2] == 20
+    assert monitor.rate(2, now=109) == 2.0
+    assert monitor.rate(2, now=114) == 1.0
+    assert monitor.rate(5, now=109) == 0.0
+
+
+def test_monitor_attributes_events_by_guild():
+    monitor = ShardMonitor()
+    bot = SimpleNamespace(shard_count=4)
+    message = SimpleNamespace(guild=SimpleNamespace(id=guild_on(3, 4)))
+    monitor.record_event(bot, "message", (message,))
+    monitor.record_event(bot, "shard_ready", (2,))
+    monitor.record_event(bot, "socket_event_type", ("MESSAGE_CREATE",))
+    assert dict(monitor.totals) == {3: 1, 2: 1}
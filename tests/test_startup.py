@@ -0,0 +1,34 @@
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import discover_extensions, load_extensions
+from tests.harness import HarnessBot
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def test_discovery_finds_modules_and_packages():
+    names = discover_extensions(os.path.join(ROOT, "cogs"))
+    assert "cogs.levels" in names
+    assert "cogs.verifications" in names
+    assert names[-1] == "ai.chat"
+    assert not any("__" in name for name in names)
+
+
+def test_every_extension_loads_concurrently():
+    names = discover_extensions(os.path.join(ROOT, "cogs"))
+
+    async def run():
+        bot = HarnessBot()
+        timings = await load_extensions(bot, names + ["cogs.does_not_exist"])
+        loaded = set(bot.extensions)
+        for name in list(bot.extensions):
+            await bot.unload_extension(name)
+        return timings, loaded
+
+    timings, loaded = asyncio.run(run())
+    # a broken extension is logged and skipped, the rest still load
+    assert set(timings) == set(names) == loaded
@@ -0,0 +1,39 @@
+import sys
+import os
+import builtins
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from startup_profile import ImportProfiler
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_profiler_times_nested_imports(tmp_path):
+    (tmp_path / "prof_outer.py").write_text("import time\ntime.sleep(0.02)\nimport prof_inner\n")
+    (tmp_path / "prof_inner.py").write_text("import time\ntime.sleep(0.03)\n")
+    sys.path.insert(0, str(tmp_path))
+    original = builtins.__import__
+    profiler = ImportProfiler()
+    profiler.install()
+    try:
+        __import__("prof_outer")
+    finally:
+        profiler.uninstall()
+        sys.path.remove(str(tmp_path))
+    assert builtins.__import__ is original
+    outer_total, outer_self = profiler.imports["prof_outer"]
+    inner_total, inner_self = profiler.imports["prof_inner"]
+    assert inner_total >= 30 and inner_self == inner_total
+    assert outer_total >= 50 and 20 <= outer_self < outer_total - 25
+    profiler.record("load cogs.levels", 12.5)
+    report = profiler.report(top=5)
+    assert "prof_outer" in report and "load cogs.levels" in report
+
+
+def test_optional_sdks_are_not_imported_without_tokens():
+    env = {k: v for k, v in os.environ.items() if k not in ("GITHUB_TOKEN", "AI_TOKEN")}
+    code = "import sys, main, ai.chat; print('github' in sys.modules, 'openai' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.split()[-2:] == ["False", "False"]
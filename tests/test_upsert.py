@@ -0,0 +1,88 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import (
+    Base, UserEconomy, UserLevel, build_upsert, bulk_upsert, get_or_create, increment, upsert,
+)
+
+
+def make_session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_increment_creates_then_adds():
+    session = make_session()
+    key = {"guild_id": 1, "user_id": 2}
+    increment(session, UserLevel, key, xp=10, level=1)
+    increment(session, UserLevel, key, xp=5)
+    session.commit()
+    row = session.query(UserLevel).filter_by(**key).one()
+    # level starts from its column default (1), xp from 0
+    assert (row.xp, row.level) == (15, 2)
+
+
+def test_increment_treats_null_as_default():
+    session = make_session()
+    session.add(UserLevel(guild_id=1, user_id=2, xp=None, level=None))
+    session.commit()
+    increment(session, UserLevel, {"guild_id": 1, "user_id": 2}, xp=3, level=1)
+    session.commit()
+    row = session.query(UserLevel).one()
+    assert (row.xp, row.level) == (3, 2)
+
+
+def test_bulk_upsert_mixes_inserts_and_updates():
+    session = make_session()
+    upsert(session, UserLevel, {"guild_id": 1, "user_id": 1}, values={"voice_minutes": 7})
+    session.commit()
+    rows = [
+        {"guild_id": 1, "user_id": 1, "total_messages": 2, "voice_minutes": 1},
+        {"guild_id": 1, "user_id": 2, "total_messages": 1, "voice_minutes": 4},
+    ]
+    assert bulk_upsert(session, UserLevel, ("guild_id", "user_id"), rows, ("total_messages",)) == 2
+    session.commit()
+    result = {r.user_id: (r.total_messages, r.voice_minutes) for r in session.query(UserLevel)}
+    assert result == {1: (2, 1), 2: (1, 4)}
+
+
+def test_get_or_create_is_idempotent():
+    session = make_session()
+    row, created = get_or_create(session, UserEconomy, defaults={"balance": 100}, guild_id=1, user_id=2)
+    assert created and row.balance == 100
+    again, created = get_or_create(session, UserEconomy, defaults={"balance": 5}, guild_id=1, user_id=2)
+    assert not created and again.id == row.id and again.balance == 100
+    assert session.query(UserEconomy).count() == 1
+
+
+def test_get_or_create_leaves_the_commit_to_the_caller():
+    session = make_session()
+    session.add(UserLevel(guild_id=1, user_id=9, xp=5))
+    get_or_create(session, UserEconomy, guild_id=1, user_id=2)
+    session.rollback()
+    # neither the unrelated pending row nor the insert was committed behind the caller's back
+    assert session.query(UserLevel).count() == 0
+    assert session.query(UserEconomy).count() == 0
+
+
+def test_build_upsert_per_dialect():
+    pg = str(build_upsert(UserLevel, "postgresql", ("guild_id", "user_id"), (), ("xp",))
+             .compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (guild_id, user_id) DO UPDATE" in pg
+    assert "coalesce(user_levels.xp" in pg
+    my = str(build_upsert(UserLevel, "mysql", ("guild_id", "user_id"), ("voice_minutes",))
+             .compile(dialect=mysql.dialect()))
+    assert "ON DUPLICATE KEY UPDATE voice_minutes" in my
+    ignore = str(build_upsert(UserLevel, "postgresql", ("guild_id", "user_id"))
+                 .compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT DO NOTHING" in ignore
@@ -0,0 +1,142 @@
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database
+from batch_writer import batch_writer
+from cogs.levels import Levels
+from database import LevelConfig, UserLevel
+from voice_sessions import VoiceSessions, voice_sessions
+from tests.harness import FakeGuild, FakeVoiceState, seed, temporary_database
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.values = {}
+
+    def update(self, model, key, increments=None, values=None):
+        self.values[(key["guild_id"], key["user_id"])] = dict(values)
+
+
+def test_only_eligible_time_is_credited_and_the_remainder_carries():
+    now = [0.0]
+    writer = RecordingWriter()
+    sessions = VoiceSessions(writer=writer, clock=lambda: now[0])
+    sessions.update(1, 10, 20)
+    now[0] = 90
+    sessions.update(1, 10, 20, excluded=True)    # muted
+    now[0] = 600
+    sessions.update(1, 10, 21)                   # unmuted in another channel, same session
+    now[0] = 650
+    [credit] = sessions.collect()
+    assert (credit.minutes, credit.channel_id) == (2, 21)
+    assert sessions.get(1, 10).seconds == 20
+    # the checkpoint leaves out the 20 uncredited seconds
+    assert writer.values[(1, 10)]["last_voice_update"].timestamp() == 630
+
+    now[0] = 700
+    sessions.update(1, 10, None)
+    assert len(sessions) == 0
+    [credit] = sessions.collect()
+    assert credit.minutes == 1
+    assert writer.values[(1, 10)] == {"last_voice_update": None}
+    assert sessions.collect() == []
+
+
+def test_excluded_sessions_are_not_checkpointed():
+    now = [0.0]
+    writer = RecordingWriter()
+    sessions = VoiceSessions(writer=writer, clock=lambda: now[0])
+    sessions.update(1, 10, 20, excluded=True)    # joined the AFK channel
+    now[0] = 120
+    assert sessions.collect() == []
+    assert writer.values == {}
+
+    sessions.update(1, 10, 21)
+    now[0] = 180
+    sessions.collect()
+    assert writer.values[(1, 10)]["last_voice_update"] is not None
+    # deafened again: the old checkpoint would resume time that never accrued
+    sessions.update(1, 10, 21, excluded=True)
+    now[0] = 240
+    sessions.collect()
+    assert writer.values[(1, 10)] == {"last_voice_update": None}
+    writer.values.clear()
+    now[0] = 300
+    sessions.collect()
+    sessions.update(1, 10, None)
+    sessions.collect()
+    assert writer.values == {}
+
+
+def test_recent_checkpoints_resume():
+    now = [10_000.0]
+    sessions = VoiceSessions(writer=RecordingWriter(), clock=lambda: now[0], resume_grace=300)
+    sessions.update(1, 10, 20)
+    now[0] += 130
+    sessions.collect()
+    checkpoint = sessions.writer.values[(1, 10)]["last_voice_update"]
+    # the bot restarts 100 seconds later
+    now[0] += 100
+    assert sessions.resume_seconds(checkpoint) == 110
+    now[0] += 1000
+    assert sessions.resume_seconds(checkpoint) == 0
+    assert sessions.resume_seconds(None) == 0
+
+
+def test_voice_events_credit_xp_in_batches_with_exclusions():
+    guild = FakeGuild(1)
+    member = guild.member(10)
+    guild.afk_channel = guild.voice_channel(40)
+    cog = Levels(bot=SimpleNamespace(get_guild=lambda gid: guild if gid == 1 else None))
+    now = [0.0]
+    clock = voice_sessions.clock
+
+    async def move(at, channel_id, **flags):
+        now[0] = at
+        after = FakeVoiceState(guild.voice_channel(channel_id) if channel_id else None)
+        for flag, value in flags.items():
+            setattr(after, flag, value)
+        await cog.on_voice_state_update(member, member.voice or FakeVoiceState(), after)
+        member.voice = after if after.channel else None
+
+    async def run():
+        await move(0, 20)
+        await move(150, 20, self_mute=True)
+        await move(300, 20)
+        await move(330, 30)     # ignored channel
+        await move(400, 40)     # AFK channel
+        now[0] = 500
+        await cog.credit_voice()
+        await batch_writer.flush()
+
+    async def leave():
+        voice_sessions.update(1, 10, None)
+        voice_sessions.collect()
+        await batch_writer.flush()
+
+    with temporary_database():
+        seed(database.SessionLocal, [1])
+        session = database.SessionLocal()
+        session.query(LevelConfig).filter_by(guild_id=1).update({"xp_per_voice_minute": 2, "ignore_channel_ids": [30]})
+        session.commit()
+        session.close()
+        voice_sessions.clock = lambda: now[0]
+        try:
+            asyncio.run(run())
+            session = database.SessionLocal()
+            try:
+                row = session.query(UserLevel).filter_by(guild_id=1, user_id=10).one()
+            finally:
+                session.close()
+        finally:
+            asyncio.run(leave())
+            voice_sessions.clock = clock
+            cog.cog_unload()
+    # 150 s before the mute and 30 s after it: three minutes at 2 XP each
+    assert (row.voice_minutes, row.xp) == (3, 6)
+    # sitting in the AFK channel accrues nothing, so there is no checkpoint to resume
+    assert row.last_voice_update is None
@@ -0,0 +1,97 @@
+import sys
+import os
+import asyncio
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database
+from batch_writer import BatchWriter
+from database import UserLevel
+from xp_engine import XPEngine
+from tests.harness import temporary_database
+
+
+def make_engine(**kwargs):
+    writer = BatchWriter(interval_ms=60_000)
+    return XPEngine(writer=writer, **kwargs), writer
+
+
+def stored(guild_id, user_id):
+    session = database.SessionLocal()
+    try:
+        row = session.query(UserLevel).filter_by(guild_id=guild_id, user_id=user_id).one()
+        return row.level, row.xp, row.total_messages
+    finally:
+        session.close()
+
+
+def test_state_loads_once_and_is_persisted_in_batches():
+    async def run():
+        engine, writer = make_engine()
+        session = database.SessionLocal()
+        session.add(UserLevel(guild_id=1, user_id=2, level=3, xp=40, total_messages=10))
+        session.commit()
+        session.close()
+        writer.update(UserLevel, {"guild_id": 1, "user_id": 2}, increments={"xp": 5})
+
+        first, second = await asyncio.gather(engine.get(1, 2), engine.get(1, 2))
+        assert first is second and engine.loads == 1
+        assert (first.level, first.xp) == (3, 45)
+        for _ in range(100):
+            engine.apply(await engine.get(1, 2), xp=1, total_messages=1)
+        engine.apply(first, xp=-100, level=1)
+        assert engine.loads == 1 and engine.hits == 100
+        assert stored(1, 2) == (3, 40, 10)
+        await writer.flush()
+        assert stored(1, 2) == (first.level, first.xp, first.total_messages) == (4, 45, 110)
+        await writer.close()
+
+    with temporary_database():
+        asyncio.run(run())
+
+
+def test_new_member_starts_at_level_one():
+    async def run():
+        engine, writer = make_engine()
+        state = await engine.get(1, 9)
+        engine.apply(state, xp=7, total_messages=1)
+        await writer.flush()
+        assert stored(1, 9) == (1, 7, 1)
+        await writer.close()
+
+    with temporary_database():
+        asyncio.run(run())
+
+
+def test_idle_and_overflowing_members_are_evicted():
+    async def run():
+        engine, writer = make_engine(max_users=3, idle_seconds=60)
+        for user_id in range(5):
+            await engine.get(1, user_id)
+        assert len(engine) == 3 and engine.peek(1, 0) is None and engine.peek(1, 4) is not None
+        engine.peek(1, 2).touched = time.monotonic() - 120
+        engine.peek(1, 3).touched = time.monotonic() - 120
+        # least recently used order: 2 and 3 are oldest, so the next load sweeps them
+        await engine.get(1, 5)
+        assert sorted(k[1] for k in engine._states) == [4, 5]
+        await writer.close()
+
+    with temporary_database():
+        asyncio.run(run())
+
+
+def test_invalidate_during_load_is_not_cached():
+    async def run():
+        engine, writer = make_engine()
+        loading = asyncio.ensure_future(engine.get(1, 2))
+        await asyncio.sleep(0)
+        engine.invalidate(1)
+        await loading
+        assert engine.peek(1, 2) is None
+        await engine.get(1, 2)
+        assert engine.peek(1, 2) is not None and engine.loads == 2
+        await writer.close()
+
+    with temporary_database():
+        asyncio.run(run())
@@ -0,0 +1,166 @@
+"""
+In-memory voice sessions for voice XP.
+
+Levels used to commit UserLevel.last_voice_update on every join and leave
+and credit the whole session on disconnect, so moves between channels,
+muting and a restart mid-session were all mishandled. Voice state updates
+now only touch this table: each tracked member has a session that accrues
+eligible seconds (not in the AFK channel, an ignored channel, or self-muted
+or deafened; the caller decides). Every VOICE_CREDIT_INTERVAL_S the Levels
+cog calls collect(), which turns whole minutes into credits and carries the
+remainder over. Sessions that ended since the last call are drained too.
+
+collect() also checkpoints every session that is accruing time through
+batch_writer (excluded ones are skipped, so muted or AFK members get no row): it
+stores in last_voice_update the time up to which the member has been
+credited. After a restart, a member who is still in voice and whose
+checkpoint is younger than VOICE_RESUME_GRACE_S gets the gap carried into
+the new session. A crash therefore costs at most the unflushed write-behind
+batch, not the session.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+
+from batch_writer import batch_writer
+from database import SessionLocal, UserLevel
+
+VOICE_CREDIT_INTERVAL_S = int(os.getenv("VOICE_CREDIT_INTERVAL_S", "60"))
+VOICE_RESUME_GRACE_S = int(os.getenv("VOICE_RESUME_GRACE_S", "300"))
+
+
+def _to_datetime(ts: float) -> datetime:
+    # last_voice_update is naive UTC like the other DateTime columns
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def _to_timestamp(dt: datetime) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+class VoiceSession:
+    __slots__ = ("guild_id", "user_id", "channel_id", "excluded", "since", "seconds", "checkpointed")
+
+    def __init__(self, guild_id: int, user_id: int, channel_id: int, excluded: bool, now: float,
+                 seconds: float = 0.0):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.excluded = excluded
+        self.since = now
+        # eligible time not credited yet
+        self.seconds = seconds
+        self.checkpointed = False
+
+    @property
+    def key(self) -> dict:
+        return {"guild_id": self.guild_id, "user_id": self.user_id}
+
+    def settle(self, now: float):
+        if not self.excluded:
+            self.seconds += max(now - self.since, 0.0)
+        self.since = now
+
+
+class VoiceCredit:
+    __slots__ = ("guild_id", "user_id", "channel_id", "minutes")
+
+    def __init__(self, guild_id: int, user_id: int, channel_id: int, minutes: int):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.minutes = minutes
+
+
+class VoiceSessions:
+    def __init__(self, writer=batch_writer, session_factory=SessionLocal, clock=time.time,
+                 resume_grace: int = VOICE_RESUME_GRACE_S):
+        self.writer = writer
+        self.session_factory = session_factory
+        self.clock = clock
+        self.resume_grace = resume_grace
+        self._sessions: dict[tuple, VoiceSession] = {}
+        self._ended: list[VoiceSession] = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def clear(self):
+        """Forget every session, open or ended, without crediting it."""
+        self._sessions.clear()
+        self._ended = []
+
+    def get(self, guild_id: int, user_id: int) -> VoiceSession | None:
+        return self._sessions.get((guild_id, user_id))
+
+    def update(self, guild_id: int, user_id: int, channel_id: int | None, excluded: bool = False,
+               carried_seconds: float = 0.0):
+        """Record a member's current voice state; channel_id None ends the session.
+        carried_seconds seeds a new session, e.g. the gap since a checkpoint.
+        """
+        now = self.clock()
+        key = (guild_id, user_id)
+        session = self._sessions.get(key)
+        if session is not None:
+            session.settle(now)
+        if channel_id is None:
+            if session is not None:
+                del self._sessions[key]
+                self._ended.append(session)
+            return
+        if session is None:
+            self._sessions[key] = VoiceSession(guild_id, user_id, channel_id, excluded, now, carried_seconds)
+            return
+        session.channel_id = channel_id
+        session.excluded = excluded
+
+    def collect(self) -> list[VoiceCredit]:
+        """Whole minutes earned since the last call, and checkpoints for the accruing sessions."""
+        now = self.clock()
+        credits = []
+        for session in self._ended:
+            minutes = int(session.seconds // 60)
+            if minutes:
+                credits.append(VoiceCredit(session.guild_id, session.user_id, session.channel_id, minutes))
+            if session.checkpointed:
+                self.writer.update(UserLevel, session.key, values={"last_voice_update": None})
+        self._ended = []
+        for session in self._sessions.values():
+            session.settle(now)
+            minutes = int(session.seconds // 60)
+            if minutes:
+                session.seconds -= minutes * 60
+                credits.append(VoiceCredit(session.guild_id, session.user_id, session.channel_id, minutes))
+            if session.excluded:
+                # nothing is accruing, so there is nothing to resume; drop a stale
+                # checkpoint rather than creating rows for members who never earn
+                if session.checkpointed:
+                    self.writer.update(UserLevel, session.key, values={"last_voice_update": None})
+                    session.checkpointed = False
+                continue
+            # credited up to now minus the carried remainder
+            self.writer.update(UserLevel, session.key, values={"last_voice_update": _to_datetime(now - session.seconds)})
+            session.checkpointed = True
+        return credits
+
+    def checkpoints(self, guild_id: int) -> dict[int, datetime]:
+        """Checkpoints stored for a guild's members; blocking, run it on the db executor."""
+        session = self.session_factory()
+        try:
+            rows = session.query(UserLevel.user_id, UserLevel.last_voice_update).filter(
+                UserLevel.guild_id == guild_id, UserLevel.last_voice_update.isnot(None)
+            ).all()
+            return {user_id: checkpoint for user_id, checkpoint in rows}
+        finally:
+            session.close()
+
+    def resume_seconds(self, checkpoint: datetime | None) -> float:
+        """Time owed since a checkpoint, if it is recent enough to trust."""
+        if checkpoint is None:
+            return 0.0
+        gap = self.clock() - _to_timestamp(checkpoint)
+        return gap if 0 <= gap <= self.resume_grace else 0.0
+
+
+voice_sessions = VoiceSessions()
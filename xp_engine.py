@@ -0,0 +1,175 @@
+"""
+In-memory level state for active members.
+
+The XP stage used to read a member's UserLevel row on every message that
+passed the cooldown. The engine keeps the level, XP and counters of
+recently active members in memory instead: the first touch loads the row
+(plus any increments still queued in the write-behind writer), and later
+gains are applied to the in-memory state at once and queued as increments
+on batch_writer, which persists them in batches every
+WRITE_BEHIND_INTERVAL_MS. Level checks and level-up announcements therefore
+never wait for the database.
+
+Members idle for XP_ENGINE_IDLE_SECONDS are evicted, least recently used
+first once XP_ENGINE_MAX_USERS is reached; evicting is safe at any time
+because everything applied is already queued. Code that writes UserLevel
+directly must call invalidate() after committing, like config_cache.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from batch_writer import batch_writer
+from database import AsyncSessionLocal, UserLevel
+
+logger = logging.getLogger("alfheim_bot.xp_engine")
+
+XP_ENGINE_MAX_USERS = int(os.getenv("XP_ENGINE_MAX_USERS", "50000"))
+XP_ENGINE_IDLE_SECONDS = int(os.getenv("XP_ENGINE_IDLE_SECONDS", "1800"))
+
+# counters applied as increments; last_message_xp is a plain value
+_COUNTERS = ("xp", "level", "total_messages", "voice_minutes")
+
+
+class LevelState:
+    __slots__ = ("guild_id", "user_id", "level", "xp", "total_messages", "voice_minutes", "last_message_xp", "touched")
+
+    def __init__(self, guild_id: int, user_id: int, level: int = 1, xp: int = 0, total_messages: int = 0,
+                 voice_minutes: int = 0, last_message_xp=None):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.level = level
+        self.xp = xp
+        self.total_messages = total_messages
+        self.voice_minutes = voice_minutes
+        self.last_message_xp = last_message_xp
+        self.touched = time.monotonic()
+
+    @property
+    def key(self) -> dict:
+        return {"guild_id": self.guild_id, "user_id": self.user_id}
+
+
+class XPEngine:
+    def __init__(self, writer=batch_writer, session_factory=AsyncSessionLocal,
+                 max_users: int = XP_ENGINE_MAX_USERS, idle_seconds: int = XP_ENGINE_IDLE_SECONDS):
+        self.writer = writer
+        self.session_factory = session_factory
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self._states: OrderedDict[tuple, LevelState] = OrderedDict()
+        self._loading: dict[tuple, asyncio.Future] = {}
+        # loads in flight when their member was invalidated; their result is not cached
+        self._stale: set[tuple] = set()
+        self._listeners = []
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def peek(self, guild_id: int, user_id: int) -> LevelState | None:
+        return self._states.get((guild_id, user_id))
+
+    def states(self, guild_id: int) -> list[LevelState]:
+        return [state for (gid, _), state in self._states.items() if gid == guild_id]
+
+    def on_change(self, listener):
+        """Call listener(state) after every gain that changes level or XP; usable as a decorator."""
+        self._listeners.append(listener)
+        return listener
+
+    async def get(self, guild_id: int, user_id: int) -> LevelState:
+        """The member's current state, loading it on first touch."""
+        key = (guild_id, user_id)
+        state = self._states.get(key)
+        if state is not None:
+            self.hits += 1
+            state.touched = time.monotonic()
+            self._states.move_to_end(key)
+            return state
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(self._load(key))
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        # shielded so one cancelled caller does not cancel the load for the others
+        return await asyncio.shield(loading)
+
+    async def _load(self, key: tuple) -> LevelState:
+        guild_id, user_id = key
+        self.loads += 1
+        async with self.session_factory() as session:
+            for _ in range(3):
+                # a flush landing during the read would be counted twice or not at all, so read again
+                epoch = self.writer.epoch
+                result = await session.execute(
+                    select(UserLevel).filter_by(guild_id=guild_id, user_id=user_id).limit(1)
+                    .execution_options(populate_existing=True))
+                row = result.scalars().first()
+                if self.writer.epoch == epoch:
+                    break
+        queued = self.writer.pending_increments(UserLevel, guild_id=guild_id, user_id=user_id)
+        state = LevelState(
+            guild_id, user_id,
+            level=(row.level if row and row.level else 1) + queued.get("level", 0),
+            xp=(row.xp if row and row.xp else 0) + queued.get("xp", 0),
+            total_messages=(row.total_messages if row and row.total_messages else 0) + queued.get("total_messages", 0),
+            voice_minutes=(row.voice_minutes if row and row.voice_minutes else 0) + queued.get("voice_minutes", 0),
+            last_message_xp=row.last_message_xp if row else None,
+        )
+        if key in self._stale:
+            self._stale.discard(key)
+            return state
+        self._states[key] = state
+        self._evict()
+        return state
+
+    def apply(self, state: LevelState, xp: int = 0, level: int = 0, total_messages: int = 0,
+              voice_minutes: int = 0, last_message_xp=None):
+        """Apply gains to the in-memory state and queue the same increments for the database."""
+        increments = {}
+        for column, delta in zip(_COUNTERS, (xp, level, total_messages, voice_minutes)):
+            if delta:
+                setattr(state, column, getattr(state, column) + delta)
+                increments[column] = delta
+        values = None
+        if last_message_xp is not None:
+            state.last_message_xp = last_message_xp
+            values = {"last_message_xp": last_message_xp}
+        if increments or values:
+            self.writer.update(UserLevel, state.key, increments=increments, values=values)
+        if xp or level:
+            for listener in self._listeners:
+                listener(state)
+
+    def invalidate(self, guild_id: int | None = None, user_id: int | None = None):
+        """Forget cached state for one member, one guild, or everything."""
+        if guild_id is None:
+            keys = list(self._states) + list(self._loading)
+        elif user_id is None:
+            keys = [k for k in (*self._states, *self._loading) if k[0] == guild_id]
+        else:
+            keys = [(guild_id, user_id)]
+        for key in keys:
+            self._states.pop(key, None)
+            if key in self._loading:
+                self._stale.add(key)
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        # least recently used first, so stop at the first member still active
+        while self._states:
+            key, state = next(iter(self._states.items()))
+            if len(self._states) <= self.max_users and state.touched >= cutoff:
+                break
+            del self._states[key]
+            self.evictions += 1
+
+
+xp_engine = XPEngine()